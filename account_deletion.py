@@ -0,0 +1,207 @@
+from sqlalchemy import delete, func, or_, select, update
+from create_retire_database import AccountDeletion, CalculationRun, Input, User, UserRatings, SessionLocal
+from ratings_summary import adjust_ratings_summary
+from retention import RESULT_MODELS, delete_runs
+import datetime
+import os
+import threading
+import time
+
+# Account deletion. DELETE /users/{user_id} only stamps users.deleted_at (every lookup then treats the
+# user as gone) and queues an account_deletions row; a background worker purges the user's runs,
+# results and inputs ACCOUNT_PURGE_BATCH_RUNS runs per transaction, checks that no row still
+# references the user, and deletes the user row last. Progress is kept on the account_deletions row.
+ACCOUNT_PURGE_WORKER = os.getenv("ACCOUNT_PURGE_WORKER", "1") == "1"
+ACCOUNT_PURGE_BATCH_RUNS = int(os.getenv("ACCOUNT_PURGE_BATCH_RUNS", "50"))
+ACCOUNT_PURGE_PAUSE = float(os.getenv("ACCOUNT_PURGE_PAUSE", "0.05"))  # Seconds between batches, so other work gets the locks
+ACCOUNT_PURGE_POLL_SECONDS = float(os.getenv("ACCOUNT_PURGE_POLL_SECONDS", "30"))
+STALE_CLAIM = datetime.timedelta(minutes=10)  # A claim older than this belonged to a worker that died
+
+DEPENDENT_MODELS = (CalculationRun, Input, UserRatings) + RESULT_MODELS
+
+def _now():
+    return datetime.datetime.now(datetime.UTC)
+
+def request_deletion(session, user):
+    """Mark the user deleted and queue the purge; their ratings leave the community summary now. Caller commits."""
+    user.deleted_at = _now()
+    rating_count, rating_sum = session.query(
+        func.count(UserRatings.star_rating), func.coalesce(func.sum(UserRatings.star_rating), 0)
+    ).filter_by(user_id=user.user_id).one()
+    session.query(UserRatings).filter_by(user_id=user.user_id).delete(synchronize_session=False)
+    adjust_ratings_summary(session, -rating_count, -int(rating_sum))
+    session.merge(AccountDeletion(user_id=user.user_id, status="pending", requested_at=user.deleted_at,
+                                  batches=0, rows_deleted=0, locked_at=None, completed_at=None, last_error=None))
+
+def remaining_rows(session, user_id):
+    """Rows per table that still reference the user (only non-zero counts)"""
+    counts = {}
+    for model in DEPENDENT_MODELS:
+        count = session.execute(select(func.count()).select_from(model).where(model.user_id == user_id)).scalar()
+        if count:
+            counts[model.__tablename__] = count
+    return counts
+
+def _claim(session, user_id):
+    """Mark a queued (or abandoned) purge as ours in its own transaction"""
+    claimed = session.execute(
+        update(AccountDeletion)
+        .where(AccountDeletion.user_id == user_id)
+        .where(or_(
+            AccountDeletion.status.in_(("pending", "failed")),
+            (AccountDeletion.status == "purging") & (AccountDeletion.locked_at < _now() - STALE_CLAIM),
+        ))
+        .values(status="purging", locked_at=_now())
+    ).rowcount == 1
+    session.commit()
+    return claimed
+
+def _record_batch(session, user_id, rows):
+    session.execute(
+        update(AccountDeletion).where(AccountDeletion.user_id == user_id).values(
+            batches=AccountDeletion.batches + 1,
+            rows_deleted=AccountDeletion.rows_deleted + rows,
+            locked_at=_now(),
+        )
+    )
+    session.commit()
+
+def purge_user(session, user_id, batch_runs=ACCOUNT_PURGE_BATCH_RUNS, pause=ACCOUNT_PURGE_PAUSE):
+    """Claim and purge one deleted account; returns its final status (None if claimed elsewhere)"""
+    if not _claim(session, user_id):
+        return None
+    try:
+        while True:
+            run_ids = session.execute(
+                select(CalculationRun.run_id).where(CalculationRun.user_id == user_id)
+                .order_by(CalculationRun.run_id).limit(batch_runs)
+            ).scalars().all()
+            if run_ids:
+                _record_batch(session, user_id, sum(delete_runs(session, run_ids).values()))
+                time.sleep(pause)
+                continue
+
+            # Runs are gone; clear whatever else points at the user, verify, then remove the user itself
+            rows = session.execute(delete(Input).where(Input.user_id == user_id)).rowcount
+            for model in RESULT_MODELS:
+                rows += session.execute(delete(model).where(model.user_id == user_id)).rowcount
+            rating_count, rating_sum = session.execute(
+                select(func.count(UserRatings.star_rating), func.coalesce(func.sum(UserRatings.star_rating), 0))
+                .where(UserRatings.user_id == user_id)
+            ).one()
+            if rating_count:
+                rows += session.execute(delete(UserRatings).where(UserRatings.user_id == user_id)).rowcount
+                adjust_ratings_summary(session, -rating_count, -int(rating_sum))
+
+            leftover = remaining_rows(session, user_id)
+            if leftover.get(CalculationRun.__tablename__):
+                _record_batch(session, user_id, rows)  # A calculation finished after the runs were listed; go round again
+                continue
+            if leftover:
+                raise RuntimeError(f"Rows still reference user {user_id}: {leftover}")
+            session.execute(delete(User).where(User.user_id == user_id, User.deleted_at.is_not(None)))
+            session.execute(
+                update(AccountDeletion).where(AccountDeletion.user_id == user_id).values(
+                    status="done", completed_at=_now(), last_error=None,
+                    batches=AccountDeletion.batches + 1, rows_deleted=AccountDeletion.rows_deleted + rows,
+                )
+            )
+            session.commit()
+            print(f"Account {user_id} purged")
+            return "done"
+    except Exception as e:
+        session.rollback()
+        session.execute(
+            update(AccountDeletion).where(AccountDeletion.user_id == user_id).values(status="failed", last_error=str(e))
+        )
+        session.commit()
+        print(f"Account {user_id} purge failed: {e}")
+        return "failed"
+
+def purge_pending_accounts(limit=20):
+    """Purge up to limit queued accounts, oldest request first; returns {status: count}"""
+    session = SessionLocal()
+    try:
+        user_ids = session.execute(
+            select(AccountDeletion.user_id).where(or_(
+                AccountDeletion.status.in_(("pending", "failed")),
+                (AccountDeletion.status == "purging") & (AccountDeletion.locked_at < _now() - STALE_CLAIM),
+            )).order_by(AccountDeletion.requested_at).limit(limit)
+        ).scalars().all()
+        session.rollback()
+
+        counts = {}
+        for user_id in user_ids:
+            status = purge_user(session, user_id)
+            if status:
+                counts[status] = counts.get(status, 0) + 1
+        return counts
+    finally:
+        session.close()
+
+def deletion_status(session, user_id):
+    """Progress of a user's account deletion, or None if none was requested"""
+    row = session.get(AccountDeletion, user_id)
+    if row is None:
+        return None
+    return {
+        "user_id": row.user_id,
+        "status": row.status,
+        "requested_at": row.requested_at.isoformat() if row.requested_at else None,
+        "completed_at": row.completed_at.isoformat() if row.completed_at else None,
+        "batches": row.batches,
+        "rows_deleted": row.rows_deleted,
+        "remaining": remaining_rows(session, user_id) if row.status != "done" else {},
+        "last_error": row.last_error,
+    }
+
+class AccountPurgeWorker:
+    """Background thread that purges deleted accounts. The delete endpoint wakes it; it also polls,
+    so purges queued by other processes (or left failed) are picked up."""
+
+    def __init__(self, poll_seconds=ACCOUNT_PURGE_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.processed = {}
+        self.last_error = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="account-purge-worker", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def notify(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            try:
+                for status, count in purge_pending_accounts().items():
+                    self.processed[status] = self.processed.get(status, 0) + count
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Account purge worker error: {e}")
+
+    def info(self):
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "processed": dict(self.processed),
+            "last_error": self.last_error,
+        }
+
+account_purge_worker = AccountPurgeWorker()
+
+if __name__ == "__main__":
+    # Purge queued accounts once, e.g. from a cron job when the in-process worker is disabled
+    print(purge_pending_accounts(limit=10000))
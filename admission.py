@@ -0,0 +1,146 @@
+from collections import deque
+from contextlib import contextmanager
+import math
+import os
+import threading
+import time
+
+# Admission control for /calculate-yr-data. A calculation holds a pooled connection for its whole
+# run, so only CALC_MAX_IN_FLIGHT run at once per worker process, leaving the rest of the pool to
+# other endpoints. Up to CALC_MAX_QUEUE more wait (first come, first served) for at most
+# CALC_QUEUE_TIMEOUT seconds, and any one user may have CALC_MAX_PER_USER running or waiting.
+# Everything beyond that is turned away with 429 and a Retry-After estimate.
+CALC_MAX_IN_FLIGHT = int(os.getenv("CALC_MAX_IN_FLIGHT", "4"))
+CALC_MAX_PER_USER = int(os.getenv("CALC_MAX_PER_USER", "1"))
+CALC_MAX_QUEUE = int(os.getenv("CALC_MAX_QUEUE", "16"))
+CALC_QUEUE_TIMEOUT = float(os.getenv("CALC_QUEUE_TIMEOUT", "10"))
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed; carries the reason and a Retry-After hint in seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Global and per-user concurrency limits with a short, bounded FIFO wait queue"""
+
+    def __init__(self, max_in_flight, max_per_user, max_queue, queue_timeout):
+        self.max_in_flight = max_in_flight
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._in_flight = 0
+        self._per_user = {}
+        self._mean_service = 1.0  # Running estimate of seconds per calculation, for Retry-After
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = {"per_user": 0, "queue_full": 0, "queue_timeout": 0}
+        self.max_queue_seen = 0
+
+    def _retry_after(self, position):
+        """Seconds until about position more calculations have finished"""
+        return max(1, math.ceil(self._mean_service * (position + 1) / self.max_in_flight))
+
+    def _reject(self, reason, position):
+        self.rejected[reason] += 1
+        raise AdmissionRejected(reason, self._retry_after(position))
+
+    def acquire(self, user_id, slots=1):
+        """Take a calculation slot for user_id (waiting briefly if needed) or raise AdmissionRejected.
+        A request that runs several engine calculations at once (a batch) takes one slot for each;
+        it still counts once against the per-user limit."""
+        slots = min(slots, self.max_in_flight)
+        with self._cond:
+            if self._per_user.get(user_id, 0) >= self.max_per_user:
+                self._reject("per_user", len(self._waiting))
+            if self._in_flight + slots <= self.max_in_flight and not self._waiting:
+                self._admit(user_id, slots)
+                return
+            if len(self._waiting) >= self.max_queue:
+                self._reject("queue_full", len(self._waiting))
+
+            ticket = object()
+            self._waiting.append(ticket)
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+            self.queued += 1
+            self.max_queue_seen = max(self.max_queue_seen, len(self._waiting))
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while not (self._waiting[0] is ticket and self._in_flight + slots <= self.max_in_flight):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject("queue_timeout", len(self._waiting))
+                    self._cond.wait(remaining)
+            except AdmissionRejected:
+                self._waiting.remove(ticket)
+                self._release_user(user_id)
+                self._cond.notify_all()
+                raise
+            self._waiting.popleft()
+            self._release_user(user_id)
+            self._admit(user_id, slots)
+            self._cond.notify_all()  # The next waiter may also fit
+
+    def try_acquire(self, user_id, slots=1):
+        """Take slots only if they are free right now and nobody is queued; True if taken. For
+        background work that should yield to requests: it never waits and is not held to the
+        per-user limit. Give the slots back with release()."""
+        slots = min(slots, self.max_in_flight)
+        with self._cond:
+            if self._in_flight + slots > self.max_in_flight or self._waiting:
+                return False
+            self._admit(user_id, slots)
+            return True
+
+    def _admit(self, user_id, slots=1):
+        self._in_flight += slots
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        self.admitted += 1
+
+    def _release_user(self, user_id):
+        remaining = self._per_user[user_id] - 1
+        if remaining:
+            self._per_user[user_id] = remaining
+        else:
+            del self._per_user[user_id]
+
+    def release(self, user_id, elapsed=None, slots=1):
+        """Give back the slots taken by acquire(); elapsed (seconds) refines the Retry-After estimate"""
+        slots = min(slots, self.max_in_flight)
+        with self._cond:
+            self._in_flight -= slots
+            self._release_user(user_id)
+            if elapsed is not None:
+                self._mean_service = 0.8 * self._mean_service + 0.2 * elapsed
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, user_id):
+        """acquire() for the duration of a with block, recording how long it ran"""
+        self.acquire(user_id)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(user_id, time.monotonic() - started)
+
+    def info(self):
+        with self._cond:
+            return {
+                "in_flight": self._in_flight,
+                "queue_length": len(self._waiting),
+                "max_in_flight": self.max_in_flight,
+                "max_per_user": self.max_per_user,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": dict(self.rejected),
+                "max_queue_seen": self.max_queue_seen,
+                "mean_service_seconds": round(self._mean_service, 3),
+            }
+
+calculation_admission = AdmissionController(CALC_MAX_IN_FLIGHT, CALC_MAX_PER_USER, CALC_MAX_QUEUE, CALC_QUEUE_TIMEOUT)
@@ -0,0 +1,153 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, date, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from create_retire_database import DB_URL, SessionLocal, is_memory_url
+from calc_roth_conv_data import compute_retire_and_conversions, plan_from_records
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+# Batch evaluation for advisors: many client profiles in one request, run on the engine core without
+# creating users or storing runs. BATCH_WORKERS profiles are evaluated at a time and each result is
+# yielded as an NDJSON line as soon as it is ready, so memory stays bounded by the worker count
+# rather than the batch size.
+# The engine is CPU-bound Decimal/NumPy code that holds the GIL, so profiles run in a pool of
+# BATCH_WORKERS processes (spawned, each with its own database engine) shared by every batch in this
+# worker. An in-memory SQLite database can't be reached from other processes, so there they run on
+# threads. A batch holds one admission slot per profile it runs at once (see main.batch_calculate).
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "2"))
+BATCH_MAX_PROFILES = int(os.getenv("BATCH_MAX_PROFILES", "500"))
+BATCH_PROCESSES = os.getenv("BATCH_PROCESSES", "1") == "1" and not is_memory_url(DB_URL)
+
+# Same fields /roth_conversions/{run_id} returns, minus the run and user ids
+CONVERSION_SUMMARY_FIELDS = (
+    "conv_group_num", "tax_rate_bucket", "conv_amt", "conv_tax", "conv_tax_rate",
+    "dist_mtr_pre_conv", "dist_mtr_post_conv", "conv_dist_tax", "conv_dist_tax_rate",
+    "distributions_total_pre_conv", "distributions_total_post_conv", "total_after_tax_dist_chg_amt",
+    "conv_return_multiple", "conv_irr", "conv_duration", "synthetic_roth_cont", "tax_rate_arb_amt",
+)
+
+def _decimal(value):
+    return Decimal(str(value)) if value is not None else None
+
+def plan_from_profile(profile):
+    """Engine plan for one batch profile dict, with the defaults a stored calculation applies"""
+    user = SimpleNamespace(
+        birth_date=date.fromisoformat(profile["birth_date"]),
+        trad_savings=_decimal(profile["trad_savings"]),
+        roth_savings=_decimal(profile["roth_savings"]),
+    )
+    inputs = SimpleNamespace(
+        soc_sec_benefit=_decimal(profile.get("soc_sec_benefit")),
+        dist_return_assum=_decimal(profile.get("dist_return_assum")),
+        soc_sec_grw_assum=_decimal(profile.get("soc_sec_grw_assum")),
+        distribution_status=profile.get("distribution_status"),
+        inflation_assum=_decimal(profile.get("inflation_assum")),
+        life_years=profile.get("life_years"),
+    )
+    return plan_from_records(inputs, user)
+
+def evaluate_profile(index, profile, run_date):
+    """Conversion summary for one profile (an error line instead if the engine rejects it)"""
+    line = {"index": index, "client_ref": profile.get("client_ref")}
+    session = SessionLocal()
+    try:
+        computed = compute_retire_and_conversions(session, plan_from_profile(profile), run_date)
+        line.update({
+            "status": "ok",
+            "distribution": float(computed["distribution"]),
+            "annuity_factor_multiple": float(computed["annuity_factor_multiple"]),
+            "base_duration": float(computed["base_duration"]),
+            "conversions": [
+                {field: float(c[field]) if field != "conv_group_num" else c[field] for field in CONVERSION_SUMMARY_FIELDS}
+                for c in computed["conversions"]
+            ],
+        })
+    except Exception as e:
+        line.update({"status": "error", "error": str(e)})
+    finally:
+        session.close()
+    return line
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def batch_pool():
+    """The shared engine pool, started on first use (and restarted if a process died)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if BATCH_PROCESSES:
+                _pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                _pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch-calc")
+        return _pool
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_batch_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def stream_batch(profiles, workers=BATCH_WORKERS, on_close=None):
+    """NDJSON lines, one per profile in completion order, then a summary line"""
+    run_date = datetime.now(timezone.utc)
+    started = time.monotonic()
+    succeeded = failed = 0
+    pending = {}  # future -> (index, profile, pool it runs on)
+    remaining = iter(enumerate(profiles))
+    try:
+        while True:
+            # Keep at most `workers` profiles queued or running
+            for index, profile in remaining:
+                pool = batch_pool()
+                try:
+                    future = pool.submit(evaluate_profile, index, profile, run_date)
+                except BrokenProcessPool:
+                    _discard_pool(pool)
+                    future = batch_pool().submit(evaluate_profile, index, profile, run_date)
+                    pool = batch_pool()
+                pending[future] = (index, profile, pool)
+                if len(pending) >= workers:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, profile, pool = pending.pop(future)
+                try:
+                    line = future.result()
+                except Exception as e:
+                    # The process running it died (BrokenProcessPool); later profiles get a new pool
+                    if isinstance(e, BrokenProcessPool):
+                        _discard_pool(pool)
+                    line = {"index": index, "client_ref": profile.get("client_ref"), "status": "error",
+                            "error": f"{type(e).__name__}: {e}"}
+                if line["status"] == "ok":
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield json.dumps(line) + "\n"
+        yield json.dumps({"summary": {
+            "profiles": succeeded + failed,
+            "succeeded": succeeded,
+            "failed": failed,
+            "elapsed_seconds": round(time.monotonic() - started, 3),
+        }}) + "\n"
+    finally:
+        for future in pending:
+            future.cancel()  # Client went away: don't start profiles nobody will read
+        if on_close:
+            on_close()
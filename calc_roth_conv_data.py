@@ -1,9 +1,13 @@
 from sqlalchemy.orm import sessionmaker
-from create_retire_database import engine, RetireYrData, User, Input, CalculationRun, SSProvisionalIncomeBrackets, StandardDeductions, TaxBrackets, RothConversions, RothConversionsParts, UserRatings
+from create_retire_database import engine, RetireYrData, RetireYrSeries, User, Input, CalculationRun, StandardDeductions, TaxBrackets, RothConversions, RothConversionsParts
+from hot_queries import active_user, latest_input
+from ratings_summary import read_ratings_summary
+from retire_yr_series import build_series_rows, writes_rows, writes_series
+from single_flight import calculation_flights
+from tax_schedule import compile_tax_schedule, get_projected_schedule, get_run_year_tables, get_tax_table_version
 from datetime import datetime, date, timezone
 from decimal import Decimal
-from sqlalchemy import func
-import numpy_financial as npf
+from sqlalchemy import func, insert, update
 import decimal
 import math
 import sys
@@ -19,26 +23,13 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 def get_ratings_summary(user_id):
-      Session = sessionmaker(bind=engine)
-      session = Session()
-      try:
-          result = session.query(
-              func.avg(UserRatings.star_rating).label('avg_rating'),
-              func.count(UserRatings.star_rating).label('total_count')
-          ).first()
-
-          user_rating = session.query(UserRatings.star_rating)\
-              .filter_by(user_id=user_id)\
-              .order_by(UserRatings.rating_timestamp.desc())\
-              .first()
-
-          return {
-              "averageRating": round(float(result.avg_rating or 0), 1),
-              "totalRatings": result.total_count,
-              "userCurrentRating": user_rating.star_rating if user_rating else None
-          }
-      finally:
-          session.close()
+    """Same summary the /ratings/summary endpoint serves"""
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        return read_ratings_summary(session, user_id)
+    finally:
+        session.close()
 
 def annuity_factor(interest_rate, years):
     """Returns annuity factor for converting savings to constant annual distribution"""
@@ -80,6 +71,10 @@ def get_standard_deduction_for_year(session, year, filing_status, inflation_assu
         StandardDeductions.filing_status == filing_status,
         StandardDeductions.year <= year
     ).order_by(StandardDeductions.year.desc()).first()
+    return project_standard_deduction(latest_deduction, year, filing_status, inflation_assum)
+
+def project_standard_deduction(latest_deduction, year, filing_status, inflation_assum):
+    """Inflation adjusts the latest deduction row at or before year to year"""
     if not latest_deduction:
         raise ValueError(f"No standard deduction found for filing_status={filing_status}")
     
@@ -103,6 +98,14 @@ def get_tax_brackets_for_year(session, year, filing_status, inflation_assum):
     
     latest_year = latest_brackets[0].year
     latest_yr_brackets = [b for b in latest_brackets if b.year == latest_year]
+    return project_tax_brackets(latest_yr_brackets, year, inflation_assum)
+
+def project_tax_brackets(latest_yr_brackets, year, inflation_assum):
+    """Inflation adjusts the brackets of the latest year at or before year (rate ascending) to year"""
+    if not latest_yr_brackets:
+        return []
+    
+    latest_year = latest_yr_brackets[0].year
     if latest_year == year:
         return latest_yr_brackets
     
@@ -120,56 +123,19 @@ def get_tax_brackets_for_year(session, year, filing_status, inflation_assum):
 
 def calculate_federal_taxes(tax_brackets, taxable_income, taxable_income_opt):
     """Calculate federal tax for both regular and optimized taxable income"""
-    fed_tax = Decimal('0')
-    fed_tax_opt = Decimal('0')
-    prev_max = Decimal('0')
-    
-    for bracket in tax_brackets:
-        if taxable_income <= (bracket.income_max or taxable_income):
-            fed_tax += (taxable_income - prev_max) * bracket.tax_rate
-            income_done = True
-        else:
-            fed_tax += (bracket.income_max - prev_max) * bracket.tax_rate
-            income_done = False
-        if taxable_income_opt <= (bracket.income_max or taxable_income_opt):
-            fed_tax_opt += (taxable_income_opt - prev_max) * bracket.tax_rate
-            income_opt_done = True
-        else:
-            fed_tax_opt += (bracket.income_max - prev_max) * bracket.tax_rate
-            income_opt_done = False
-            
-        prev_max = bracket.income_max
-        if income_done and income_opt_done:
-            break
-    return fed_tax, fed_tax_opt
+    schedule = compile_tax_schedule(tax_brackets)
+    return schedule.tax(taxable_income), schedule.tax(taxable_income_opt)
 
 def get_mtr(tax_brackets, taxable_income):
     """Get marginal tax rate for next dollar of income"""
-    if taxable_income <= 0:
-        return Decimal('0')
-    for bracket in tax_brackets:
-        if (taxable_income + 1) <= (bracket.income_max or taxable_income + 1):
-            return bracket.tax_rate
-    return Decimal('0')
+    return compile_tax_schedule(tax_brackets).marginal_rate(taxable_income)
 
 def calculate_conversion_tax(conv_amt, tax_brackets, std_deduction):
     """Calculate tax on conversion amount"""
     taxable_amt = conv_amt - std_deduction
     if taxable_amt <= 0:
         return Decimal('0')
-    
-    conv_tax = Decimal('0')
-    prev_max = Decimal('0')
-    for tax_bracket in tax_brackets:
-        if taxable_amt <= (tax_bracket.income_max or taxable_amt):
-            taxable_in_bracket = taxable_amt - prev_max
-            conv_tax += taxable_in_bracket * tax_bracket.tax_rate
-            break
-        else:
-            taxable_in_bracket = tax_bracket.income_max - prev_max
-            conv_tax += taxable_in_bracket * tax_bracket.tax_rate
-            prev_max = tax_bracket.income_max
-    return conv_tax
+    return compile_tax_schedule(tax_brackets).tax(taxable_amt)
 
 def calc_base_duration(interest_rate, years):
     """Present value of annuity formula.  Returns:  Duration of annuity"""
@@ -181,522 +147,624 @@ def calc_base_duration(interest_rate, years):
     base_duration = Decimal('0.00000000') if multiple <= 0 else Decimal(str(min(round(math.log(float(multiple)) / math.log(float(interest_rate) + 1), 8), 99.99999999)))
     return base_duration
 
-def calc_retire_and_conversions(user_id):
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    
-    try:
-        input_record = session.query(Input).filter_by(user_id=user_id).order_by(Input.input_timestamp.desc()).first()
-        if not input_record:
-            raise ValueError(f"No input record found for user_id={user_id}")
-        
-        user = session.query(User).filter_by(user_id=user_id).first()
-        if not user:
-            raise ValueError(f"No user found for user_id={user_id}")
-        
-        # Create new calculation run for this analysis
-        calc_run = CalculationRun(
-            user_id=user_id,
-            run_timestamp=datetime.now(timezone.utc)
-        )
-        session.add(calc_run)
-        session.commit()
-        session.refresh(calc_run)
+def plan_from_records(input_record, user):
+    """Engine inputs for one user, with the same defaults the calculation has always applied"""
+    return {
+        "birth_date": user.birth_date,
+        "trad_savings": user.trad_savings,
+        "roth_savings": user.roth_savings,
+        "soc_sec_benefit": input_record.soc_sec_benefit or Decimal('24000.00'),
+        "dist_return_assum": input_record.dist_return_assum or Decimal('0.05'),
+        "soc_sec_grw_assum": input_record.soc_sec_grw_assum or Decimal('0.015'),
+        "distribution_status": input_record.distribution_status or 'S',
+        "inflation_assum": input_record.inflation_assum or Decimal('0.015'),
+        "life_years": input_record.life_years or 30,
+    }
 
-        # Update user's calculation count based on actual runs
-        user.calc_count = session.query(func.count(CalculationRun.run_id)).filter_by(user_id=user_id).scalar()
-        session.commit()
+def compute_retire_and_conversions(session, plan, run_date, on_progress=None):
+    """Runs the engine for one plan. Reads tax tables through session but writes nothing;
+    records and conversion rows come back without run_id/user_id for the caller to stamp.
+    on_progress(kind, data) is called as pieces finish (see replay_progress for the kinds)."""
+    import numpy_financial as npf  # Pulls in NumPy; loaded on the first calculation, not at app import
+    run_year = run_date.year
+    retirement_age = 62
 
-        run_date = calc_run.run_timestamp
-        run_year = run_date.year
-        retirement_age = 62
-        
-        #current_age = run_year - user.birth_date.year - (1 if (run_date.month, run_date.day) < (user.birth_date.month, user.birth_date.day) else 0)
-        current_age = run_year - user.birth_date.year
-        user_actual_age = current_age
-        if current_age < retirement_age:
-            user_actual_age = current_age + (retirement_age - current_age)
-        start_year = run_year + (retirement_age - current_age)
-        if start_year <= run_year:
-            start_year = run_year + 1
-            user_actual_age += 1  # added 12/12/2025
-        
-        initial_ss_benefit = input_record.soc_sec_benefit or Decimal('24000.00')
-        dist_return_assum = input_record.dist_return_assum or Decimal('0.05')
-        ss_growth_rate = input_record.soc_sec_grw_assum or Decimal('0.015')
-        distribution_status = input_record.distribution_status or 'S'
-        inflation_assum = input_record.inflation_assum or Decimal('0.015')
-        life_years = input_record.life_years or 30
-        
-        # Get tax data
-        std_deduction = session.query(StandardDeductions).filter_by(
-            filing_status=distribution_status
-        ).filter(
-            StandardDeductions.year <= run_year
-        ).order_by(StandardDeductions.year.desc()).first()
-        
-        if not std_deduction:
-            raise ValueError(f"No standard deduction found for filing_status={distribution_status}")
-
-        tax_brackets = session.query(TaxBrackets).filter_by(
-            year=run_year, filing_status=distribution_status
-        ).order_by(TaxBrackets.tax_rate.asc()).all()
-        if not tax_brackets:
-            raise ValueError(f"No tax brackets found for year={run_year} and filing_status={distribution_status}")
-        
-        # Calculate base duration for conversion metrics
-        base_duration = calc_base_duration(dist_return_assum, life_years)
-        logger.info(f"base_duration={base_duration}, trad_savings={user.trad_savings}, soc_sec_benefit={initial_ss_benefit}, dist_return={dist_return_assum}, years={life_years}")
-        
-        # Delete existing records
-        delete_retire = session.query(RetireYrData).filter_by(user_id=user_id).delete()
-        delete_conv = session.query(RothConversions).filter_by(user_id=user_id).delete()
-        delete_parts = session.query(RothConversionsParts).filter_by(user_id=user_id).delete()
-        session.commit()
-        logger.info(f"Deleted {delete_retire} retire_yr_data, {delete_conv} roth_conversions, {delete_parts} roth_conversions_parts records")
-        
-        logger.info(f"Initial trad_savings=${user.trad_savings:,.2f}, roth_savings=${user.roth_savings:,.2f}")
-        
-        # Adjust savings to end of run year if needed
-        years_to_start_year = start_year - run_year -1
-        if years_to_start_year > 0:
-            initial_trad_savings = user.trad_savings * (Decimal('1') + dist_return_assum) ** years_to_start_year
-            initial_roth_savings = user.roth_savings * (Decimal('1') + dist_return_assum) ** years_to_start_year
-            std_ded_adjusted = std_deduction.std_ded * (Decimal('1') + inflation_assum) ** years_to_start_year # added 12/12/2025
-            tax_brackets_adjusted = []                                 # added 12/12/2025
-            for bracket in tax_brackets:                               # added 12/12/2025
-                adjusted_bracket_max = bracket.income_max * (Decimal('1') + inflation_assum) ** years_to_start_year if bracket.income_max else None  # added 12/12/2025
-                # Create a copy of the bracket with adjusted max
-                tax_brackets_adjusted.append(type('obj', (object,), {  # added 12/12/2025
-                    'tax_rate': bracket.tax_rate,                      # added 12/12/2025
-                    'income_max': adjusted_bracket_max                 # added 12/12/2025
-                    })())                                              # added 12/12/2025
-        else:
-            initial_trad_savings = user.trad_savings
-            initial_roth_savings = user.roth_savings
-            std_ded_adjusted = std_deduction.std_ded                   # added 12/12/2025
-            tax_brackets_adjusted = tax_brackets                       # added 12/12/2025
-        
-        # Storage for all records and conversion data
-        all_retire_records = []
-        all_conversions = []
-        all_parts_conversions = []
-        
-        # Storage for conversion calculations
-        mtr_map = {}
-        dist_map = {}
-        fed_tax_map = {}
-        trad_dist_opt_map = {}
-        tax_map = {0: Decimal('0')}
-        amt_map = {0: Decimal('0')}
-        
-        # Define conversion groups
-        conversion_groups = []
-        
-        # Group 0: Baseline
-        conversion_groups.append({
-            'conv_group_num': 0,
-            'trad_savings': initial_trad_savings,
-            'roth_savings': initial_roth_savings,
-            'description': 'Baseline'
-        })
-        
-        # Group 1: Standard deduction
+    #current_age = run_year - user.birth_date.year - (1 if (run_date.month, run_date.day) < (user.birth_date.month, user.birth_date.day) else 0)
+    current_age = run_year - plan["birth_date"].year
+    user_actual_age = current_age
+    if current_age < retirement_age:
+        user_actual_age = current_age + (retirement_age - current_age)
+    start_year = run_year + (retirement_age - current_age)
+    if start_year <= run_year:
+        start_year = run_year + 1
+        user_actual_age += 1  # added 12/12/2025
+
+    initial_ss_benefit = plan["soc_sec_benefit"]
+    dist_return_assum = plan["dist_return_assum"]
+    ss_growth_rate = plan["soc_sec_grw_assum"]
+    distribution_status = plan["distribution_status"]
+    inflation_assum = plan["inflation_assum"]
+    life_years = plan["life_years"]
+
+    # Get tax data
+    std_deduction, tax_brackets = get_run_year_tables(session, run_year, distribution_status)
+
+    if not std_deduction:
+        raise ValueError(f"No standard deduction found for filing_status={distribution_status}")
+
+    if not tax_brackets:
+        raise ValueError(f"No tax brackets found for year={run_year} and filing_status={distribution_status}")
+    compiled_tax_brackets = compile_tax_schedule(tax_brackets)
+    tax_table_version = get_tax_table_version(session)
+
+    # Calculate base duration for conversion metrics
+    base_duration = calc_base_duration(dist_return_assum, life_years)
+    logger.info(f"base_duration={base_duration}, trad_savings={plan['trad_savings']}, soc_sec_benefit={initial_ss_benefit}, dist_return={dist_return_assum}, years={life_years}")
+
+    logger.info(f"Initial trad_savings=${plan['trad_savings']:,.2f}, roth_savings=${plan['roth_savings']:,.2f}")
+
+    # Adjust savings to end of run year if needed
+    years_to_start_year = start_year - run_year -1
+    if years_to_start_year > 0:
+        initial_trad_savings = plan["trad_savings"] * (Decimal('1') + dist_return_assum) ** years_to_start_year
+        initial_roth_savings = plan["roth_savings"] * (Decimal('1') + dist_return_assum) ** years_to_start_year
+        std_ded_adjusted = std_deduction.std_ded * (Decimal('1') + inflation_assum) ** years_to_start_year # added 12/12/2025
+        tax_brackets_adjusted = []                                 # added 12/12/2025
+        for bracket in tax_brackets:                               # added 12/12/2025
+            adjusted_bracket_max = bracket.income_max * (Decimal('1') + inflation_assum) ** years_to_start_year if bracket.income_max else None  # added 12/12/2025
+            # Create a copy of the bracket with adjusted max
+            tax_brackets_adjusted.append(type('obj', (object,), {  # added 12/12/2025
+                'tax_rate': bracket.tax_rate,                      # added 12/12/2025
+                'income_max': adjusted_bracket_max                 # added 12/12/2025
+                })())                                              # added 12/12/2025
+    else:
+        initial_trad_savings = plan["trad_savings"]
+        initial_roth_savings = plan["roth_savings"]
+        std_ded_adjusted = std_deduction.std_ded                   # added 12/12/2025
+        tax_brackets_adjusted = tax_brackets                       # added 12/12/2025
+
+    # Storage for all records and conversion data
+    all_retire_records = []
+    all_conversions = []
+    all_parts_conversions = []
+
+    # Storage for conversion calculations
+    mtr_map = {}
+    dist_map = {}
+    fed_tax_map = {}
+    trad_dist_opt_map = {}
+    tax_map = {0: Decimal('0')}
+    amt_map = {0: Decimal('0')}
+
+    # Define conversion groups
+    conversion_groups = []
+
+    # Group 0: Baseline
+    conversion_groups.append({
+        'conv_group_num': 0,
+        'trad_savings': initial_trad_savings,
+        'roth_savings': initial_roth_savings,
+        'description': 'Baseline'
+    })
+
+    # Group 1: Standard deduction
+    conversion_groups.append({
+        'conv_group_num': 1,
+        'trad_savings': initial_trad_savings - std_ded_adjusted,  # added 12/12/2025
+        'roth_savings': initial_roth_savings + std_ded_adjusted,  # added 12/12/2025
+        #'trad_savings': initial_trad_savings - std_deduction.std_ded,
+        #'roth_savings': initial_roth_savings + std_deduction.std_ded,
+        'description': 'Standard deduction'
+    })
+
+    # Groups 2+: Tax bracket conversions (only if trad_savings >= std_ded)
+    trad_savings = plan["trad_savings"]  # Probably can delete 12/12/2025
+    roth_savings = plan["roth_savings"]  # Probably can delete 12/12/2025
+    conv_group = 2
+    breaking_bracket = None
+
+    if initial_trad_savings > std_ded_adjusted:  # modified 12/12/2025
+        #for bracket in tax_brackets[:-1]:
+        #    if bracket.income_max is not None and trad_savings > (std_deduction.std_ded + bracket.income_max):
+        for bracket_adjusted in tax_brackets_adjusted[:-1]:
+            if bracket_adjusted.income_max is not None and initial_trad_savings > (std_ded_adjusted + bracket_adjusted.income_max):
+                conversion_groups.append({
+                    'conv_group_num': conv_group,
+                    #'trad_savings': initial_trad_savings - (std_deduction.std_ded + bracket.income_max),
+                    #'roth_savings': initial_roth_savings + (std_deduction.std_ded + bracket.income_max),
+                    #'description': f'Fill {bracket.tax_rate:.1%} bracket'
+                    'trad_savings': initial_trad_savings - (std_ded_adjusted + bracket_adjusted.income_max),
+                    'roth_savings': initial_roth_savings + (std_ded_adjusted + bracket_adjusted.income_max),
+                    'description': f'Fill {bracket_adjusted.tax_rate:.1%} bracket'
+                })
+                conv_group += 1
+            else:
+                breaking_bracket = bracket_adjusted
+                break
+
+        # Final group: Full conversion
         conversion_groups.append({
-            'conv_group_num': 1,
-            'trad_savings': initial_trad_savings - std_ded_adjusted,  # added 12/12/2025
-            'roth_savings': initial_roth_savings + std_ded_adjusted,  # added 12/12/2025
-            #'trad_savings': initial_trad_savings - std_deduction.std_ded,
-            #'roth_savings': initial_roth_savings + std_deduction.std_ded,
-            'description': 'Standard deduction'
+            'conv_group_num': conv_group,
+            'trad_savings': Decimal('0'),
+            'roth_savings': initial_roth_savings + initial_trad_savings,
+            'description': 'Full conversion'
         })
-        
-        # Groups 2+: Tax bracket conversions (only if trad_savings >= std_ded)
-        trad_savings = user.trad_savings  # Probably can delete 12/12/2025
-        roth_savings = user.roth_savings  # Probably can delete 12/12/2025
-        conv_group = 2
-        breaking_bracket = None
-        
-        if initial_trad_savings > std_ded_adjusted:  # modified 12/12/2025
-            #for bracket in tax_brackets[:-1]:
-            #    if bracket.income_max is not None and trad_savings > (std_deduction.std_ded + bracket.income_max):
-            for bracket_adjusted in tax_brackets_adjusted[:-1]:
-                if bracket_adjusted.income_max is not None and initial_trad_savings > (std_ded_adjusted + bracket_adjusted.income_max):
-                    conversion_groups.append({
-                        'conv_group_num': conv_group,
-                        #'trad_savings': initial_trad_savings - (std_deduction.std_ded + bracket.income_max),
-                        #'roth_savings': initial_roth_savings + (std_deduction.std_ded + bracket.income_max),
-                        #'description': f'Fill {bracket.tax_rate:.1%} bracket'
-                        'trad_savings': initial_trad_savings - (std_ded_adjusted + bracket_adjusted.income_max),
-                        'roth_savings': initial_roth_savings + (std_ded_adjusted + bracket_adjusted.income_max),
-                        'description': f'Fill {bracket_adjusted.tax_rate:.1%} bracket'
-                    })
-                    conv_group += 1
-                else:
-                    breaking_bracket = bracket_adjusted
-                    break
-        
-            # Final group: Full conversion
-            conversion_groups.append({
-                'conv_group_num': conv_group,
-                'trad_savings': Decimal('0'),
-                'roth_savings': initial_roth_savings + initial_trad_savings,
-                'description': 'Full conversion'
-            })
-        
-        # Process each conversion group
-        for group_info in conversion_groups:
-            conv_group_num = group_info['conv_group_num']
-            group_trad_savings = group_info['trad_savings']
-            group_roth_savings = group_info['roth_savings']
-            
-            # Calculate distributions
-            af = annuity_factor(dist_return_assum, life_years)
-            trad_dist = calc_constant_distribution(group_trad_savings, af)
-            roth_dist_opt = calc_constant_distribution(group_roth_savings, af)
-            trad_dist_opt = calc_constant_distribution(group_trad_savings, af)
-            
-            # Create retirement year records for this group
-            group_records = []
-            group_dists = []
-            
-            current_year = date(start_year, 12, 31)
-            current_age = user_actual_age
-            current_ss_benefit = initial_ss_benefit
-            current_trad_savings = group_trad_savings * (Decimal('1') + dist_return_assum) - trad_dist
-            roth_savings_opt = group_roth_savings * (Decimal('1') + dist_return_assum) - roth_dist_opt
-            trad_savings_opt = group_trad_savings * (Decimal('1') + dist_return_assum) - trad_dist_opt
-            
-            for year_offset in range(life_years):
-                if year_offset > 0:
-                    current_year = date(start_year + year_offset, 12, 31)
-                    current_age = user_actual_age + year_offset
-                    current_ss_benefit = initial_ss_benefit * (Decimal('1') + ss_growth_rate) ** year_offset
-                    current_trad_savings = group_trad_savings * (Decimal('1') + dist_return_assum) ** (year_offset + 1) - trad_dist * sum([(Decimal('1') + dist_return_assum) ** i for i in range(year_offset + 1)])
-                    roth_savings_opt = group_roth_savings * (Decimal('1') + dist_return_assum) ** (year_offset + 1) - roth_dist_opt * sum([(Decimal('1') + dist_return_assum) ** i for i in range(year_offset + 1)])
-                    trad_savings_opt = group_trad_savings * (Decimal('1') + dist_return_assum) ** (year_offset + 1) - trad_dist_opt * sum([(Decimal('1') + dist_return_assum) ** i for i in range(year_offset + 1)])
-                
-                PI = (current_ss_benefit / Decimal('2')) + trad_dist
-                PI_opt = (current_ss_benefit / Decimal('2')) + trad_dist_opt
-                SSPI = SSProvisionalIncomeBrackets
-                
-                ss_bracket = session.query(SSPI).filter(
-                    SSPI.filing_status == distribution_status,
-                    SSPI.year <= start_year + year_offset,
-                    SSPI.prov_income_min <= PI,
-                    (SSPI.prov_income_max >= PI) | (SSPI.prov_income_max.is_(None))
-                ).order_by(SSPI.year.desc()).first()
-                
-                ss_bracket_opt = session.query(SSPI).filter(
-                    SSPI.filing_status == distribution_status,
-                    SSPI.year <= start_year + year_offset,
-                    SSPI.prov_income_min <= PI_opt,
-                    (SSPI.prov_income_max >= PI_opt) | (SSPI.prov_income_max.is_(None))
-                ).order_by(SSPI.year.desc()).first()
-                
-                taxable_ss_trad, PITM = calc_taxable_ss(current_ss_benefit, PI, ss_bracket)
-                taxable_ss_opt, PITM_opt = calc_taxable_ss(current_ss_benefit, PI_opt, ss_bracket_opt)
-                pct_ss_taxed_trad = taxable_ss_trad / current_ss_benefit if current_ss_benefit != 0 else Decimal('0')
-                pct_ss_taxed_opt = taxable_ss_opt / current_ss_benefit if current_ss_benefit != 0 else Decimal('0')
-                
-                std_ded, std_ded_65_add = get_standard_deduction_for_year(session, start_year + year_offset, distribution_status, inflation_assum)
-                
-                taxable_income = trad_dist + taxable_ss_trad - std_ded
-                taxable_income_opt = trad_dist_opt + taxable_ss_opt - std_ded
-                if current_age >= 65:
-                    taxable_income -= std_ded_65_add
-                    taxable_income_opt -= std_ded_65_add
-                taxable_income = max(taxable_income, Decimal('0'))
-                taxable_income_opt = max(taxable_income_opt, Decimal('0'))
-                
-                year_tax_brackets = get_tax_brackets_for_year(session, start_year + year_offset, distribution_status, inflation_assum)
-                fed_tax, fed_tax_opt = calculate_federal_taxes(year_tax_brackets, taxable_income, taxable_income_opt)
-                
-                after_tax_dist_opt = roth_dist_opt + trad_dist_opt - fed_tax_opt
-                atcf_opt = after_tax_dist_opt + current_ss_benefit
-                
-                trad_mtr = get_mtr(year_tax_brackets, taxable_income)
-                trad_mtr_opt = get_mtr(year_tax_brackets, taxable_income_opt)
-                
-                trad_mtr_adj = trad_mtr * PITM
-                trad_mtr_adj_opt = trad_mtr_opt * PITM_opt
-                trad_atcf = trad_dist + current_ss_benefit - fed_tax
-                trad_cum_comp = (fed_tax / (trad_dist * life_years)) if trad_dist != 0 and life_years != 0 else Decimal('0')
-                trad_dist_opt_tax_rate = fed_tax_opt / trad_dist_opt if trad_dist_opt != 0 else Decimal('0')
-                
-                record = RetireYrData(
-                    run_id=calc_run.run_id,
-                    user_id=user.user_id,
-                    conv_group_num=conv_group_num,
-                    year=current_year,
-                    age=current_age,
-                    trad_dist=trad_dist,
-                    roth_dist_opt=roth_dist_opt,
-                    trad_dist_opt=trad_dist_opt,
-                    trad_savings=current_trad_savings,
-                    roth_savings_opt=roth_savings_opt,
-                    trad_savings_opt=trad_savings_opt,
-                    ss_benefit=current_ss_benefit,
-                    taxable_ss_trad=taxable_ss_trad,
-                    pct_ss_taxed_trad=pct_ss_taxed_trad,
-                    taxable_ss_opt=taxable_ss_opt,
-                    pct_ss_taxed_opt=pct_ss_taxed_opt,
-                    taxable_income=taxable_income,
-                    taxable_income_opt=taxable_income_opt,
-                    fed_tax=fed_tax,
-                    fed_tax_opt=fed_tax_opt,
-                    after_tax_dist_opt=after_tax_dist_opt,
-                    atcf_opt=atcf_opt,
-                    trad_atcf=trad_atcf,
-                    trad_mtr=trad_mtr,
-                    trad_mtr_opt=trad_mtr_opt,
-                    trad_mtr_adj=trad_mtr_adj,
-                    trad_mtr_adj_opt=trad_mtr_adj_opt,
-                    trad_dist_opt_tax_rate=trad_dist_opt_tax_rate,
-                    trad_cum_comp=trad_cum_comp
-                )
-                
-                group_records.append(record)
-                group_dists.append(after_tax_dist_opt)
-            
-            all_retire_records.extend(group_records)
-            
-            # Store group statistics for all groups (including group 0)
-            avg_mtr = sum(r.trad_mtr_adj_opt for r in group_records) / len(group_records)
-            total_dist = sum(r.after_tax_dist_opt for r in group_records)
-            total_fed_tax = sum(r.fed_tax_opt for r in group_records)
-            total_trad_dist_opt = sum(r.trad_dist_opt for r in group_records)
-            
-            mtr_map[conv_group_num] = avg_mtr
-            dist_map[conv_group_num] = total_dist
-            fed_tax_map[conv_group_num] = total_fed_tax
-            trad_dist_opt_map[conv_group_num] = total_trad_dist_opt
-            
-            # Calculate conversion metrics for this group (skip group 0)
-            if conv_group_num > 0:
-                # Calculate group statistics (already done above)
-                # avg_mtr and total_dist already calculated
-                
-                # Calculate conversion amounts and taxes
-                if conv_group_num == 1:
-                    # Standard deduction conversion
-                    #conv_amt = std_deduction.std_ded
-                    conv_amt = min(user.trad_savings,std_deduction.std_ded) # 12/13/2025 - used intial_trad_savings and std_ded_adjusted - incorrectly on 12/12/2025
-                    conv_tax = Decimal('0')
-                    tax_rate_bucket = Decimal('0.000')
-                    
-                    # Use group 0 as baseline for group 1
-                    pre_mtr = mtr_map[0]
-                    pre_conv_dist = dist_map[0]
-                    
-                    group_1_pre_conv_dist = pre_conv_dist
-                    group_1_pre_mtr = pre_mtr
-                    
+
+    # Process each conversion group
+    for group_info in conversion_groups:
+        conv_group_num = group_info['conv_group_num']
+        group_trad_savings = group_info['trad_savings']
+        group_roth_savings = group_info['roth_savings']
+
+        # Calculate distributions
+        af = annuity_factor(dist_return_assum, life_years)
+        trad_dist = calc_constant_distribution(group_trad_savings, af)
+        roth_dist_opt = calc_constant_distribution(group_roth_savings, af)
+        trad_dist_opt = calc_constant_distribution(group_trad_savings, af)
+
+        # Create retirement year records for this group
+        group_records = []
+        group_dists = []
+
+        current_year = date(start_year, 12, 31)
+        current_age = user_actual_age
+        current_ss_benefit = initial_ss_benefit
+        current_trad_savings = group_trad_savings * (Decimal('1') + dist_return_assum) - trad_dist
+        roth_savings_opt = group_roth_savings * (Decimal('1') + dist_return_assum) - roth_dist_opt
+        trad_savings_opt = group_trad_savings * (Decimal('1') + dist_return_assum) - trad_dist_opt
+
+        for year_offset in range(life_years):
+            if year_offset > 0:
+                current_year = date(start_year + year_offset, 12, 31)
+                current_age = user_actual_age + year_offset
+                current_ss_benefit = initial_ss_benefit * (Decimal('1') + ss_growth_rate) ** year_offset
+                current_trad_savings = group_trad_savings * (Decimal('1') + dist_return_assum) ** (year_offset + 1) - trad_dist * sum([(Decimal('1') + dist_return_assum) ** i for i in range(year_offset + 1)])
+                roth_savings_opt = group_roth_savings * (Decimal('1') + dist_return_assum) ** (year_offset + 1) - roth_dist_opt * sum([(Decimal('1') + dist_return_assum) ** i for i in range(year_offset + 1)])
+                trad_savings_opt = group_trad_savings * (Decimal('1') + dist_return_assum) ** (year_offset + 1) - trad_dist_opt * sum([(Decimal('1') + dist_return_assum) ** i for i in range(year_offset + 1)])
+
+            PI = (current_ss_benefit / Decimal('2')) + trad_dist
+            PI_opt = (current_ss_benefit / Decimal('2')) + trad_dist_opt
+            # Projected brackets, deductions and SS brackets for this year come from the shared schedule cache
+            schedule = get_projected_schedule(session, start_year + year_offset, distribution_status, inflation_assum, tax_table_version)
+            ss_bracket = schedule.ss_bracket(PI)
+            ss_bracket_opt = schedule.ss_bracket(PI_opt)
+
+            taxable_ss_trad, PITM = calc_taxable_ss(current_ss_benefit, PI, ss_bracket)
+            taxable_ss_opt, PITM_opt = calc_taxable_ss(current_ss_benefit, PI_opt, ss_bracket_opt)
+            pct_ss_taxed_trad = taxable_ss_trad / current_ss_benefit if current_ss_benefit != 0 else Decimal('0')
+            pct_ss_taxed_opt = taxable_ss_opt / current_ss_benefit if current_ss_benefit != 0 else Decimal('0')
+
+            std_ded, std_ded_65_add = schedule.std_ded, schedule.std_ded_65_add
+
+            taxable_income = trad_dist + taxable_ss_trad - std_ded
+            taxable_income_opt = trad_dist_opt + taxable_ss_opt - std_ded
+            if current_age >= 65:
+                taxable_income -= std_ded_65_add
+                taxable_income_opt -= std_ded_65_add
+            taxable_income = max(taxable_income, Decimal('0'))
+            taxable_income_opt = max(taxable_income_opt, Decimal('0'))
+
+            year_tax_brackets = schedule.compiled
+            fed_tax, fed_tax_opt = calculate_federal_taxes(year_tax_brackets, taxable_income, taxable_income_opt)
+
+            after_tax_dist_opt = roth_dist_opt + trad_dist_opt - fed_tax_opt
+            atcf_opt = after_tax_dist_opt + current_ss_benefit
+
+            trad_mtr = get_mtr(year_tax_brackets, taxable_income)
+            trad_mtr_opt = get_mtr(year_tax_brackets, taxable_income_opt)
+
+            trad_mtr_adj = trad_mtr * PITM
+            trad_mtr_adj_opt = trad_mtr_opt * PITM_opt
+            trad_atcf = trad_dist + current_ss_benefit - fed_tax
+            trad_cum_comp = (fed_tax / (trad_dist * life_years)) if trad_dist != 0 and life_years != 0 else Decimal('0')
+            trad_dist_opt_tax_rate = fed_tax_opt / trad_dist_opt if trad_dist_opt != 0 else Decimal('0')
+
+            record = RetireYrData(
+                conv_group_num=conv_group_num,
+                year=current_year,
+                age=current_age,
+                trad_dist=trad_dist,
+                roth_dist_opt=roth_dist_opt,
+                trad_dist_opt=trad_dist_opt,
+                trad_savings=current_trad_savings,
+                roth_savings_opt=roth_savings_opt,
+                trad_savings_opt=trad_savings_opt,
+                ss_benefit=current_ss_benefit,
+                taxable_ss_trad=taxable_ss_trad,
+                pct_ss_taxed_trad=pct_ss_taxed_trad,
+                taxable_ss_opt=taxable_ss_opt,
+                pct_ss_taxed_opt=pct_ss_taxed_opt,
+                taxable_income=taxable_income,
+                taxable_income_opt=taxable_income_opt,
+                fed_tax=fed_tax,
+                fed_tax_opt=fed_tax_opt,
+                after_tax_dist_opt=after_tax_dist_opt,
+                atcf_opt=atcf_opt,
+                trad_atcf=trad_atcf,
+                trad_mtr=trad_mtr,
+                trad_mtr_opt=trad_mtr_opt,
+                trad_mtr_adj=trad_mtr_adj,
+                trad_mtr_adj_opt=trad_mtr_adj_opt,
+                trad_dist_opt_tax_rate=trad_dist_opt_tax_rate,
+                trad_cum_comp=trad_cum_comp
+            )
+
+            group_records.append(record)
+            group_dists.append(after_tax_dist_opt)
+
+        all_retire_records.extend(group_records)
+        if on_progress and conv_group_num == 0:
+            on_progress("baseline", group_records)
+
+        # Store group statistics for all groups (including group 0)
+        avg_mtr = sum(r.trad_mtr_adj_opt for r in group_records) / len(group_records)
+        total_dist = sum(r.after_tax_dist_opt for r in group_records)
+        total_fed_tax = sum(r.fed_tax_opt for r in group_records)
+        total_trad_dist_opt = sum(r.trad_dist_opt for r in group_records)
+
+        mtr_map[conv_group_num] = avg_mtr
+        dist_map[conv_group_num] = total_dist
+        fed_tax_map[conv_group_num] = total_fed_tax
+        trad_dist_opt_map[conv_group_num] = total_trad_dist_opt
+
+        # Calculate conversion metrics for this group (skip group 0)
+        if conv_group_num > 0:
+            # Calculate group statistics (already done above)
+            # avg_mtr and total_dist already calculated
+
+            # Calculate conversion amounts and taxes
+            if conv_group_num == 1:
+                # Standard deduction conversion
+                #conv_amt = std_deduction.std_ded
+                conv_amt = min(plan["trad_savings"],std_deduction.std_ded) # 12/13/2025 - used intial_trad_savings and std_ded_adjusted - incorrectly on 12/12/2025
+                conv_tax = Decimal('0')
+                tax_rate_bucket = Decimal('0.000')
+
+                # Use group 0 as baseline for group 1
+                pre_mtr = mtr_map[0]
+                pre_conv_dist = dist_map[0]
+
+                group_1_pre_conv_dist = pre_conv_dist
+                group_1_pre_mtr = pre_mtr
+
+            else:
+                # Tax bracket conversions
+                if conv_group_num == len(conversion_groups) - 1:
+                    # Full conversion
+                    conv_amt = plan["trad_savings"]
+                    tax_rate_bucket = breaking_bracket.tax_rate if breaking_bracket else tax_brackets[-1].tax_rate
                 else:
-                    # Tax bracket conversions
-                    if conv_group_num == len(conversion_groups) - 1:
-                        # Full conversion
-                        conv_amt = user.trad_savings
-                        tax_rate_bucket = breaking_bracket.tax_rate if breaking_bracket else tax_brackets[-1].tax_rate
+                    # Partial bracket fill
+                    bracket_idx = conv_group_num - 2
+                    bracket = tax_brackets[bracket_idx]
+                    conv_amt = std_deduction.std_ded + bracket.income_max
+                    tax_rate_bucket = bracket.tax_rate
+
+                conv_tax = calculate_conversion_tax(conv_amt, compiled_tax_brackets, std_deduction.std_ded)
+                pre_mtr = group_1_pre_mtr
+                pre_conv_dist = group_1_pre_conv_dist
+
+            conv_tax_rate = conv_tax / conv_amt if conv_amt != 0 else Decimal('0')
+            tax_map[conv_group_num] = conv_tax
+            amt_map[conv_group_num] = conv_amt
+
+            total_after_tax = total_dist - pre_conv_dist
+
+            # Calculate IRR and duration
+            if conv_group_num == 1:
+                conv_return_multiple = Decimal('99.99999999')
+                conv_irr = Decimal('0.99999999')
+                conv_duration = Decimal('0.00000000')
+            else:
+                conv_return_multiple = total_after_tax / conv_tax if conv_tax != 0 else Decimal('0')
+
+                # IRR calculation
+                group_0_dists = [r.after_tax_dist_opt for r in all_retire_records if r.conv_group_num == 0]
+                current_dists = group_dists
+
+                if len(current_dists) == len(group_0_dists) == life_years:
+                    diffs = [c - g0 for c, g0 in zip(current_dists, group_0_dists)]
+                    cash_flows = [float(conv_tax * -1)] + [float(d) for d in diffs]
+                    irr_value = npf.irr(cash_flows)
+                    if irr_value is not None and not math.isnan(irr_value) and not math.isinf(irr_value):
+                        conv_irr = Decimal(str(min(round(irr_value, 8), 0.99999999)))
                     else:
-                        # Partial bracket fill
-                        bracket_idx = conv_group_num - 2
-                        bracket = tax_brackets[bracket_idx]
-                        conv_amt = std_deduction.std_ded + bracket.income_max
-                        tax_rate_bucket = bracket.tax_rate
-                    
-                    conv_tax = calculate_conversion_tax(conv_amt, tax_brackets, std_deduction.std_ded)
-                    pre_mtr = group_1_pre_mtr
-                    pre_conv_dist = group_1_pre_conv_dist
-                
-                conv_tax_rate = conv_tax / conv_amt if conv_amt != 0 else Decimal('0')
-                tax_map[conv_group_num] = conv_tax
-                amt_map[conv_group_num] = conv_amt
-                
-                total_after_tax = total_dist - pre_conv_dist
-                
-                # Calculate IRR and duration
-                if conv_group_num == 1:
-                    conv_return_multiple = Decimal('99.99999999')
-                    conv_irr = Decimal('0.99999999')
-                    conv_duration = Decimal('0.00000000')
+                        conv_irr = Decimal('0')
                 else:
-                    conv_return_multiple = total_after_tax / conv_tax if conv_tax != 0 else Decimal('0')
-                    
-                    # IRR calculation
-                    group_0_dists = [r.after_tax_dist_opt for r in all_retire_records if r.conv_group_num == 0]
-                    current_dists = group_dists
-                    
-                    if len(current_dists) == len(group_0_dists) == life_years:
-                        diffs = [c - g0 for c, g0 in zip(current_dists, group_0_dists)]
-                        cash_flows = [float(conv_tax * -1)] + [float(d) for d in diffs]
-                        irr_value = npf.irr(cash_flows)
-                        if irr_value is not None and not math.isnan(irr_value) and not math.isinf(irr_value):
-                            conv_irr = Decimal(str(min(round(irr_value, 8), 0.99999999)))
-                        else:
-                            conv_irr = Decimal('0')
+                    conv_irr = Decimal('0')
+
+                # Duration calculation
+                try:
+                    if conv_irr <= -1 or conv_return_multiple <= 0:
+                        conv_duration = Decimal('0.00000000')
                     else:
-                        conv_irr = Decimal('0')
-                    
-                    # Duration calculation
-                    try:
-                        if conv_irr <= -1 or conv_return_multiple <= 0:
-                            conv_duration = Decimal('0.00000000')
+                        log_base = float(conv_irr) + 1
+                        log_multiple = float(conv_return_multiple)
+                        if log_base > 0 and log_multiple > 0:
+                            duration_calc = math.log(log_multiple) / math.log(log_base)
+                            conv_duration = Decimal(str(min(round(duration_calc, 8), 99.99999999)))
                         else:
-                            log_base = float(conv_irr) + 1
-                            log_multiple = float(conv_return_multiple)
-                            if log_base > 0 and log_multiple > 0:
-                                duration_calc = math.log(log_multiple) / math.log(log_base)
-                                conv_duration = Decimal(str(min(round(duration_calc, 8), 99.99999999)))
-                            else:
-                                conv_duration = Decimal('0.00000000')
-                    except (ValueError, OverflowError, decimal.InvalidOperation):
-                        conv_duration = Decimal('0.00000000')
-                
-                synthetic_roth_cont = conv_tax * Decimal(str((1 + float(dist_return_assum)) ** float(base_duration)))
-                tax_rate_arb_amt = total_after_tax - synthetic_roth_cont
-                if abs(tax_rate_arb_amt) < Decimal('0.0001'):
-                    tax_rate_arb_amt = Decimal('0')
-                
-                # Calculate conv_dist_tax: fed_tax of group 0 minus fed_tax of current group
-                conv_dist_tax = fed_tax_map.get(0, Decimal('0')) - fed_tax_map.get(conv_group_num, Decimal('0'))
-                conv_trad_dist_opt = trad_dist_opt_map.get(0, Decimal('0')) - trad_dist_opt_map.get(conv_group_num, Decimal('0'))
-                
-                # Calculate conv_dist_tax_rate
-                conv_dist_tax_rate = conv_dist_tax / conv_trad_dist_opt if conv_trad_dist_opt != 0 else Decimal('0')
-                
-                conv_data = {
-                    'run_id': calc_run.run_id,
-                    'user_id': user.user_id,
-                    'conv_group_num': conv_group_num,
-                    'tax_rate_bucket': tax_rate_bucket,
-                    'conv_amt': conv_amt,
-                    'conv_tax': conv_tax,
-                    'conv_tax_rate': conv_tax_rate,
-                    'dist_mtr_pre_conv': pre_mtr,
-                    'dist_mtr_post_conv': avg_mtr,
-                    'distributions_total_pre_conv': pre_conv_dist,
-                    'distributions_total_post_conv': total_dist,
-                    'total_after_tax_dist_chg_amt': total_after_tax,
-                    'conv_return_multiple': Decimal(str(min(round(conv_return_multiple, 8), 99.99999999))),
-                    'conv_irr': conv_irr,
-                    'conv_duration': conv_duration,
-                    'synthetic_roth_cont': synthetic_roth_cont,
-                    'tax_rate_arb_amt': tax_rate_arb_amt,
-                    'conv_dist_tax': conv_dist_tax,
-                    'conv_dist_tax_rate': conv_dist_tax_rate
-                }
-                all_conversions.append(conv_data)
-                
-                # Parts conversions
-                if conv_group_num == 1:
-                    # For group 1, use group 0 as baseline
-                    parts_pre_dist = dist_map[0]
-                    parts_pre_mtr = mtr_map[0]
-                else:
-                    # For groups 2+, use previous group as baseline
-                    parts_pre_dist = dist_map.get(conv_group_num - 1, Decimal('0'))
-                    parts_pre_mtr = mtr_map.get(conv_group_num - 1, Decimal('0'))
-                
-                tot_aft_tax_dist_chg = total_dist - parts_pre_dist
-                if tot_aft_tax_dist_chg < .00000001:
-                    tot_aft_tax_dist_chg = Decimal('0')
-
-                conv_tax_parts = conv_tax - tax_map.get(conv_group_num - 1, Decimal('0'))
-                parts_conv_amt = conv_amt - amt_map.get(conv_group_num - 1, Decimal('0'))
-                parts_conv_tax_rate = conv_tax_parts / parts_conv_amt if parts_conv_amt != 0 else Decimal('0')
-                
-                # Parts IRR calculation
-                if conv_group_num == 1:
-                    parts_conv_irr = Decimal('0.99999999')
-                    parts_return_multiple = Decimal('99.99999999')
-                    parts_duration = Decimal('0.00000000')
+                            conv_duration = Decimal('0.00000000')
+                except (ValueError, OverflowError, decimal.InvalidOperation):
+                    conv_duration = Decimal('0.00000000')
+
+            synthetic_roth_cont = conv_tax * Decimal(str((1 + float(dist_return_assum)) ** float(base_duration)))
+            tax_rate_arb_amt = total_after_tax - synthetic_roth_cont
+            if abs(tax_rate_arb_amt) < Decimal('0.0001'):
+                tax_rate_arb_amt = Decimal('0')
+
+            # Calculate conv_dist_tax: fed_tax of group 0 minus fed_tax of current group
+            conv_dist_tax = fed_tax_map.get(0, Decimal('0')) - fed_tax_map.get(conv_group_num, Decimal('0'))
+            conv_trad_dist_opt = trad_dist_opt_map.get(0, Decimal('0')) - trad_dist_opt_map.get(conv_group_num, Decimal('0'))
+
+            # Calculate conv_dist_tax_rate
+            conv_dist_tax_rate = conv_dist_tax / conv_trad_dist_opt if conv_trad_dist_opt != 0 else Decimal('0')
+
+            conv_data = {
+                'conv_group_num': conv_group_num,
+                'tax_rate_bucket': tax_rate_bucket,
+                'conv_amt': conv_amt,
+                'conv_tax': conv_tax,
+                'conv_tax_rate': conv_tax_rate,
+                'dist_mtr_pre_conv': pre_mtr,
+                'dist_mtr_post_conv': avg_mtr,
+                'distributions_total_pre_conv': pre_conv_dist,
+                'distributions_total_post_conv': total_dist,
+                'total_after_tax_dist_chg_amt': total_after_tax,
+                'conv_return_multiple': Decimal(str(min(round(conv_return_multiple, 8), 99.99999999))),
+                'conv_irr': conv_irr,
+                'conv_duration': conv_duration,
+                'synthetic_roth_cont': synthetic_roth_cont,
+                'tax_rate_arb_amt': tax_rate_arb_amt,
+                'conv_dist_tax': conv_dist_tax,
+                'conv_dist_tax_rate': conv_dist_tax_rate
+            }
+            all_conversions.append(conv_data)
+            if on_progress:
+                on_progress("conversion", conv_data)
+
+            # Parts conversions
+            if conv_group_num == 1:
+                # For group 1, use group 0 as baseline
+                parts_pre_dist = dist_map[0]
+                parts_pre_mtr = mtr_map[0]
+            else:
+                # For groups 2+, use previous group as baseline
+                parts_pre_dist = dist_map.get(conv_group_num - 1, Decimal('0'))
+                parts_pre_mtr = mtr_map.get(conv_group_num - 1, Decimal('0'))
+
+            tot_aft_tax_dist_chg = total_dist - parts_pre_dist
+            if tot_aft_tax_dist_chg < .00000001:
+                tot_aft_tax_dist_chg = Decimal('0')
+
+            conv_tax_parts = conv_tax - tax_map.get(conv_group_num - 1, Decimal('0'))
+            parts_conv_amt = conv_amt - amt_map.get(conv_group_num - 1, Decimal('0'))
+            parts_conv_tax_rate = conv_tax_parts / parts_conv_amt if parts_conv_amt != 0 else Decimal('0')
+
+            # Parts IRR calculation
+            if conv_group_num == 1:
+                parts_conv_irr = Decimal('0.99999999')
+                parts_return_multiple = Decimal('99.99999999')
+                parts_duration = Decimal('0.00000000')
+            else:
+                # Use the exact same logic as original populate program
+                current_dists = group_dists
+                prior_dists = [r.after_tax_dist_opt for r in all_retire_records if r.conv_group_num == conv_group_num - 1]
+
+                if len(current_dists) == len(prior_dists) == life_years:
+                    parts_diffs = [c - p for c, p in zip(current_dists, prior_dists)]
+                    sum_parts_diffs = sum(parts_diffs) < .00000001
+                    parts_cash_flows = [float(conv_tax_parts * -1)] + [float(d) for d in parts_diffs]
+                    #logger.info(f"parts_cash_flows = {[f'{cf:,.2f}' for cf in parts_cash_flows]}")
+                    parts_irr_value = npf.irr(parts_cash_flows)
+                    if parts_irr_value is not None and not math.isnan(parts_irr_value) and not math.isinf(parts_irr_value) and not sum_parts_diffs:
+                        parts_conv_irr = Decimal(str(min(round(parts_irr_value, 8), 0.99999999)))
+                    else:
+                        parts_conv_irr = Decimal('-1')  # Conversion tax paid results in zero AFTC increase or total loss
                 else:
-                    # Use the exact same logic as original populate program
-                    current_dists = group_dists
-                    prior_dists = [r.after_tax_dist_opt for r in all_retire_records if r.conv_group_num == conv_group_num - 1]
-                    
-                    if len(current_dists) == len(prior_dists) == life_years:
-                        parts_diffs = [c - p for c, p in zip(current_dists, prior_dists)]
-                        sum_parts_diffs = sum(parts_diffs) < .00000001
-                        parts_cash_flows = [float(conv_tax_parts * -1)] + [float(d) for d in parts_diffs]
-                        #logger.info(f"parts_cash_flows = {[f'{cf:,.2f}' for cf in parts_cash_flows]}")
-                        parts_irr_value = npf.irr(parts_cash_flows)
-                        if parts_irr_value is not None and not math.isnan(parts_irr_value) and not math.isinf(parts_irr_value) and not sum_parts_diffs:
-                            parts_conv_irr = Decimal(str(min(round(parts_irr_value, 8), 0.99999999)))
-                        else:
-                            parts_conv_irr = Decimal('-1')  # Conversion tax paid results in zero AFTC increase or total loss
+                    parts_conv_irr = Decimal('0')
+                logger.info(f"parts_pre_dist={parts_pre_dist}, total_dist={total_dist}")
+
+                parts_return_multiple = Decimal(str(min(round((tot_aft_tax_dist_chg) / conv_tax_parts, 8), 99.99999999))) if conv_tax_parts != 0 else Decimal('0')
+                #parts_return_multiple = Decimal(str(min(round((total_dist - parts_pre_dist) / conv_tax_parts, 8), 99.99999999))) if conv_tax_parts != 0 else Decimal('0')
+
+                try:
+                    if parts_conv_irr <= -1 or parts_return_multiple <= 0:
+                        parts_duration = Decimal('0.00000000')
                     else:
-                        parts_conv_irr = Decimal('0')
-                    logger.info(f"parts_pre_dist={parts_pre_dist}, total_dist={total_dist}")
-                    
-                    parts_return_multiple = Decimal(str(min(round((tot_aft_tax_dist_chg) / conv_tax_parts, 8), 99.99999999))) if conv_tax_parts != 0 else Decimal('0')
-                    #parts_return_multiple = Decimal(str(min(round((total_dist - parts_pre_dist) / conv_tax_parts, 8), 99.99999999))) if conv_tax_parts != 0 else Decimal('0')
-                    
-                    try:
-                        if parts_conv_irr <= -1 or parts_return_multiple <= 0:
-                            parts_duration = Decimal('0.00000000')
+                        log_base = float(parts_conv_irr) + 1
+                        log_multiple = float(parts_return_multiple)
+                        if log_base > 0 and log_multiple > 0:
+                            duration_calc = math.log(log_multiple) / math.log(log_base)
+                            parts_duration = Decimal(str(min(round(duration_calc, 8), 99.99999999)))
                         else:
-                            log_base = float(parts_conv_irr) + 1
-                            log_multiple = float(parts_return_multiple)
-                            if log_base > 0 and log_multiple > 0:
-                                duration_calc = math.log(log_multiple) / math.log(log_base)
-                                parts_duration = Decimal(str(min(round(duration_calc, 8), 99.99999999)))
-                            else:
-                                parts_duration = Decimal('0.00000000')
-                    except (ValueError, OverflowError, decimal.InvalidOperation):
-                        parts_duration = Decimal('0.00000000')
-                
-                parts_synthetic_roth_cont = conv_tax_parts * Decimal(str((1 + float(dist_return_assum)) ** float(base_duration)))
-                parts_tax_rate_arb_amt = (total_dist - parts_pre_dist) - parts_synthetic_roth_cont
-                if abs(parts_tax_rate_arb_amt) < Decimal('0.0001'):
-                    parts_tax_rate_arb_amt = Decimal('0')
-
-                # Calculate conv_dist_tax_parts: fed_tax of (r-1) minus fed_tax of (r)
-                if conv_group_num == 1:
-                    # For group 1, compare to group 0
-                    conv_dist_tax_parts = fed_tax_map.get(0, Decimal('0')) - fed_tax_map.get(1, Decimal('0'))
-                    conv_trad_dist_opt_parts = trad_dist_opt_map.get(0, Decimal('0')) - trad_dist_opt_map.get(1, Decimal('0'))
-                else:
-                    # For groups 2+, compare to previous group
-                    conv_dist_tax_parts = fed_tax_map.get(conv_group_num - 1, Decimal('0')) - fed_tax_map.get(conv_group_num, Decimal('0'))
-                    conv_trad_dist_opt_parts = trad_dist_opt_map.get(conv_group_num - 1, Decimal('0')) - trad_dist_opt_map.get(conv_group_num, Decimal('0'))
-
-                # Calculate conv_dist_tax_rate_parts
-                conv_dist_tax_rate_parts = conv_dist_tax_parts / conv_trad_dist_opt_parts if conv_trad_dist_opt_parts != 0 else Decimal('0')
-
-                parts_data = {
-                    'run_id': calc_run.run_id,
-                    'user_id': user.user_id,
-                    'conv_group_num': conv_group_num,
-                    'tax_rate_bucket': tax_rate_bucket,
-                    'distributions_total_pre_conv': parts_pre_dist,
-                    'distributions_total_post_conv': total_dist,
-                    #'total_after_tax_dist_chg_amt': total_dist - parts_pre_dist,
-                    'total_after_tax_dist_chg_amt': tot_aft_tax_dist_chg,
-                    'conv_tax': conv_tax_parts,
-                    'dist_mtr_pre_conv': parts_pre_mtr,
-                    'dist_mtr_post_conv': avg_mtr,
-                    'conv_return_multiple': parts_return_multiple,
-                    'conv_irr': parts_conv_irr,
-                    'conv_amt': parts_conv_amt,
-                    'conv_tax_rate': parts_conv_tax_rate,
-                    'conv_duration': parts_duration,
-                    'synthetic_roth_cont': parts_synthetic_roth_cont,
-                    'tax_rate_arb_amt': parts_tax_rate_arb_amt,
-                    'conv_dist_tax': conv_dist_tax_parts,
-                    'conv_dist_tax_rate': conv_dist_tax_rate_parts
-                }
-                all_parts_conversions.append(parts_data)
-        
-        # Bulk insert all records
-        session.bulk_insert_mappings(RetireYrData, [r.__dict__ for r in all_retire_records])
-        session.bulk_insert_mappings(RothConversions, all_conversions)
-        session.bulk_insert_mappings(RothConversionsParts, all_parts_conversions)
+                            parts_duration = Decimal('0.00000000')
+                except (ValueError, OverflowError, decimal.InvalidOperation):
+                    parts_duration = Decimal('0.00000000')
+
+            parts_synthetic_roth_cont = conv_tax_parts * Decimal(str((1 + float(dist_return_assum)) ** float(base_duration)))
+            parts_tax_rate_arb_amt = (total_dist - parts_pre_dist) - parts_synthetic_roth_cont
+            if abs(parts_tax_rate_arb_amt) < Decimal('0.0001'):
+                parts_tax_rate_arb_amt = Decimal('0')
+
+            # Calculate conv_dist_tax_parts: fed_tax of (r-1) minus fed_tax of (r)
+            if conv_group_num == 1:
+                # For group 1, compare to group 0
+                conv_dist_tax_parts = fed_tax_map.get(0, Decimal('0')) - fed_tax_map.get(1, Decimal('0'))
+                conv_trad_dist_opt_parts = trad_dist_opt_map.get(0, Decimal('0')) - trad_dist_opt_map.get(1, Decimal('0'))
+            else:
+                # For groups 2+, compare to previous group
+                conv_dist_tax_parts = fed_tax_map.get(conv_group_num - 1, Decimal('0')) - fed_tax_map.get(conv_group_num, Decimal('0'))
+                conv_trad_dist_opt_parts = trad_dist_opt_map.get(conv_group_num - 1, Decimal('0')) - trad_dist_opt_map.get(conv_group_num, Decimal('0'))
+
+            # Calculate conv_dist_tax_rate_parts
+            conv_dist_tax_rate_parts = conv_dist_tax_parts / conv_trad_dist_opt_parts if conv_trad_dist_opt_parts != 0 else Decimal('0')
+
+            parts_data = {
+                'conv_group_num': conv_group_num,
+                'tax_rate_bucket': tax_rate_bucket,
+                'distributions_total_pre_conv': parts_pre_dist,
+                'distributions_total_post_conv': total_dist,
+                #'total_after_tax_dist_chg_amt': total_dist - parts_pre_dist,
+                'total_after_tax_dist_chg_amt': tot_aft_tax_dist_chg,
+                'conv_tax': conv_tax_parts,
+                'dist_mtr_pre_conv': parts_pre_mtr,
+                'dist_mtr_post_conv': avg_mtr,
+                'conv_return_multiple': parts_return_multiple,
+                'conv_irr': parts_conv_irr,
+                'conv_amt': parts_conv_amt,
+                'conv_tax_rate': parts_conv_tax_rate,
+                'conv_duration': parts_duration,
+                'synthetic_roth_cont': parts_synthetic_roth_cont,
+                'tax_rate_arb_amt': parts_tax_rate_arb_amt,
+                'conv_dist_tax': conv_dist_tax_parts,
+                'conv_dist_tax_rate': conv_dist_tax_rate_parts
+            }
+            all_parts_conversions.append(parts_data)
+
+    # Calculate distribution schedule values
+    af = annuity_factor(dist_return_assum, life_years)
+    distribution = calc_constant_distribution(initial_trad_savings, af)
+    annuity_factor_multiple = af * life_years
+    if on_progress:
+        on_progress("parts", all_parts_conversions)
+
+    return {
+        "retire_records": all_retire_records,
+        "conversions": all_conversions,
+        "parts": all_parts_conversions,
+        "distribution": distribution,
+        "annuity_factor_multiple": annuity_factor_multiple,
+        "base_duration": base_duration,
+    }
+
+def replay_progress(computed, on_progress):
+    """The on_progress calls compute_retire_and_conversions makes, for an already computed result:
+    "baseline" (group 0 year records), one "conversion" per group, then "parts" (the parts rows)"""
+    on_progress("baseline", [r for r in computed["retire_records"] if r.conv_group_num == 0])
+    for conv_data in computed["conversions"]:
+        on_progress("conversion", conv_data)
+    on_progress("parts", computed["parts"])
+
+def persist_calculation(session, user_id, input_id, run_date, computed):
+    """Writes one computed run without committing: new calculation_runs row, calc_count bump,
+    replacement of the user's result rows and the input's run_id. Returns what the endpoint needs."""
+    # Allocate the run id (distribution schedule included) in a single round trip
+    run_id = session.execute(
+        insert(CalculationRun).values(
+            user_id=user_id,
+            run_timestamp=run_date,
+            distribution=computed["distribution"],
+            annuity_factor_multiple=computed["annuity_factor_multiple"],
+            base_duration=computed["base_duration"]
+        ).returning(CalculationRun.run_id)
+    ).scalar_one()
+
+    # Count this run atomically instead of re-counting all of the user's runs
+    calc_count, subscription_status = session.execute(
+        update(User)
+        .where(User.user_id == user_id)
+        .values(calc_count=func.coalesce(User.calc_count, 0) + 1)
+        .returning(User.calc_count, User.subscription_status)
+    ).one()
+
+    # Delete existing records
+    delete_retire = session.query(RetireYrData).filter_by(user_id=user_id).delete(synchronize_session=False)
+    delete_conv = session.query(RothConversions).filter_by(user_id=user_id).delete(synchronize_session=False)
+    delete_parts = session.query(RothConversionsParts).filter_by(user_id=user_id).delete(synchronize_session=False)
+    # Both year-data layouts, whichever is configured now: runs may have been stored under another RETIRE_YR_STORAGE
+    session.query(RetireYrSeries).filter_by(user_id=user_id).delete(synchronize_session=False)
+    logger.info(f"Deleted {delete_retire} retire_yr_data, {delete_conv} roth_conversions, {delete_parts} roth_conversions_parts records")
+
+    for record in computed["retire_records"]:
+        record.run_id = run_id
+        record.user_id = user_id
+    for row in computed["conversions"] + computed["parts"]:
+        row["run_id"] = run_id
+        row["user_id"] = user_id
+
+    # Bulk insert all records (year data as rows, packed series, or both - see retire_yr_series.py)
+    if writes_rows():
+        session.bulk_insert_mappings(RetireYrData, [r.__dict__ for r in computed["retire_records"]])
+    if writes_series():
+        session.bulk_insert_mappings(RetireYrSeries, build_series_rows(computed["retire_records"], run_id, user_id))
+    session.bulk_insert_mappings(RothConversions, computed["conversions"])
+    session.bulk_insert_mappings(RothConversionsParts, computed["parts"])
+
+    # Update user's inputs to reference this completed calculation
+    session.query(Input).filter_by(input_id=input_id).update({"run_id": run_id}, synchronize_session=False)
+
+    return {
+        "run_id": run_id,
+        "calc_count": calc_count,
+        "subscription_status": subscription_status,
+    }
+
+def plan_key(user_id, plan):
+    """Single-flight key: the user plus their normalized engine inputs"""
+    return (user_id,) + tuple((name, str(plan[name])) for name in sorted(plan))
+
+def calc_retire_and_conversions(user_id, guard=None, precomputed=None, on_progress=None):
+    """Runs and stores a calculation from the user's latest inputs. Concurrent calls with the same
+    inputs share one run (see single_flight.py); guard, a context manager factory such as an
+    admission slot, is entered only by the call that actually computes. precomputed(session, user_id,
+    plan, run_date) may return an engine result already computed for this plan (see speculation.py).
+    on_progress(kind, data) reports engine progress and, once committed, ("saved", result); a call
+    that shares another call's run gets no progress calls."""
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        input_record = latest_input(session, user_id)
+        if not input_record:
+            raise ValueError(f"No input record found for user_id={user_id}")
+
+        user = active_user(session, user_id)
+        if not user:
+            raise ValueError(f"No user found for user_id={user_id}")
+
+        input_id = input_record.input_id
+        plan = plan_from_records(input_record, user)
+    except Exception as e:
+        logger.error(f"Error in calc_retire_and_conversions: {e}")
+        return {"run_id": None, "records_created": 0}
+    finally:
+        session.close()  # Callers sharing another call's run don't hold a connection while they wait
+
+    return calculation_flights.run(
+        plan_key(user_id, plan), user_id, lambda: run_calculation(user_id, input_id, plan, precomputed, on_progress), guard=guard
+    )
+
+def run_calculation(user_id, input_id, plan, precomputed=None, on_progress=None):
+    """Computes (or takes from precomputed) and stores one run in a single transaction"""
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+    try:
+        run_date = datetime.now(timezone.utc)
+        computed = precomputed(session, user_id, plan, run_date) if precomputed else None
+        if computed is None:
+            computed = compute_retire_and_conversions(session, plan, run_date, on_progress)
+        elif on_progress:
+            replay_progress(computed, on_progress)
+
+        # Everything the run writes commits together
+        persisted = persist_calculation(session, user_id, input_id, run_date, computed)
         session.commit()
-        
-        logger.info(f"Successfully created {len(all_retire_records)} retire_yr_data records, {len(all_conversions)} roth_conversions records, {len(all_parts_conversions)} roth_conversions_parts records")
-        
+        run_id = persisted["run_id"]
+        result = {
+            "run_id": run_id,
+            "records_created": len(computed["retire_records"]),
+            "calc_count": persisted["calc_count"],
+            "subscription_status": persisted["subscription_status"],
+            "distribution": float(computed["distribution"]),
+            "annuity_factor_multiple": float(computed["annuity_factor_multiple"]),
+            "base_duration": float(computed["base_duration"]),
+        }
+        if on_progress:
+            on_progress("saved", result)  # Before the run is written to the log below
+
+        logger.info(f"Successfully created {len(computed['retire_records'])} retire_yr_data records, {len(computed['conversions'])} roth_conversions records, {len(computed['parts'])} roth_conversions_parts records")
+
         # Log retire_yr_data records for all groups (all records)
         logger.info(
             f"{'#':>3} "
@@ -720,7 +788,7 @@ def calc_retire_and_conversions(user_id):
         )
         
         # Log all retirement year data records
-        for idx, rec in enumerate(all_retire_records, 1):
+        for idx, rec in enumerate(computed["retire_records"], 1):
             logger.info(
                 f"{idx:3d} "
                 f"{rec.run_id:5d} "
@@ -743,7 +811,7 @@ def calc_retire_and_conversions(user_id):
             )
         
         # Log conversion data
-        logger.info(f"Inserted {len(all_conversions)} records into roth_conversions and {len(all_parts_conversions)} into roth_conversions_parts for run_id={calc_run.run_id}")
+        logger.info(f"Inserted {len(computed['conversions'])} records into roth_conversions and {len(computed['parts'])} into roth_conversions_parts for run_id={run_id}")
         logger.info(
             f"{'Grp':>3} "
             f"{'Rate':>7} "
@@ -763,7 +831,7 @@ def calc_retire_and_conversions(user_id):
         )
         logger.info("-" * 140)
         
-        for rec in all_conversions:
+        for rec in computed["conversions"]:
             logger.info(
                 f"{rec['conv_group_num']:3d} "
                 f"{rec['tax_rate_bucket']:7.3f} "
@@ -784,7 +852,7 @@ def calc_retire_and_conversions(user_id):
         
         logger.info("-" * 140)
         
-        for rec in all_parts_conversions:
+        for rec in computed["parts"]:
             logger.info(
                 f"{rec['conv_group_num']:3d} "
                 f"{rec['tax_rate_bucket']:7.3f} "
@@ -805,35 +873,15 @@ def calc_retire_and_conversions(user_id):
         
         logger.info("-" * 140)
 
-        # Calculate distribution schedule values
-        af = annuity_factor(dist_return_assum, life_years)
-        distribution = calc_constant_distribution(initial_trad_savings, af)
-        annuity_factor_multiple = af * life_years
-
-        # Update calculation run with distribution schedule values
-        calc_run.distribution = distribution
-        calc_run.annuity_factor_multiple = annuity_factor_multiple
-        calc_run.base_duration = base_duration
-
-        # Update user's inputs to reference this completed calculation
-        input_record.run_id = calc_run.run_id
-        session.commit()
+        return result
 
-        return {
-            "run_id": calc_run.run_id,
-            "records_created": len(all_retire_records),
-            "distribution": float(distribution),
-            "annuity_factor_multiple": float(annuity_factor_multiple),
-            "base_duration": float(base_duration),
-        }
-    
     except Exception as e:
         session.rollback()
-        logger.error(f"Error in calc_retire_and_conversions: {e}")
+        logger.error(f"Error in run_calculation: {e}")
         import traceback
         traceback.print_exc()
         return {"run_id": None, "records_created": 0}
-    
+
     finally:
         session.close()
 
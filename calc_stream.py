@@ -0,0 +1,130 @@
+from batch_calc import CONVERSION_SUMMARY_FIELDS
+from calc_roth_conv_data import calc_retire_and_conversions
+from create_retire_database import RetireYrData, RothConversions, SessionLocal
+from decimal import Decimal, ROUND_HALF_UP
+from hot_queries import RETIRE_YR_API_FIELDS, retire_yr_api_rows, roth_conversions, roth_conversions_parts
+import json
+import queue
+import threading
+
+# Progressive calculation results as server-sent events, so the Conversions tab can render while
+# the engine is still working. In order:
+#   event: baseline    {"conv_group_num": 0, "records": [...]}  (the /retire_yr_data/{run_id} records)
+#   event: conversion  one per conversion group, as soon as its IRR is computed (a /roth_conversions
+#                      row without run_id/user_id)
+#   event: parts       the parts table (/roth_conversions_parts rows without run_id/user_id)
+#   event: done        the /calculate-yr-data response, sent once the run is committed
+#   event: error       {"detail": ...} if the calculation failed
+# The calculation runs on its own thread and goes through calc_retire_and_conversions as usual
+# (single flight, admission, speculation). A request that shares another request's run gets no
+# engine progress; it streams the stored rows once that run is committed.
+
+def sse(event, data):
+    """One server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _stored_float(column, value):
+    """value rounded to the column's Numeric scale, so streamed numbers match what the GET endpoints return later"""
+    if value is None:
+        return None
+    return float(Decimal(value).quantize(Decimal(1).scaleb(-column.type.scale), rounding=ROUND_HALF_UP))
+
+def baseline_payload(records):
+    columns = RetireYrData.__table__.c
+    return {
+        "conv_group_num": 0,
+        "records": [
+            dict({"year": r.year.isoformat(), "age": r.age},
+                 **{field: _stored_float(columns[field], getattr(r, field)) for field in RETIRE_YR_API_FIELDS})
+            for r in records
+        ],
+    }
+
+def conversion_payload(row):
+    """A conversion or parts row (engine dict or stored Row) in the API shape, without run_id/user_id"""
+    row = row if isinstance(row, dict) else row._mapping
+    columns = RothConversions.__table__.c  # roth_conversions_parts has the same column types
+    return {
+        field: _stored_float(columns[field], row[field]) if field != "conv_group_num" else row[field]
+        for field in CONVERSION_SUMMARY_FIELDS
+    }
+
+def stored_events(run_id):
+    """baseline, conversion and parts events read back from a committed run"""
+    session = SessionLocal()
+    try:
+        yield sse("baseline", baseline_payload(retire_yr_api_rows(session, run_id)))
+        for row in roth_conversions(session, run_id):
+            yield sse("conversion", conversion_payload(row))
+        yield sse("parts", [conversion_payload(row) for row in roth_conversions_parts(session, run_id)])
+    finally:
+        session.close()
+
+def done_payload(result):
+    return {
+        "run_id": result["run_id"],
+        "records_created": result["records_created"],
+        "calc_count": result.get("calc_count", 0),
+        "subscription_status": result.get("subscription_status") or "unpaid",
+        "distribution": result.get("distribution"),
+        "annuity_factor_multiple": result.get("annuity_factor_multiple"),
+        "base_duration": result.get("base_duration"),
+    }
+
+class CalculationStream:
+    """Runs one calculation on a thread and turns its progress into server-sent events"""
+
+    def __init__(self, user_id, guard=None, precomputed=None):
+        self._events = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, args=(user_id, guard, precomputed), name="calc-stream", daemon=True
+        )
+        self._thread.start()
+        self._first = self._events.get()
+
+    def _run(self, user_id, guard, precomputed):
+        try:
+            result = calc_retire_and_conversions(
+                user_id, guard=guard, precomputed=precomputed,
+                on_progress=lambda kind, data: self._events.put((kind, data))
+            )
+            self._events.put(("result", result))
+        except BaseException as e:
+            self._events.put(("exception", e))
+
+    def first_error(self):
+        """The exception the calculation raised before producing anything (e.g. AdmissionRejected), or None"""
+        kind, data = self._first
+        return data if kind == "exception" else None
+
+    def events(self, on_done=None):
+        """The event stream; the calculation carries on to its commit even if the client goes away.
+        on_done(result) is called when the done event goes out."""
+        item, done_sent = self._first, False
+        while True:
+            kind, data = item
+            if kind == "baseline":
+                yield sse("baseline", baseline_payload(data))
+            elif kind == "conversion":
+                yield sse("conversion", conversion_payload(data))
+            elif kind == "parts":
+                yield sse("parts", [conversion_payload(row) for row in data])
+            elif kind == "saved":
+                done_sent = True
+                if on_done:
+                    on_done(data)
+                yield sse("done", done_payload(data))
+            elif kind == "result":
+                if not data["run_id"]:
+                    yield sse("error", {"detail": "Calculation failed"})
+                elif not done_sent:
+                    # Shared another request's run: nothing was streamed, so send what it stored
+                    yield from stored_events(data["run_id"])
+                    if on_done:
+                        on_done(data)
+                    yield sse("done", done_payload(data))
+                return
+            else:
+                yield sse("error", {"detail": str(data)})
+                return
+            item = self._events.get()
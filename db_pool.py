@@ -0,0 +1,171 @@
+from collections import deque
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+import os
+import threading
+import time
+
+# Connection pool sizing and telemetry for the server database.
+#
+# Sizing: the connections the database allows us, less DB_RESERVED_CONNECTIONS kept back for
+# migrations, psql and the retention/cron jobs, are split between everything that connects. Each of
+# the WEB_CONCURRENCY worker processes runs BATCH_WORKERS batch processes when BATCH_PROCESSES is on
+# (see batch_calc.py); those evaluate one profile at a time on one session, so each holds at most one
+# connection. The rest is shared equally by the workers' pools: a primary pool, plus a replica pool
+# when REPLICA_DATABASE_URL is set (counted against the same budget, as it is when the replica sits
+# behind the same server or pooler):
+#     available = DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS - WEB_CONCURRENCY * batch processes
+#     share = available // (WEB_CONCURRENCY * (2 if replica else 1))
+#     pool_size = min(share, DB_POOL_SIZE_CAP), max_overflow = min(share - pool_size, pool_size)
+# DB_POOL_SIZE / DB_MAX_OVERFLOW override the derived values. Set WEB_CONCURRENCY to the real worker
+# count: with the default of 1, several workers would each size for the whole budget.
+#
+# Liveness: instead of a pre-ping round trip on every checkout, connections are recycled after
+# DB_POOL_RECYCLE seconds (below the server / proxy idle timeout), and a connection that does fail
+# is invalidated by SQLAlchemy's disconnect handling. DB_POOL_PRE_PING=1 turns pre-ping back on.
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "97"))  # Postgres default 100 minus superuser slots
+DB_RESERVED_CONNECTIONS = int(os.getenv("DB_RESERVED_CONNECTIONS", "10"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))  # Worker processes sharing the database
+DB_POOL_SIZE_CAP = int(os.getenv("DB_POOL_SIZE_CAP", "10"))
+# The batch and replica settings batch_calc.py and create_retire_database.py read (not imported: both import this module)
+BATCH_PROCESS_COUNT = int(os.getenv("BATCH_WORKERS", "2")) if os.getenv("BATCH_PROCESSES", "1") == "1" else 0
+REPLICA_CONFIGURED = bool(os.getenv("REPLICA_DATABASE_URL"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "0") == "1"
+WAIT_SAMPLES = 1000  # Recent checkout waits kept for percentiles
+
+def pool_settings():
+    """create_engine pool arguments for this process"""
+    workers = max(1, WEB_CONCURRENCY)
+    available = DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS - workers * BATCH_PROCESS_COUNT
+    share = max(2, available // (workers * (2 if REPLICA_CONFIGURED else 1)))
+    pool_size = int(os.getenv("DB_POOL_SIZE") or min(share, DB_POOL_SIZE_CAP))
+    max_overflow = int(os.getenv("DB_MAX_OVERFLOW") or min(max(0, share - pool_size), pool_size))
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+class PoolTelemetry:
+    """Checkout wait, usage and failure counters for one engine's pool"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self.pool = None
+        self.checkouts = 0
+        self.waited = 0          # Checkouts that found no idle connection and had to wait
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidated = 0     # Connections thrown away after an error (includes failed pre-pings)
+        self.disconnects = 0     # Statements that failed because the connection was gone
+        self.peak_in_use = 0
+        self.peak_overflow = 0
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            self._waits.append(seconds)
+            if seconds > 0.001:
+                self.waited += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def record_checkout(self, pool):
+        with self._lock:
+            self.checkouts += 1
+            if isinstance(pool, QueuePool):
+                self.peak_in_use = max(self.peak_in_use, pool.checkedout())
+                self.peak_overflow = max(self.peak_overflow, pool.overflow())
+
+    def increment(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def info(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            pool = self.pool if isinstance(self.pool, QueuePool) else None  # StaticPool (in-memory SQLite) has no sizing
+            return {
+                "size": pool.size() if pool is not None else None,
+                "max_overflow": getattr(pool, "_max_overflow", None),
+                "in_use": pool.checkedout() if pool is not None else None,
+                "idle": pool.checkedin() if pool is not None else None,
+                "overflow_in_use": max(0, pool.overflow()) if pool is not None else None,
+                "peak_in_use": self.peak_in_use,
+                "peak_overflow": max(0, self.peak_overflow),
+                "checkouts": self.checkouts,
+                "waited": self.waited,
+                "timeouts": self.timeouts,
+                "wait_ms_mean": round(1000 * self.wait_seconds / len(self._waits), 3) if self._waits else None,
+                "wait_ms_p95": round(1000 * waits[int(0.95 * (len(waits) - 1))], 3) if waits else None,
+                "wait_ms_max": round(1000 * self.max_wait_seconds, 3),
+                "connects": self.connects,
+                "invalidated": self.invalidated,
+                "disconnects": self.disconnects,
+            }
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times each checkout, including time spent waiting for a free connection"""
+    telemetry = None  # Set on the per-engine subclass made by instrumented_pool_class()
+    _local = threading.local()
+
+    def _do_get(self):
+        if getattr(self._local, "timing", False):
+            return super()._do_get()  # QueuePool retries by calling _do_get again; time the outer call only
+        self._local.timing = True
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.telemetry.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        finally:
+            self._local.timing = False
+        self.telemetry.record_wait(time.perf_counter() - started)
+        return connection
+
+def instrumented_pool_class(telemetry):
+    """A pool class bound to telemetry; the binding survives engine.dispose(), which recreates the pool"""
+    return type("InstrumentedQueuePool", (InstrumentedQueuePool,), {"telemetry": telemetry})
+
+def instrument_engine(engine, telemetry):
+    """Hook pool and engine events into telemetry"""
+    telemetry.pool = engine.pool
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        telemetry.pool = engine.pool  # engine.dispose() swaps in a new pool
+        telemetry.record_checkout(engine.pool)
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        telemetry.increment("connects")
+
+    @event.listens_for(engine, "invalidate")
+    def _invalidate(dbapi_connection, connection_record, exception):
+        telemetry.increment("invalidated")
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        if context.is_disconnect:
+            telemetry.increment("disconnects")
+
+pool_telemetry = {}  # Engine name ("primary", "replica") -> PoolTelemetry
+
+def is_pool_timeout(exc):
+    """True if exc, or the exception it was raised while handling, is a pool checkout timeout"""
+    while exc is not None:
+        if isinstance(exc, PoolTimeoutError):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
@@ -0,0 +1,116 @@
+from create_retire_database import REPLICA_DB_URL, DB_URL, ReplicaSessionLocal, SessionLocal
+from sqlalchemy.engine import make_url
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+# Read routing. With REPLICA_DATABASE_URL set, read-only endpoints (run results, profile and input
+# reads) query the replica and everything else uses the primary. Replicas lag,
+# so for READ_YOUR_WRITES_SECONDS after a calculation or profile write, reads of that run_id or
+# user_id stay on the primary. Pins are per worker process; run reads that find nothing on the
+# replica are also retried on the primary, which covers a run written through another worker.
+#
+# Locally, point DATABASE_URL and REPLICA_DATABASE_URL at two SQLite files and copy the primary
+# across whenever the "replica" should catch up:
+#   python db_routing.py sync-sqlite
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "10"))
+
+class PrimaryPins:
+    """Keys (("run", id) or ("user", id)) whose reads go to the primary until their pin expires"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._lock = threading.Lock()
+        self._expires = {}
+        self.counts = {"replica": 0, "primary": 0, "pinned": 0, "fallback": 0}
+
+    def pin(self, key):
+        with self._lock:
+            now = time.monotonic()
+            if len(self._expires) > 10000:
+                self._expires = {k: t for k, t in self._expires.items() if t > now}
+            self._expires[key] = now + self.seconds
+
+    def pinned(self, key):
+        with self._lock:
+            expires = self._expires.get(key)
+            if expires is None:
+                return False
+            if expires <= time.monotonic():
+                del self._expires[key]
+                return False
+            return True
+
+    def count(self, route):
+        with self._lock:
+            self.counts[route] += 1
+
+    def info(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "replica_configured": ReplicaSessionLocal is not None,
+                "pinned_keys": sum(1 for t in self._expires.values() if t > now),
+                "reads": dict(self.counts),
+            }
+
+primary_pins = PrimaryPins(READ_YOUR_WRITES_SECONDS)
+
+def pin_writes(user_id=None, run_id=None):
+    """Keep this user's / run's reads on the primary for a while after a committed write"""
+    if ReplicaSessionLocal is None:
+        return
+    if user_id is not None:
+        primary_pins.pin(("user", user_id))
+    if run_id is not None:
+        primary_pins.pin(("run", run_id))
+
+def read_session(user_id=None, run_id=None):
+    """(session, on_replica) for a read-only request about this user or run"""
+    if ReplicaSessionLocal is None:
+        primary_pins.count("primary")
+        return SessionLocal(), False
+    if (user_id is not None and primary_pins.pinned(("user", user_id))) or \
+            (run_id is not None and primary_pins.pinned(("run", run_id))):
+        primary_pins.count("pinned")
+        return SessionLocal(), False
+    primary_pins.count("replica")
+    return ReplicaSessionLocal(), True
+
+def read(fn, user_id=None, run_id=None):
+    """fn(session) on the replica when allowed; an empty result from the replica is re-read on the primary"""
+    session, on_replica = read_session(user_id=user_id, run_id=run_id)
+    try:
+        result = fn(session)
+    finally:
+        session.close()
+    if on_replica and not result:
+        primary_pins.count("fallback")
+        session = SessionLocal()
+        try:
+            result = fn(session)
+        finally:
+            session.close()
+    return result
+
+def sync_sqlite(primary_url=DB_URL, replica_url=REPLICA_DB_URL):
+    """Copy a SQLite primary over a SQLite replica with the online backup API (local testing only)"""
+    primary, replica = make_url(primary_url), make_url(replica_url or "")
+    if primary.get_backend_name() != "sqlite" or replica.get_backend_name() != "sqlite" or not replica.database:
+        raise ValueError("sync-sqlite needs SQLite file URLs in DATABASE_URL and REPLICA_DATABASE_URL")
+    source = sqlite3.connect(primary.database)
+    target = sqlite3.connect(replica.database)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    print(f"Copied {primary.database} -> {replica.database}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read-replica helpers")
+    parser.add_argument("command", choices=["sync-sqlite"])
+    parser.parse_args()
+    sync_sqlite()
@@ -0,0 +1,208 @@
+from decimal import Decimal
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, Numeric, String, Text, select
+from create_retire_database import RetireYrData, RetireYrSeries, RothConversions, RothConversionsParts, SessionLocal
+from retire_yr_series import decode_series, series_years, writes_rows
+import argparse
+import csv
+import io
+import sys
+
+# Streaming export of stored run results. Rows are read through a server-side cursor (yield_per) in
+# chunks of EXPORT_CHUNK_ROWS and written out chunk by chunk - CSV text, or one Parquet row group per
+# chunk - so memory stays flat whether the export is one run or every run in the database.
+#
+#   python export_runs.py retire_yr_data --run-id 42 --output run42.csv
+#   python export_runs.py roth_conversions --format parquet --output all_conversions.parquet
+#
+# Parquet needs pyarrow (pip install pyarrow); CSV has no extra dependencies.
+EXPORT_CHUNK_ROWS = 5000
+
+EXPORT_TABLES = {
+    "retire_yr_data": RetireYrData,
+    "roth_conversions": RothConversions,
+    "roth_conversions_parts": RothConversionsParts,
+}
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+def export_columns(model):
+    return list(model.__table__.columns)
+
+def _filtered(stmt, model, run_id, user_id):
+    if run_id is not None:
+        stmt = stmt.where(model.run_id == run_id)
+    if user_id is not None:
+        stmt = stmt.where(model.user_id == user_id)
+    return stmt
+
+def _row_chunks(session, model, run_id, user_id, chunk_rows):
+    """Lists of row tuples (table column order, primary-key order) read through a server-side cursor"""
+    table = model.__table__
+    stmt = _filtered(select(*table.columns), model, run_id, user_id).order_by(*table.primary_key.columns)
+    result = session.execute(stmt.execution_options(yield_per=chunk_rows))
+    for partition in result.partitions():
+        yield [tuple(row) for row in partition]
+
+def _series_chunks(session, run_id, user_id, chunk_rows):
+    """retire_yr_data-shaped row tuples decoded from retire_yr_series, for trees storing only the packed layout"""
+    columns = [c.name for c in export_columns(RetireYrData)]
+    scales = {c.name: c.type.scale for c in export_columns(RetireYrData) if isinstance(c.type, Numeric)}
+    stmt = _filtered(select(RetireYrSeries), RetireYrSeries, run_id, user_id).order_by(
+        RetireYrSeries.run_id, RetireYrSeries.conv_group_num
+    )
+    value_fields = [name for name in columns if name in scales]
+    chunk = []
+    for series_row in session.scalars(stmt.execution_options(yield_per=max(1, chunk_rows // 40))):
+        decoded = decode_series(series_row, value_fields)
+        years, ages = series_years(series_row)
+        for i, (year, age) in enumerate(zip(years, ages)):
+            values = {
+                "run_id": series_row.run_id, "user_id": series_row.user_id,
+                "conv_group_num": series_row.conv_group_num, "year": year, "age": age,
+            }
+            for name in value_fields:
+                values[name] = Decimal(repr(decoded[name][i])).quantize(Decimal(1).scaleb(-scales[name]))
+            chunk.append(tuple(values[name] for name in columns))
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _year_chunks(session, run_id, user_id, chunk_rows):
+    """retire_yr_data from the configured layout, or the other one if that holds nothing for this run/user"""
+    from_rows = lambda: _row_chunks(session, RetireYrData, run_id, user_id, chunk_rows)
+    from_series = lambda: _series_chunks(session, run_id, user_id, chunk_rows)
+    first, second = (from_rows, from_series) if writes_rows() else (from_series, from_rows)
+    found = False
+    for chunk in first():
+        found = True
+        yield chunk
+    if not found:
+        yield from second()
+
+def iter_chunks(session, table_name, run_id=None, user_id=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    model = EXPORT_TABLES[table_name]
+    if model is RetireYrData:
+        return _year_chunks(session, run_id, user_id, chunk_rows)
+    return _row_chunks(session, model, run_id, user_id, chunk_rows)
+
+def stream_csv(table_name, run_id=None, user_id=None, chunk_rows=EXPORT_CHUNK_ROWS, session_factory=SessionLocal):
+    """CSV text chunks: a header line, then one chunk per cursor batch"""
+    session = session_factory()
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([c.name for c in export_columns(EXPORT_TABLES[table_name])])
+        for chunk in iter_chunks(session, table_name, run_id, user_id, chunk_rows):
+            writer.writerows(chunk)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        session.close()
+
+def _arrow_schema(model):
+    import pyarrow as pa
+    fields = []
+    for column in export_columns(model):
+        column_type = column.type
+        if isinstance(column_type, Numeric) and not isinstance(column_type, Float):
+            arrow_type = pa.decimal128(column_type.precision, column_type.scale)
+        elif isinstance(column_type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(column_type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column_type, DateTime):
+            arrow_type = pa.timestamp("us")
+        elif isinstance(column_type, Date):
+            arrow_type = pa.date32()
+        elif isinstance(column_type, Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(column_type, (String, Text)):
+            arrow_type = pa.string()
+        else:
+            raise TypeError(f"No Parquet type for {model.__tablename__}.{column.name}")
+        fields.append(pa.field(column.name, arrow_type, nullable=column.nullable))
+    return pa.schema(fields)
+
+class _ChunkSink:
+    """Write-only file object ParquetWriter writes into; the export drains it after each row group"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+def stream_parquet(table_name, run_id=None, user_id=None, chunk_rows=EXPORT_CHUNK_ROWS, session_factory=SessionLocal):
+    """Parquet file bytes: one row group per cursor batch, emitted as each group is written"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    model = EXPORT_TABLES[table_name]
+    schema = _arrow_schema(model)
+    sink = _ChunkSink()
+    session = session_factory()
+    try:
+        with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+            for chunk in iter_chunks(session, table_name, run_id, user_id, chunk_rows):
+                columns = list(zip(*chunk))
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, type=schema.field(i).type) for i, values in enumerate(columns)], schema=schema
+                ))
+                yield sink.drain()
+        yield sink.drain()  # Footer
+    finally:
+        session.close()
+
+def stream_export(table_name, export_format, run_id=None, user_id=None, chunk_rows=EXPORT_CHUNK_ROWS, session_factory=SessionLocal):
+    if export_format == "parquet":
+        import pyarrow  # noqa: F401 - fail before streaming starts if the optional dependency is missing
+        return stream_parquet(table_name, run_id, user_id, chunk_rows, session_factory)
+    return stream_csv(table_name, run_id, user_id, chunk_rows, session_factory)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export stored run results as CSV or Parquet")
+    parser.add_argument("table", choices=sorted(EXPORT_TABLES))
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--run-id", type=int, help="Only this run (default: every run)")
+    parser.add_argument("--user-id", type=int, help="Only this user's runs")
+    parser.add_argument("--output", help="File to write (default: stdout, CSV only)")
+    parser.add_argument("--chunk-rows", type=int, default=EXPORT_CHUNK_ROWS, help="Rows fetched and written per batch")
+    args = parser.parse_args()
+    if args.format == "parquet" and not args.output:
+        parser.error("--output is required for Parquet")
+
+    chunks = stream_export(args.table, args.format, args.run_id, args.user_id, args.chunk_rows)
+    if args.output:
+        with open(args.output, "wb") as out:
+            for chunk in chunks:
+                out.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        print(f"Wrote {args.table} to {args.output}")
+    else:
+        for chunk in chunks:
+            sys.stdout.write(chunk)
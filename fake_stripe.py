@@ -0,0 +1,204 @@
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Local stand-in for Stripe's webhook sender: builds checkout.session.completed events, signs them
+# the way Stripe does (Stripe-Signature: t=<timestamp>,v1=<HMAC-SHA256 of "<t>.<payload>">) with
+# STRIPE_WEBHOOK_SECRET, and replays bursts with duplicate, out-of-order and concurrent deliveries.
+#
+#   STRIPE_WEBHOOK_SECRET=whsec_test python fake_stripe.py --user-id 1 --events 20 --duplicates 5
+#
+# The app must run with the same STRIPE_WEBHOOK_SECRET. Afterwards the ledger should hold each event
+# once, with its delivery count, and the user should have been updated once per distinct event.
+#
+# With --serve-api it is instead a stand-in for the Stripe API's checkout endpoint, slow or failing on
+# demand, for testing how checkout behaves when the provider degrades (see stripe_checkout.py):
+#
+#   python fake_stripe.py --serve-api --latency 1 --failure-rate 0.3 --hang-rate 0.1
+#   STRIPE_API_BASE=http://127.0.0.1:12111 STRIPE_SECRET_KEY=sk_test_fake uvicorn main:app
+
+def sign(payload, secret, timestamp=None):
+    """Stripe-Signature header value for a payload"""
+    timestamp = int(timestamp or time.time())
+    signed = f"{timestamp}.{payload}".encode("utf-8")
+    signature = hmac.new(secret.encode("utf-8"), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+def checkout_completed_event(user_id=None, email=None, amount_cents=2500):
+    """A checkout.session.completed event shaped like the ones Stripe sends"""
+    return {
+        "id": f"evt_fake_{uuid.uuid4().hex[:24]}",
+        "object": "event",
+        "type": "checkout.session.completed",
+        "created": int(time.time()),
+        "data": {
+            "object": {
+                "id": f"cs_fake_{uuid.uuid4().hex[:24]}",
+                "object": "checkout.session",
+                "amount_total": amount_cents,
+                "payment_intent": f"pi_fake_{uuid.uuid4().hex[:24]}",
+                "customer_details": {"email": email},
+                "metadata": {"user_id": str(user_id)} if user_id else {},
+            }
+        },
+    }
+
+def deliver(base_url, event, secret, timeout=10):
+    """POST one event to the webhook; returns (HTTP status, response JSON or None)"""
+    payload = json.dumps(event)
+    req = urllib.request.Request(base_url + "/stripe-webhook", data=payload.encode("utf-8"), method="POST")
+    req.add_header("Content-Type", "application/json")
+    req.add_header("Stripe-Signature", sign(payload, secret))
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, json.loads(resp.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, None
+    except (urllib.error.URLError, OSError):
+        return None, None
+
+def replay_burst(base_url, events, secret, duplicates, concurrency):
+    """Deliver every event 1 + duplicates times, shuffled, from concurrency threads; returns response counts"""
+    deliveries = [event for event in events for _ in range(1 + duplicates)]
+    random.shuffle(deliveries)
+    counts = {}
+    lock = threading.Lock()
+
+    def send(event):
+        status, body = deliver(base_url, event, secret)
+        key = f"{status} {body.get('status') if body else ''}".strip()
+        with lock:
+            counts[key] = counts.get(key, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, deliveries))
+    return counts
+
+class FakeCheckoutAPI(BaseHTTPRequestHandler):
+    """POST /v1/checkout/sessions with configurable latency, 500s and hangs. Like Stripe, a repeated
+    Idempotency-Key gets the response of the first successful request back."""
+    latency = 0.0
+    failure_rate = 0.0
+    hang_rate = 0.0
+    hang_seconds = 60.0
+    sessions = {}  # Idempotency-Key -> session JSON
+    counts = {"requests": 0, "created": 0, "replayed": 0, "failed": 0, "hung": 0}
+    lock = threading.Lock()
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client timed out and hung up
+
+    def _count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+            return dict(self.counts)
+
+    def do_POST(self):
+        params = parse_qs(self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8"))
+        if self.path != "/v1/checkout/sessions":
+            return self._send(404, {"error": {"type": "invalid_request_error", "message": f"Unrecognized request URL ({self.path})"}})
+        self._count("requests")
+        time.sleep(self.latency)
+        roll = random.random()
+        if roll < self.hang_rate:
+            print(f"hang       {self._count('hung')}")
+            time.sleep(self.hang_seconds)
+            return self._send(500, {"error": {"type": "api_error", "message": "Fake stall"}})
+        if roll < self.hang_rate + self.failure_rate:
+            print(f"500        {self._count('failed')}")
+            return self._send(500, {"error": {"type": "api_error", "message": "Fake outage"}})
+
+        key = self.headers.get("Idempotency-Key") or uuid.uuid4().hex
+        with self.lock:
+            session = self.sessions.get(key)
+            replayed = session is not None
+            if session is None:
+                session_id = f"cs_fake_{uuid.uuid4().hex[:24]}"
+                session = self.sessions[key] = {
+                    "id": session_id,
+                    "object": "checkout.session",
+                    "customer_email": params.get("customer_email", [None])[0],
+                    "metadata": {"user_id": params.get("metadata[user_id]", [None])[0]},
+                    "mode": params.get("mode", [None])[0],
+                    "url": f"http://127.0.0.1:{self.server.server_port}/pay/{session_id}",
+                }
+        counts = self._count("replayed" if replayed else "created")
+        print(f"{'replayed' if replayed else 'created':<10} {session['id']} {counts}")
+        self._send(200, session)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_api(port, latency, failure_rate, hang_rate, hang_seconds):
+    FakeCheckoutAPI.latency = latency
+    FakeCheckoutAPI.failure_rate = failure_rate
+    FakeCheckoutAPI.hang_rate = hang_rate
+    FakeCheckoutAPI.hang_seconds = hang_seconds
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeCheckoutAPI)
+    server.daemon_threads = True
+    print(f"Fake Stripe API on http://127.0.0.1:{port} (latency {latency}s, failure rate {failure_rate}, hang rate {hang_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay signed Stripe webhook events against the app, or serve a fake checkout API")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--user-id", type=int, help="User the checkout events pay for (metadata.user_id)")
+    parser.add_argument("--email", help="Customer email on the events")
+    parser.add_argument("--events", type=int, default=10, help="Distinct events to send")
+    parser.add_argument("--duplicates", type=int, default=3, help="Extra deliveries of each event")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel deliveries")
+    parser.add_argument("--amount-cents", type=int, default=2500)
+    parser.add_argument("--serve-api", action="store_true", help="Serve a fake checkout API instead of sending webhooks")
+    parser.add_argument("--port", type=int, default=12111, help="Fake API port")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake API: seconds before every response")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fake API: share of requests answered with a 500")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Fake API: share of requests left hanging")
+    parser.add_argument("--hang-seconds", type=float, default=60.0, help="Fake API: how long a hung request hangs")
+    args = parser.parse_args()
+
+    if args.serve_api:
+        serve_api(args.port, args.latency, args.failure_rate, args.hang_rate, args.hang_seconds)
+        return
+
+    secret = os.getenv("STRIPE_WEBHOOK_SECRET")
+    if not secret:
+        print("Set STRIPE_WEBHOOK_SECRET to the secret the app verifies with")
+        sys.exit(1)
+
+    events = [checkout_completed_event(args.user_id, args.email, args.amount_cents) for _ in range(args.events)]
+    start = time.perf_counter()
+    counts = replay_burst(args.base_url.rstrip("/"), events, secret, args.duplicates, args.concurrency)
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+    print(f"{total} deliveries of {len(events)} events in {elapsed:.2f}s ({total / elapsed:.0f}/s)")
+    for key, count in sorted(counts.items()):
+        print(f"  {key:<20} {count}")
+    print(f"Expected: {len(events)} success, {len(events) * args.duplicates} duplicate")
+
+if __name__ == "__main__":
+    main()
@@ -209,7 +209,21 @@ export const useConversions = (runId) => {
     setDistributionSchedule(null);
 
     try {
-      const result = await apiService.runFullCalculation(userId);
+      let result;
+      let streamed = false;
+      try {
+        // Fill the tables in as the groups arrive instead of waiting for the whole run
+        result = await apiService.streamFullCalculation(userId, (name, partial) => {
+          streamed = true;
+          setConversions(partial.conversions);
+          setParts(partial.parts);
+          setRetireYearData(partial.retireYearData);
+        });
+      } catch (streamErr) {
+        if (streamed || streamErr.status === 429) throw streamErr;
+        console.warn('Streaming calculation unavailable, falling back:', streamErr.message);
+        result = await apiService.runFullCalculation(userId);
+      }
       setConversions(result.conversions);
       setParts(result.parts);
       setRetireYearData(result.retireYearData);
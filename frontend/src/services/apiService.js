@@ -81,6 +81,17 @@ export const apiService = {
     return response.data;
   },
 
+  // Column-wise year data for the charted groups/fields only, e.g. (runId, ['fed_tax_opt'], 'all')
+  getRetireYearSeries: async (runId, fields, groups = [0]) => {
+    const response = await api.get(`/retire_yr_data/${runId}`, {
+      params: {
+        fields: fields.join(','),
+        groups: Array.isArray(groups) ? groups.join(',') : groups
+      }
+    });
+    return response.data;
+  },
+
   getDistributionSchedule: async (runId) => {
     const response = await api.get(`/distribution_schedule/${runId}`);
     return response.data;
@@ -122,6 +133,53 @@ export const apiService = {
     }
   },
 
+  // Same result as runFullCalculation, streamed: onEvent(name, data) is called for the baseline
+  // group, each conversion group as it is computed, and the parts table, before the run is saved
+  streamFullCalculation: async (userId, onEvent = () => {}) => {
+    const response = await fetch(`${API_BASE_URL}/calculate-yr-data/${userId}/stream`, { method: 'POST' });
+    if (!response.ok || !response.body) {
+      const body = await response.json().catch(() => ({}));
+      const error = new Error(body.detail || `HTTP ${response.status}`);
+      error.status = response.status;
+      throw error;
+    }
+
+    const result = { conversions: [], parts: [], retireYearData: [] };
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const block = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        const name = block.match(/^event: (.*)$/m)?.[1];
+        const data = JSON.parse(block.match(/^data: (.*)$/m)?.[1] ?? 'null');
+        if (name === 'error') throw new Error(data?.detail || 'Calculation failed');
+        if (name === 'baseline') result.retireYearData = data.records;
+        if (name === 'conversion') result.conversions = [...result.conversions, data];
+        if (name === 'parts') result.parts = data;
+        if (name === 'done') {
+          return {
+            ...result,
+            runId: data.run_id,
+            recordsCreated: data.records_created,
+            calcCount: data.calc_count,
+            subscriptionStatus: data.subscription_status,
+            distribution: data.distribution,
+            annuity_factor_multiple: data.annuity_factor_multiple,
+            base_duration: data.base_duration
+          };
+        }
+        onEvent(name, result);
+      }
+    }
+    throw new Error('Calculation failed: stream ended early');
+  },
+
   // Rating endpoints
   submitRating: async (ratingData) => {
     const response = await api.post('/ratings', ratingData);
@@ -0,0 +1,61 @@
+from sqlalchemy import lambda_stmt, select
+from create_retire_database import CalculationRun, Input, RetireYrData, RothConversions, RothConversionsParts, User
+
+# Hot read statements. Each lookup is a lambda statement over a Core select built once at import:
+# SQLAlchemy keys its compiled-SQL cache on the lambda's code location, so a call only binds the
+# closure values (run_id, user_id) - no Query object, no cache-key walk of the whole statement, no
+# recompilation. Results are plain Rows (tuples with attribute access, same names as the model
+# columns) instead of ORM entities, so nothing goes through the identity map or attribute
+# instrumentation. Use these for read-only paths only; anything that modifies a row loads the entity.
+#
+#   python query_benchmark.py   # per-call CPU of these vs. the equivalent session.query() lookups
+
+# Profile columns the read endpoints and the engine use (never the password hash)
+USER_PROFILE_COLUMNS = (
+    User.user_id, User.username, User.email, User.birth_date, User.marital_status,
+    User.birth_date_spouse, User.trad_savings, User.roth_savings,
+)
+# Fields /retire_yr_data returns alongside year and age
+RETIRE_YR_API_FIELDS = [
+    "ss_benefit", "trad_dist_opt", "roth_dist_opt", "fed_tax_opt", "after_tax_dist_opt", "atcf_opt",
+    "pct_ss_taxed_opt", "trad_dist_opt_tax_rate", "trad_mtr_adj_opt"
+]
+
+_USER_PROFILE = select(*USER_PROFILE_COLUMNS)
+_LATEST_INPUT = select(Input.__table__).order_by(Input.input_timestamp.desc()).limit(1)
+_RUN_DISTRIBUTION = select(CalculationRun.distribution, CalculationRun.annuity_factor_multiple, CalculationRun.base_duration)
+_ROTH_CONVERSIONS = select(RothConversions.__table__).order_by(RothConversions.conv_group_num)
+_ROTH_CONVERSIONS_PARTS = select(RothConversionsParts.__table__).order_by(RothConversionsParts.conv_group_num)
+_RETIRE_YR_API = select(
+    RetireYrData.year, RetireYrData.age, *(getattr(RetireYrData, name) for name in RETIRE_YR_API_FIELDS)
+).order_by(RetireYrData.year)
+
+def active_user(session, user_id):
+    """Profile row of a user who has not deleted their account, or None"""
+    return session.execute(
+        lambda_stmt(lambda: _USER_PROFILE.where(User.user_id == user_id, User.deleted_at.is_(None)))
+    ).first()
+
+def latest_input(session, user_id):
+    """The user's most recent inputs row, or None"""
+    return session.execute(lambda_stmt(lambda: _LATEST_INPUT.where(Input.user_id == user_id))).first()
+
+def run_distribution(session, run_id):
+    """distribution, annuity_factor_multiple and base_duration of a run, or None"""
+    return session.execute(lambda_stmt(lambda: _RUN_DISTRIBUTION.where(CalculationRun.run_id == run_id))).first()
+
+def roth_conversions(session, run_id):
+    """A run's roth_conversions rows by conv_group_num"""
+    return session.execute(lambda_stmt(lambda: _ROTH_CONVERSIONS.where(RothConversions.run_id == run_id))).all()
+
+def roth_conversions_parts(session, run_id):
+    """A run's roth_conversions_parts rows by conv_group_num"""
+    return session.execute(
+        lambda_stmt(lambda: _ROTH_CONVERSIONS_PARTS.where(RothConversionsParts.run_id == run_id))
+    ).all()
+
+def retire_yr_api_rows(session, run_id):
+    """year, age and RETIRE_YR_API_FIELDS of a run's base (conv_group_num=0) year rows, by year"""
+    return session.execute(
+        lambda_stmt(lambda: _RETIRE_YR_API.where(RetireYrData.run_id == run_id, RetireYrData.conv_group_num == 0))
+    ).all()
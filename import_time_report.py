@@ -0,0 +1,99 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+# Cold-start report for the API process: how long `import main` takes in a fresh interpreter, and
+# which modules account for it (python -X importtime).
+#
+#   python import_time_report.py
+#   python import_time_report.py --budget-ms 800 --runs 5   # exits 1 if over budget (for CI)
+#
+# The budget check also fails if a dependency that main.py loads on first use is imported eagerly.
+
+APP_DIR = Path(__file__).parent
+
+# Imported on first use (see get_stripe() in main.py and compute_retire_and_conversions)
+LAZY_MODULES = ("stripe", "bcrypt", "numpy", "numpy_financial")
+
+TIMED_IMPORT = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import main\n"
+    "elapsed = time.perf_counter() - start\n"
+    "print(elapsed)\n"
+    "print(','.join(m for m in {lazy!r} if m in sys.modules))\n"
+)
+
+def run_python(code, env, importtime=False):
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    return subprocess.run(args, cwd=APP_DIR, env=env, capture_output=True, text=True, check=True)
+
+def time_cold_import(env):
+    """Seconds to import main in a fresh interpreter, and any lazy modules it pulled in"""
+    out = run_python(TIMED_IMPORT.format(lazy=LAZY_MODULES), env).stdout.splitlines()
+    return float(out[-2]), [m for m in out[-1].split(",") if m]
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us)] from -X importtime output"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+def print_report(modules, top):
+    top_level = [m for m in modules if not m[0].startswith(" ") and "." not in m[0]]
+    print(f"{'Slowest imports (cumulative)':<44} {'Self ms':>9} {'Cum ms':>9}")
+    print("-" * 64)
+    for name, self_us, cumulative_us in sorted(modules, key=lambda m: m[2], reverse=True)[:top]:
+        print(f"{name:<44} {self_us / 1000:9.1f} {cumulative_us / 1000:9.1f}")
+    print()
+    print(f"{'Top-level packages':<44} {'':>9} {'Cum ms':>9}")
+    print("-" * 64)
+    for name, _, cumulative_us in sorted(top_level, key=lambda m: m[2], reverse=True)[:top]:
+        print(f"{name:<44} {'':>9} {cumulative_us / 1000:9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold import time of the API module")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters to time (median is reported)")
+    parser.add_argument("--top", type=int, default=15, help="Rows to show in the module breakdown")
+    parser.add_argument("--budget-ms", type=float, help="Fail if the median cold import exceeds this")
+    parser.add_argument("--db-url", help="DATABASE_URL for the import (default: inherited environment)")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.db_url:
+        env["DATABASE_URL"] = args.db_url
+
+    modules = parse_importtime(run_python("import main", env, importtime=True).stderr)
+    print_report(modules, args.top)
+
+    timings = []
+    eager = []
+    for _ in range(args.runs):
+        elapsed, eager = time_cold_import(env)
+        timings.append(elapsed * 1000)
+    median_ms = statistics.median(timings)
+    print()
+    print(f"Cold import of main: median {median_ms:.0f} ms over {args.runs} run(s) "
+          f"(min {min(timings):.0f}, max {max(timings):.0f})")
+
+    failed = False
+    if eager:
+        print(f"FAIL: imported eagerly, should load on first use: {', '.join(eager)}")
+        failed = True
+    if args.budget_ms is not None:
+        if median_ms > args.budget_ms:
+            print(f"FAIL: {median_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+            failed = True
+        else:
+            print(f"OK: within the {args.budget_ms:.0f} ms budget")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
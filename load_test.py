@@ -0,0 +1,260 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Replays the frontend's traffic mix (see apiService.runFullCalculation in
+# frontend/src/services/apiService.js) against a running app.
+#
+#   python load_test.py --users 20 --duration 60 --think-time 2
+#   python load_test.py --base-url http://localhost:8000 --users 5 --iterations 10
+#
+# Without --base-url a throwaway app is started on a temporary database and
+# torn down afterwards.
+
+APP_DIR = Path(__file__).parent
+
+SAMPLE_PROFILE = {
+    "birth_date": "1965-06-15",
+    "marital_status": "M",
+    "birth_date_spouse": "1966-03-01",
+    "trad_savings": 1200000.00,
+    "roth_savings": 150000.00,
+}
+
+SAMPLE_INPUTS = {
+    "soc_sec_benefit": 36000.00,
+    "salary": 120000.00,
+    "cont_return_assum": 0.07,
+    "dist_return_assum": 0.05,
+    "trad_cont_annual": 23000.00,
+    "inflation_assum": 0.025,
+    "soc_sec_grw_assum": 0.02,
+    "retire_tax_hl": 1,
+    "contribution_status": "M",
+    "distribution_status": "M",
+    "life_years": 30,
+}
+
+
+class Stats:
+    """Thread-safe per-endpoint latency and error collector"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.flows = 0
+        self.flow_errors = 0
+
+    def record(self, label, elapsed, ok):
+        with self.lock:
+            self.latencies.setdefault(label, []).append(elapsed)
+            if not ok:
+                self.errors[label] = self.errors.get(label, 0) + 1
+
+    def record_flow(self, ok):
+        with self.lock:
+            self.flows += 1
+            if not ok:
+                self.flow_errors += 1
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def request(stats, base_url, method, path, label, body=None, timeout=30):
+    """Issue one HTTP request, record its latency and return the decoded JSON (None on failure)"""
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method)
+    if data is not None:
+        req.add_header("Content-Type", "application/json")
+    start = time.perf_counter()
+    ok = False
+    payload = None
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            payload = json.loads(resp.read() or b"null")
+            ok = 200 <= resp.status < 300
+    except (urllib.error.URLError, OSError, ValueError):
+        ok = False
+    stats.record(label, time.perf_counter() - start, ok)
+    return payload if ok else None
+
+
+def create_virtual_user(stats, base_url, run_tag, index):
+    """Sign up one virtual user and return (user_id, username, password)"""
+    username = f"lt_{run_tag}_{index}"
+    password = "load-test-pw"
+    body = dict(SAMPLE_PROFILE, username=username, password=password, email=f"{username}@loadtest.local")
+    created = request(stats, base_url, "POST", "/users", "POST /users", body)
+    if not created:
+        return None
+    return created["user_id"], username, password
+
+
+def run_flow(stats, base_url, fetch_pool, user_id, username, password):
+    """One pass of the frontend flow: login, profile fetch, save inputs, calculate, fetch results"""
+    if request(stats, base_url, "POST", "/login", "POST /login", {"username": username, "password": password}) is None:
+        return False
+    if request(stats, base_url, "GET", f"/users/{user_id}", "GET /users/{id}") is None:
+        return False
+
+    inputs = dict(SAMPLE_INPUTS, user_id=user_id,
+                  trad_savings=SAMPLE_PROFILE["trad_savings"] * random.uniform(0.5, 1.5),
+                  roth_savings=SAMPLE_PROFILE["roth_savings"])
+    if request(stats, base_url, "POST", "/inputs", "POST /inputs", inputs) is None:
+        return False
+
+    calc = request(stats, base_url, "POST", f"/calculate-yr-data/{user_id}", "POST /calculate-yr-data/{id}")
+    if not calc or calc.get("run_id") is None:
+        return False
+    run_id = calc["run_id"]
+
+    # The three result fetches run in parallel, like the Promise.all in runFullCalculation
+    fetches = [
+        fetch_pool.submit(request, stats, base_url, "GET", f"/roth_conversions/{run_id}", "GET /roth_conversions/{id}"),
+        fetch_pool.submit(request, stats, base_url, "GET", f"/roth_conversions_parts/{run_id}", "GET /roth_conversions_parts/{id}"),
+        fetch_pool.submit(request, stats, base_url, "GET", f"/retire_yr_data/{run_id}", "GET /retire_yr_data/{id}"),
+    ]
+    return all(f.result() is not None for f in fetches)
+
+
+def virtual_user(stats, base_url, run_tag, index, deadline, iterations, think_time):
+    """Loop the frontend flow for one virtual user until the deadline or iteration count is reached"""
+    account = create_virtual_user(stats, base_url, run_tag, index)
+    if account is None:
+        stats.record_flow(False)
+        return
+    user_id, username, password = account
+
+    completed = 0
+    with ThreadPoolExecutor(max_workers=3) as fetch_pool:
+        while time.monotonic() < deadline and (iterations is None or completed < iterations):
+            stats.record_flow(run_flow(stats, base_url, fetch_pool, user_id, username, password))
+            completed += 1
+            if think_time > 0:
+                time.sleep(random.uniform(0.5, 1.5) * think_time)
+
+
+def wait_until_ready(base_url, timeout=60):
+    """Poll a DB-free endpoint until the app answers"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + "/stripe/price-ids", timeout=2):
+                return True
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.25)
+    return False
+
+
+def start_local_app(port, workers, db_url):
+    """Start uvicorn on a throwaway database seeded with tax data; returns the process"""
+    env = dict(os.environ, DATABASE_URL=db_url)
+    subprocess.run([sys.executable, "-c", "from create_retire_database import init_db; init_db()"],
+                   cwd=APP_DIR, env=env, check=True)
+    subprocess.run([sys.executable, "load_retire_data.py"], cwd=APP_DIR, env=env, check=True)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=APP_DIR, env=env,
+    )
+
+
+def print_report(stats, elapsed):
+    total_requests = sum(len(v) for v in stats.latencies.values())
+    total_errors = sum(stats.errors.values())
+    print()
+    print(f"Elapsed: {elapsed:.1f}s   Flows: {stats.flows} ({stats.flow_errors} failed)   "
+          f"Requests: {total_requests} ({total_errors} errors)")
+    print(f"Throughput: {total_requests / elapsed:.1f} req/s, {stats.flows / elapsed:.2f} flows/s   "
+          f"Error rate: {(total_errors / total_requests if total_requests else 0):.2%}")
+    print()
+    print(f"{'Endpoint':<36} {'Count':>7} {'Err':>5} {'Mean':>8} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'Max':>8}")
+    print("-" * 104)
+    for label in sorted(stats.latencies):
+        values = sorted(stats.latencies[label])
+        ms = [v * 1000 for v in values]
+        print(
+            f"{label:<36} "
+            f"{len(values):7d} "
+            f"{stats.errors.get(label, 0):5d} "
+            f"{sum(ms) / len(ms):8.1f} "
+            f"{percentile(ms, 50):8.1f} "
+            f"{percentile(ms, 90):8.1f} "
+            f"{percentile(ms, 95):8.1f} "
+            f"{percentile(ms, 99):8.1f} "
+            f"{ms[-1]:8.1f}"
+        )
+    print("(latencies in ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the frontend calculation flow against the API")
+    parser.add_argument("--base-url", help="Target a running app instead of starting a throwaway one")
+    parser.add_argument("--users", type=int, default=10, help="Number of concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--iterations", type=int, help="Stop each virtual user after this many flows")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Mean seconds a user pauses between flows")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the throwaway app")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for the throwaway app")
+    parser.add_argument("--db-url", help="Database for the throwaway app (default: temporary SQLite file)")
+    args = parser.parse_args()
+
+    app_process = None
+    temp_dir = None
+    base_url = args.base_url
+    if not base_url:
+        temp_dir = tempfile.TemporaryDirectory(prefix="roth_load_")
+        db_url = args.db_url or f"sqlite:///{Path(temp_dir.name) / 'load_test.db'}"
+        base_url = f"http://127.0.0.1:{args.port}"
+        print(f"Starting throwaway app on {base_url} ({args.workers} worker(s), {db_url})")
+        app_process = start_local_app(args.port, args.workers, db_url)
+    base_url = base_url.rstrip("/")
+
+    try:
+        if not wait_until_ready(base_url):
+            print(f"App at {base_url} did not become ready")
+            sys.exit(1)
+
+        stats = Stats()
+        run_tag = uuid.uuid4().hex[:8]
+        print(f"Running {args.users} virtual user(s) for {args.duration:.0f}s, think time {args.think_time}s")
+        start = time.monotonic()
+        deadline = start + args.duration
+        threads = [
+            threading.Thread(target=virtual_user,
+                             args=(stats, base_url, run_tag, i, deadline, args.iterations, args.think_time),
+                             daemon=True)
+            for i in range(args.users)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        print_report(stats, time.monotonic() - start)
+    finally:
+        if app_process:
+            app_process.terminate()
+            app_process.wait(timeout=10)
+        if temp_dir:
+            temp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,59 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.exception_handlers import http_exception_handler
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from pathlib import Path
 from pydantic import BaseModel
-from sqlalchemy import create_engine, func
+from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from create_retire_database import User, CalculationRun, Input, RothConversions, RothConversionsParts, StandardDeductions, TaxBrackets, RetireYrData, UserRatings, init_db, SessionLocal
+from create_retire_database import User, CalculationRun, Input, StandardDeductions, TaxBrackets, RetireYrSeries, UserRatings, init_db, SessionLocal, DB_URL, is_memory_url
 from calc_roth_conv_data import calc_retire_and_conversions
+from ratings_summary import adjust_ratings_summary, read_ratings_summary
+from retire_yr_series import SERIES_FIELDS, load_year_columns, series_to_records, writes_series
+from tax_schedule import schedule_cache
+from tax_snapshot import TAX_SNAPSHOT_PATH, ensure_snapshot, snapshot_reader
+from hot_queries import RETIRE_YR_API_FIELDS, active_user, latest_input, retire_yr_api_rows, roth_conversions, roth_conversions_parts, run_distribution
+from export_runs import EXPORT_FORMATS, EXPORT_TABLES, stream_export
+from batch_calc import BATCH_MAX_PROFILES, BATCH_WORKERS, shutdown_batch_pool, stream_batch
+from calc_stream import CalculationStream
+from admission import AdmissionRejected, calculation_admission
+from single_flight import calculation_flights
+from speculation import SPECULATIVE_CALC, calculation_speculation
+from stripe_events import STRIPE_EVENT_WORKER, record_event, stripe_event_worker
+from stripe_checkout import StripeUnavailable, checkout_breaker, create_checkout
+from retention import retention_worker
+from query_budget import QueryBudgetMiddleware, declare_query_budget
+from db_pool import is_pool_timeout, pool_telemetry, DB_POOL_TIMEOUT
+from db_routing import pin_writes, primary_pins, read, read_session
+from account_deletion import ACCOUNT_PURGE_WORKER, account_purge_worker, deletion_status, request_deletion
 from decimal import Decimal
-import bcrypt
 import datetime
 import os
 from dotenv import load_dotenv
-import stripe
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize Stripe with your secret key
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
 
+# Skip the startup schema check (an inspector round trip) when the schema is managed at deploy time
+SKIP_INIT_DB = os.getenv("SKIP_INIT_DB", "0") == "1"
+
+# stripe (the slowest import in the app) and bcrypt are only needed by a few endpoints, so they are
+# imported on first use rather than at cold start
+_stripe = None
+
+def get_stripe():
+    """The stripe module, imported and configured with your secret key on first use"""
+    global _stripe
+    if _stripe is None:
+        import stripe
+        stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+        _stripe = stripe
+    return _stripe
+
 app = FastAPI()
 
 # Configure CORS for production and local development
@@ -33,6 +66,9 @@ allowed_origins = [
     "https://www.rothconv.com",
 ]
 
+# Counts SQL statements per request; QUERY_DEBUG=1 adds them to the response headers
+app.add_middleware(QueryBudgetMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
@@ -41,10 +77,50 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Endpoints turn any failure into a 500; a pool checkout timeout underneath one means the database
+# is saturated, which the client should retry rather than report
+@app.exception_handler(HTTPException)
+async def pool_timeout_as_503(request: Request, exc: HTTPException):
+    if exc.status_code == 500 and is_pool_timeout(exc.__context__):
+        retry_after = str(max(1, int(DB_POOL_TIMEOUT)))
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Database busy, retry shortly"},
+            headers={"Retry-After": retry_after}
+        )
+    return await http_exception_handler(request, exc)
+
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
-    init_db()
+    if not SKIP_INIT_DB or is_memory_url(DB_URL):
+        init_db()
+    # An in-memory database starts empty on every boot, so seed the tax tables too
+    if is_memory_url(DB_URL):
+        from load_retire_data import load_data
+        load_data()
+    # With a shared tax snapshot configured, the first worker to start publishes one if no loader has yet
+    if TAX_SNAPSHOT_PATH:
+        session = SessionLocal()
+        try:
+            ensure_snapshot(session)
+        except Exception as e:
+            print(f"Tax snapshot warning: {e}")
+        finally:
+            session.close()
+    if STRIPE_EVENT_WORKER:
+        stripe_event_worker.start()
+    if ACCOUNT_PURGE_WORKER:
+        account_purge_worker.start()
+    retention_worker.start()  # No-op unless RUN_RETENTION_INTERVAL_HOURS is set
+
+@app.on_event("shutdown")
+def shutdown_event():
+    stripe_event_worker.stop()
+    account_purge_worker.stop()
+    retention_worker.stop()
+    calculation_speculation.shutdown()
+    shutdown_batch_pool()
 
 # Database engine is already created in create_retire_database.py
 # It uses DATABASE_URL environment variable if available
@@ -75,6 +151,21 @@ class InputCreate(BaseModel):
     trad_savings: float
     roth_savings: float
 
+class BatchProfile(BaseModel):
+    client_ref: str | None = None
+    birth_date: str
+    trad_savings: float
+    roth_savings: float
+    soc_sec_benefit: float | None = None
+    dist_return_assum: float | None = None
+    soc_sec_grw_assum: float | None = None
+    distribution_status: str | None = None
+    inflation_assum: float | None = None
+    life_years: int | None = None
+
+class BatchCalculationRequest(BaseModel):
+    profiles: list[BatchProfile]
+
 class LoginRequest(BaseModel):
     username: str
     password: str
@@ -96,6 +187,7 @@ class RatingCreate(BaseModel):
 
 @app.post("/users")
 def create_user(user: UserCreate):
+    import bcrypt
     session = SessionLocal()
     try:
         if session.query(User).filter_by(username=user.username).first():
@@ -131,10 +223,11 @@ def create_user(user: UserCreate):
         session.close()
 
 @app.post("/inputs")
+@declare_query_budget(6)
 def create_input(input_data: InputCreate):
     session = SessionLocal()
     try:
-        user = session.query(User).filter_by(user_id=input_data.user_id).first()
+        user = session.query(User).filter_by(user_id=input_data.user_id, deleted_at=None).first()
         if not user:
             raise HTTPException(status_code=400, detail="User not found")
         
@@ -179,6 +272,10 @@ def create_input(input_data: InputCreate):
         
         session.commit()
         session.refresh(db_input)
+        pin_writes(user_id=input_data.user_id)
+        if SPECULATIVE_CALC:
+            # The client asks for a calculation next; start it now (superseding any earlier speculation)
+            calculation_speculation.submit(input_data.user_id)
         return {"message": "Input and savings updated successfully", "input_id": db_input.input_id}
     except Exception as e:
         session.rollback()
@@ -186,35 +283,99 @@ def create_input(input_data: InputCreate):
     finally:
         session.close()
 
+def admission_rejected(e):
+    """429 with Retry-After for a calculation turned away by admission control"""
+    return HTTPException(
+        status_code=429,
+        detail=f"Too many calculations in progress ({e.reason}); retry in {e.retry_after}s",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
 @app.post("/calculate-yr-data/{user_id}")
 def calculate_yr_data(user_id: int):
-    session = SessionLocal()
     try:
-        result = calc_retire_and_conversions(user_id)
-
-        # Retrieve updated calc_count
-        user = session.query(User).filter_by(user_id=user_id).first()
-        calc_count = user.calc_count if user else 0
+        # Duplicate concurrent requests share one run; only that run takes an admission slot.
+        # The calculation's own transaction returns the updated calc_count and subscription status
+        result = calc_retire_and_conversions(
+            user_id,
+            guard=lambda: calculation_admission.admit(user_id),
+            precomputed=calculation_speculation.take if SPECULATIVE_CALC else None,
+        )
+        # The client reads this run's results next; keep those reads off a lagging replica
+        pin_writes(user_id=user_id, run_id=result["run_id"])
 
         return {
             "run_id": result["run_id"],
             "records_created": result["records_created"],
-            "calc_count": calc_count,
-            "subscription_status": user.subscription_status or "unpaid",
+            "calc_count": result.get("calc_count", 0),
+            "subscription_status": result.get("subscription_status") or "unpaid",
             "distribution": result.get("distribution"),
             "annuity_factor_multiple": result.get("annuity_factor_multiple"),
             "base_duration": result.get("base_duration")
         }
+    except AdmissionRejected as e:
+        raise admission_rejected(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to calculate retirement data: {str(e)}")
+
+@app.post("/calculate-yr-data/{user_id}/stream")
+def calculate_yr_data_stream(user_id: int):
+    """Run a calculation and stream its results as server-sent events: the baseline group, each
+    conversion group as it is computed, the parts table, then the usual response (see calc_stream.py)"""
+    stream = CalculationStream(
+        user_id,
+        guard=lambda: calculation_admission.admit(user_id),
+        precomputed=calculation_speculation.take if SPECULATIVE_CALC else None,
+    )
+    error = stream.first_error()
+    if isinstance(error, AdmissionRejected):
+        raise admission_rejected(error)
+    if error is not None:
+        raise HTTPException(status_code=500, detail=f"Failed to calculate retirement data: {str(error)}")
+
+    return StreamingResponse(
+        stream.events(on_done=lambda result: pin_writes(user_id=user_id, run_id=result["run_id"])),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # No proxy buffering of the events
+    )
+
+@app.post("/users/{user_id}/batch-calculate")
+def batch_calculate(user_id: int, batch: BatchCalculationRequest):
+    """Evaluate many client profiles for a professional subscriber, streaming one NDJSON line per client"""
+    if len(batch.profiles) > BATCH_MAX_PROFILES:
+        raise HTTPException(status_code=413, detail=f"A batch may hold at most {BATCH_MAX_PROFILES} profiles")
+
+    session = SessionLocal()
+    try:
+        user = session.query(User.subscription_status, User.subscription_type).filter_by(user_id=user_id, deleted_at=None).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        if user.subscription_status != "paid" or user.subscription_type != "professional":
+            raise HTTPException(status_code=403, detail="Batch calculations require a professional subscription")
     finally:
         session.close()
 
+    # One admission slot per profile the batch runs at once, released when the stream finishes or the client leaves
+    slots = min(BATCH_WORKERS, calculation_admission.max_in_flight)
+    try:
+        calculation_admission.acquire(user_id, slots=slots)
+    except AdmissionRejected as e:
+        raise admission_rejected(e)
+
+    profiles = [profile.model_dump() for profile in batch.profiles]
+    return StreamingResponse(
+        stream_batch(profiles, workers=slots, on_close=lambda: calculation_admission.release(user_id, slots=slots)),
+        media_type="application/x-ndjson"
+    )
+
 @app.get("/roth_conversions/{run_id}")
+@declare_query_budget(2)
 def get_roth_conversions(run_id: int):
-    session = SessionLocal()
     try:
-        conversions = session.query(RothConversions).filter_by(run_id=run_id).order_by(RothConversions.conv_group_num).all()
+        conversions = read(
+            lambda session: roth_conversions(session, run_id),
+            run_id=run_id
+        )
         print(f"Queried roth_conversions for run_id={run_id}, found {len(conversions)} records")
         results = [
             {
@@ -243,14 +404,15 @@ def get_roth_conversions(run_id: int):
     except Exception as e:
         print(f"Error in get_roth_conversions for run_id={run_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch conversions: {str(e)}")
-    finally:
-        session.close()
 
 @app.get("/roth_conversions_parts/{run_id}")
+@declare_query_budget(2)
 def get_roth_conversions_parts(run_id: int):
-    session = SessionLocal()
     try:
-        parts = session.query(RothConversionsParts).filter_by(run_id=run_id).order_by(RothConversionsParts.conv_group_num).all()
+        parts = read(
+            lambda session: roth_conversions_parts(session, run_id),
+            run_id=run_id
+        )
         print(f"Queried roth_conversions_parts for run_id={run_id}, found {len(parts)} records")
         results = [
             {
@@ -279,16 +441,53 @@ def get_roth_conversions_parts(run_id: int):
     except Exception as e:
         print(f"Error in get_roth_conversions_parts for run_id={run_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch parts: {str(e)}")
-    finally:
-        session.close()
 
-@app.get("/retire_yr_data/{run_id}")
-def get_retire_yr_data(run_id: int):
-    session = SessionLocal()
+def parse_year_projection(fields, groups):
+    """(fields, groups) lists from the comma-separated query parameters; groups None means all"""
+    field_list = [f for f in (fields or ",".join(RETIRE_YR_API_FIELDS)).split(",") if f]
+    unknown = [f for f in field_list if f not in SERIES_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {', '.join(unknown)}; choose from {', '.join(SERIES_FIELDS)}")
+    if groups == "all":
+        return field_list, None
     try:
-        records = session.query(RetireYrData).filter_by(run_id=run_id, conv_group_num=0).order_by(RetireYrData.year).all()
-        if not records:
-            raise HTTPException(status_code=404, detail="No retire_yr_data found for run_id with conv_group_num=0")
+        return field_list, sorted({int(g) for g in (groups or "0").split(",") if g})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="groups must be 'all' or comma-separated conv_group_num values")
+
+@app.get("/retire_yr_data/{run_id}")
+@declare_query_budget(2)
+def get_retire_yr_data(run_id: int, fields: str | None = None, groups: str | None = None):
+    """Year data for conv_group_num 0 as one record per year. With fields (comma-separated columns)
+    and/or groups ("all" or comma-separated group numbers), only those columns are read and each
+    group comes back column-wise: {"year": [...], "age": [...], field: [...]}"""
+    if fields is not None or groups is not None:
+        field_list, group_list = parse_year_projection(fields, groups)
+        try:
+            columns = read(lambda session: load_year_columns(session, run_id, field_list, group_list), run_id=run_id)
+        except Exception as e:
+            print(f"Error in get_retire_yr_data for run_id={run_id}: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Failed to fetch retire_yr_data: {str(e)}")
+        if not columns:
+            raise HTTPException(status_code=404, detail="No retire_yr_data found for run_id and groups")
+        print(f"Queried retire_yr_data for run_id={run_id}, {len(columns)} groups x {len(field_list)} fields")
+        return {
+            "run_id": run_id,
+            "fields": field_list,
+            "groups": [dict(conv_group_num=group, **series) for group, series in columns.items()],
+        }
+
+    def load_series(session):
+        # Packed layout decodes straight into the response
+        series_row = session.get(RetireYrSeries, (run_id, 0))
+        if not series_row:
+            return []
+        results = series_to_records(series_row, RETIRE_YR_API_FIELDS)
+        print(f"Decoded retire_yr_series for run_id={run_id}, conv_group_num=0, {len(results)} years")
+        return results
+
+    def load_rows(session):
+        records = retire_yr_api_rows(session, run_id)
         results = [
             {
                 "year": r.year.isoformat(),
@@ -306,17 +505,48 @@ def get_retire_yr_data(run_id: int):
         ]
         print(f"Queried retire_yr_data for run_id={run_id}, conv_group_num=0, found {len(results)} records")
         return results
+
+    # The configured layout first, then the other one for runs stored under a different RETIRE_YR_STORAGE
+    first, second = (load_series, load_rows) if writes_series() else (load_rows, load_series)
+
+    try:
+        results = read(lambda session: first(session) or second(session), run_id=run_id)
+        if not results:
+            raise HTTPException(status_code=404, detail="No retire_yr_data found for run_id with conv_group_num=0")
+        return results
     except Exception as e:
         print(f"Error in get_retire_yr_data for run_id={run_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch retire_yr_data: {str(e)}")
-    finally:
-        session.close()
+
+@app.get("/export/{table_name}")
+def export_results(table_name: str, run_id: int | None = None, user_id: int | None = None, format: str = "csv"):
+    """Download one run's (run_id) or one user's (user_id) results as CSV or Parquet, streamed in chunks"""
+    if table_name not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table; choose one of {', '.join(sorted(EXPORT_TABLES))}")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format; choose one of {', '.join(sorted(EXPORT_FORMATS))}")
+    if run_id is None and user_id is None:
+        raise HTTPException(status_code=400, detail="Pass run_id or user_id (use export_runs.py for whole-database exports)")
+
+    try:
+        chunks = stream_export(table_name, format, run_id=run_id, user_id=user_id,
+                               session_factory=lambda: read_session(user_id=user_id, run_id=run_id)[0])
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow installed on the server")
+
+    media_type, extension = EXPORT_FORMATS[format]
+    scope = f"run_{run_id}" if run_id is not None else f"user_{user_id}"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{table_name}_{scope}.{extension}"'}
+    )
 
 @app.get("/distribution_schedule/{run_id}")
+@declare_query_budget(2)
 def get_distribution_schedule(run_id: int):
-    session = SessionLocal()
     try:
-        calc_run = session.query(CalculationRun).filter_by(run_id=run_id).first()
+        calc_run = read(lambda session: run_distribution(session, run_id), run_id=run_id)
         if not calc_run:
             raise HTTPException(status_code=404, detail="Calculation run not found")
 
@@ -328,14 +558,14 @@ def get_distribution_schedule(run_id: int):
     except Exception as e:
         print(f"Error in get_distribution_schedule for run_id={run_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch distribution schedule: {str(e)}")
-    finally:
-        session.close()
 
 @app.post("/login")
+@declare_query_budget(1)
 def login(login_data: LoginRequest):
+    import bcrypt
     session = SessionLocal()
     try:
-        user = session.query(User).filter_by(username=login_data.username).first()
+        user = session.query(User).filter_by(username=login_data.username, deleted_at=None).first()
         if not user or not bcrypt.checkpw(login_data.password.encode('utf-8'), user.password_hash.encode('utf-8')):
             raise HTTPException(status_code=400, detail="Invalid username or password")
         return {"user_id": user.user_id}
@@ -347,10 +577,10 @@ def login(login_data: LoginRequest):
         session.close()
 
 @app.get("/users/{user_id}")
+@declare_query_budget(2)
 def get_user(user_id: int):
-    session = SessionLocal()
     try:
-        user = session.query(User).filter_by(user_id=user_id).first()
+        user = read(lambda session: active_user(session, user_id), user_id=user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         return {
@@ -365,14 +595,12 @@ def get_user(user_id: int):
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch user: {str(e)}")
-    finally:
-        session.close()
 
 @app.put("/users/{user_id}")
 def update_user_profile(user_id: int, user_update: UserUpdate):
     session = SessionLocal()
     try:
-        user = session.query(User).filter_by(user_id=user_id).first()
+        user = session.query(User).filter_by(user_id=user_id, deleted_at=None).first()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
@@ -396,6 +624,7 @@ def update_user_profile(user_id: int, user_update: UserUpdate):
             user.birth_date_spouse = None
 
         session.commit()
+        pin_writes(user_id=user_id)
         return {"message": "Profile updated successfully"}
     except Exception as e:
         session.rollback()
@@ -405,9 +634,10 @@ def update_user_profile(user_id: int, user_update: UserUpdate):
 
 @app.post("/users/{user_id}/change-password")
 def change_password(user_id: int, password_change: PasswordChange):
+    import bcrypt
     session = SessionLocal()
     try:
-        user = session.query(User).filter_by(user_id=user_id).first()
+        user = session.query(User).filter_by(user_id=user_id, deleted_at=None).first()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
@@ -431,36 +661,51 @@ def change_password(user_id: int, password_change: PasswordChange):
 
 @app.delete("/users/{user_id}")
 def delete_user_account(user_id: int):
+    """Mark the account deleted and return; its rows are purged in the background (see account_deletion.py)"""
     session = SessionLocal()
     try:
-        user = session.query(User).filter_by(user_id=user_id).first()
+        user = session.query(User).filter_by(user_id=user_id, deleted_at=None).first()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
-        # Delete all related records
-        session.query(UserRatings).filter_by(user_id=user_id).delete()
-        session.query(Input).filter_by(user_id=user_id).delete()
-        session.query(RothConversions).filter_by(user_id=user_id).delete()
-        session.query(RothConversionsParts).filter_by(user_id=user_id).delete()
-        session.query(RetireYrData).filter_by(user_id=user_id).delete()
-        session.query(CalculationRun).filter_by(user_id=user_id).delete()
-
-        # Delete user
-        session.delete(user)
+        request_deletion(session, user)
         session.commit()
+        pin_writes(user_id=user_id)
+        account_purge_worker.notify()
 
-        return {"message": "Account deleted successfully"}
+        return {"message": "Account deleted successfully", "purge_status": "pending"}
+    except HTTPException:
+        raise
     except Exception as e:
         session.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to delete account: {str(e)}")
     finally:
         session.close()
 
+@app.get("/users/{user_id}/deletion")
+def get_account_deletion(user_id: int):
+    """Progress of the background purge for a deleted account"""
+    session = SessionLocal()
+    try:
+        status = deletion_status(session, user_id)
+        if status is None:
+            raise HTTPException(status_code=404, detail="No deletion requested for this user")
+        return status
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read deletion status: {str(e)}")
+    finally:
+        session.close()
+
 @app.get("/inputs/{user_id}")
+@declare_query_budget(2)
 def get_inputs(user_id: int):
-    session = SessionLocal()
     try:
-        inputs = session.query(Input).filter_by(user_id=user_id).order_by(Input.input_timestamp.desc()).first()
+        inputs = read(
+            lambda session: latest_input(session, user_id),
+            user_id=user_id
+        )
         if not inputs:
             raise HTTPException(status_code=404, detail="No inputs found for user")
         return {
@@ -482,8 +727,6 @@ def get_inputs(user_id: int):
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch inputs: {str(e)}")
-    finally:
-        session.close()
 
 @app.post("/ratings")
 def submit_rating(rating: RatingCreate):
@@ -494,7 +737,7 @@ def submit_rating(rating: RatingCreate):
             raise HTTPException(status_code=400, detail="Star rating must be between 1 and 5")
 
         # Check if user exists
-        user = session.query(User).filter_by(user_id=rating.user_id).first()
+        user = session.query(User).filter_by(user_id=rating.user_id, deleted_at=None).first()
         if not user:
             raise HTTPException(status_code=400, detail="User not found")
 
@@ -503,9 +746,14 @@ def submit_rating(rating: RatingCreate):
 
         if existing_rating:
             # Update existing rating
+            previous_star_rating = existing_rating.star_rating
             existing_rating.star_rating = rating.star_rating
             existing_rating.comment = rating.comment[:1000]  # Truncate to 1000 chars
             existing_rating.rating_timestamp = datetime.datetime.now(datetime.UTC)
+            if previous_star_rating is None:
+                adjust_ratings_summary(session, 1, rating.star_rating)
+            else:
+                adjust_ratings_summary(session, 0, rating.star_rating - previous_star_rating)
         else:
             # Create new rating
             db_rating = UserRatings(
@@ -516,8 +764,10 @@ def submit_rating(rating: RatingCreate):
                 is_public=False
             )
             session.add(db_rating)
+            adjust_ratings_summary(session, 1, rating.star_rating)
 
         session.commit()
+        pin_writes(user_id=rating.user_id)
         return {"message": "Rating submitted successfully"}
 
     except Exception as e:
@@ -527,40 +777,21 @@ def submit_rating(rating: RatingCreate):
         session.close()
 
 @app.get("/ratings/summary")
+@declare_query_budget(2)
 def get_ratings_summary(user_id: int = None):
-    session = SessionLocal()
     try:
-        # Get average rating and total count
-        avg_rating = session.query(func.avg(UserRatings.star_rating)).scalar() or 0
-        total_ratings = session.query(func.count(UserRatings.rating_id)).scalar() or 0
-
-        result = {
-            "averageRating": round(float(avg_rating), 1),
-            "totalRatings": total_ratings,
-            "userCurrentRating": None,
-            "userComment": None
-        }
-
-        # If user_id provided, get their current rating
-        if user_id:
-            user_rating = session.query(UserRatings).filter_by(user_id=user_id).first()
-            if user_rating:
-                result["userCurrentRating"] = user_rating.star_rating
-                result["userComment"] = user_rating.comment
-
-        return result
-
+        # Average and count come from the maintained summary row, not a full-table aggregate
+        return read(lambda session: read_ratings_summary(session, user_id), user_id=user_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch ratings summary: {str(e)}")
-    finally:
-        session.close()
 
 @app.get("/users/{user_id}/subscription-status")
+@declare_query_budget(1)
 def get_subscription_status(user_id: int):
     """Get user's subscription and calculation count status"""
     session = SessionLocal()
     try:
-        user = session.query(User).filter_by(user_id=user_id).first()
+        user = session.query(User).filter_by(user_id=user_id, deleted_at=None).first()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
@@ -578,6 +809,24 @@ def get_subscription_status(user_id: int):
         session.close()
 
 
+@app.get("/metrics")
+@declare_query_budget(0)
+def get_metrics():
+    """Process-local cache counters for this worker"""
+    return {
+        "tax_schedule_cache": schedule_cache.info(),
+        "tax_snapshot": snapshot_reader.info() if snapshot_reader else None,
+        "stripe_event_worker": stripe_event_worker.info(),
+        "calculation_admission": calculation_admission.info(),
+        "calculation_single_flight": calculation_flights.info(),
+        "account_purge_worker": account_purge_worker.info(),
+        "run_retention": retention_worker.info(),
+        "read_routing": primary_pins.info(),
+        "db_pool": {name: telemetry.info() for name, telemetry in pool_telemetry.items()},
+        "stripe_checkout": checkout_breaker.info(),
+        "calculation_speculation": calculation_speculation.info()
+    }
+
 @app.get("/stripe/price-ids")
 def get_price_ids():
     """Return Stripe Price IDs for Checkout Sessions"""
@@ -593,7 +842,7 @@ def select_free_plan(user_id: int):
     """Update user to paid status when they select the free option"""
     session = SessionLocal()
     try:
-        user = session.query(User).filter_by(user_id=user_id).first()
+        user = session.query(User).filter_by(user_id=user_id, deleted_at=None).first()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
@@ -613,44 +862,40 @@ class CheckoutSessionRequest(BaseModel):
     price_id: str
 
 @app.post("/stripe/create-checkout-session")
-def create_checkout_session(request: CheckoutSessionRequest):
+async def create_checkout_session(request: CheckoutSessionRequest):
     """Create a Stripe Checkout Session with user's email pre-filled"""
     base_url = os.getenv("APP_BASE_URL")
     if not base_url:
         raise HTTPException(status_code=500, detail="APP_BASE_URL not configured")
 
-    session = SessionLocal()
+    def load_email():
+        session = SessionLocal()
+        try:
+            user = active_user(session, request.user_id)
+            return user.email if user else None
+        finally:
+            session.close()
+
     try:
-        user = session.query(User).filter_by(user_id=request.user_id).first()
-        if not user:
+        # The database session is closed again before the Stripe call starts
+        email = await run_in_threadpool(load_email)
+        if not email:
             raise HTTPException(status_code=404, detail="User not found")
-
-        # Create Stripe Checkout Session
-        checkout_session = stripe.checkout.Session.create(
-            customer_email=user.email,  # Pre-fill email from database
-            line_items=[{
-                'price': request.price_id,
-                'quantity': 1,
-            }],
-            mode='payment',
-            success_url=base_url + "/?payment=success&tab=conversions",
-            cancel_url=base_url,
-            metadata={
-                'user_id': str(request.user_id)  # Store user_id for webhook
-            }
-        )
-
-        return {"url": checkout_session.url}
+        url = await create_checkout(email, request.price_id, request.user_id, base_url)
+        return {"url": url}
+    except StripeUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create checkout session: {str(e)}")
-    finally:
-        session.close()
 
 @app.post("/stripe-webhook")
 async def stripe_webhook(request: Request):
     """Webhook endpoint to receive payment confirmations from Stripe"""
     payload = await request.body()
     sig_header = request.headers.get("stripe-signature")
+    stripe = get_stripe()
 
     try:
         # Verify the webhook signature (security check)
@@ -666,48 +911,31 @@ async def stripe_webhook(request: Request):
         print(f"Webhook error: Invalid signature - {e}")
         raise HTTPException(status_code=400, detail="Invalid signature")
 
-    # Handle the checkout.session.completed event
-    if event["type"] == "checkout.session.completed":
-        session = event["data"]["object"]
-
-        # Extract payment information
-        customer_email = session.get("customer_details", {}).get("email")
-        amount_total = session.get("amount_total", 0) / 100  # Convert cents to dollars
-        payment_intent = session.get("payment_intent")
-
-        print(f"Payment received: {customer_email}, ${amount_total}")
-
-        # Find user by email and update their subscription
+    # Record the event and acknowledge; the worker applies it. A retried or duplicate delivery
+    # finds its row already there and is acknowledged without being applied again.
+    def record():
         db_session = SessionLocal()
         try:
-            user = db_session.query(User).filter_by(email=customer_email).first()
-            if user:
-                user.subscription_status = "paid"
-                user.amount_paid = Decimal(str(amount_total))
-                user.payment_timestamp = datetime.datetime.now(datetime.UTC)
-                user.stripe_subscription_id = payment_intent
-
-                # Set subscription end date (1 year from now)
-                user.sub_end_date = (datetime.datetime.now(datetime.UTC) + datetime.timedelta(days=365)).date()
-
-                # Determine subscription type based on amount
-                # You'll need to adjust these amounts to match your actual prices
-                if amount_total >= 99:
-                    user.subscription_type = "professional"
-                else:
-                    user.subscription_type = "individual"
-
-                db_session.commit()
-                print(f"Updated user {user.user_id}: subscription_status=paid, type={user.subscription_type}")
-            else:
-                print(f"Warning: No user found with email {customer_email}")
-        except Exception as e:
+            is_new = record_event(db_session, event)
+            db_session.commit()
+            return is_new
+        except Exception:
             db_session.rollback()
-            print(f"Database error: {e}")
-            raise HTTPException(status_code=500, detail=f"Failed to update user: {str(e)}")
+            raise
         finally:
             db_session.close()
 
+    try:
+        # The database work runs off the event loop
+        is_new = await run_in_threadpool(record)
+    except Exception as e:
+        print(f"Database error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to record event: {str(e)}")
+
+    if not is_new:
+        print(f"Webhook: duplicate delivery of {event['id']} ignored")
+        return {"status": "duplicate"}
+    stripe_event_worker.notify()
     return {"status": "success"}
 
 # Serve React static files (added for production)
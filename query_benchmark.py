@@ -0,0 +1,75 @@
+import argparse
+import os
+import time
+
+# Micro-benchmark for hot_queries.py: CPU per call of each hot lookup against the session.query()
+# form it replaced, on a throwaway in-memory database holding one user with one calculation.
+#
+#   python query_benchmark.py                  # 2000 calls of each
+#   python query_benchmark.py --iterations 10000
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")  # In-memory; the app seeds the tax tables at startup
+
+from fastapi.testclient import TestClient
+from load_test import SAMPLE_INPUTS, SAMPLE_PROFILE
+from create_retire_database import CalculationRun, Input, RetireYrData, RothConversions, RothConversionsParts, SessionLocal, User
+from calc_roth_conv_data import calc_retire_and_conversions
+import hot_queries
+import main
+
+def lookups(user_id, run_id):
+    """(name, session.query() form, hot_queries form) for each hot lookup"""
+    return [
+        ("User by id", lambda s: s.query(User).filter_by(user_id=user_id, deleted_at=None).first(),
+         lambda s: hot_queries.active_user(s, user_id)),
+        ("Input latest by user", lambda s: s.query(Input).filter_by(user_id=user_id).order_by(Input.input_timestamp.desc()).first(),
+         lambda s: hot_queries.latest_input(s, user_id)),
+        ("CalculationRun by run_id", lambda s: s.query(CalculationRun).filter_by(run_id=run_id).first(),
+         lambda s: hot_queries.run_distribution(s, run_id)),
+        ("RothConversions by run_id", lambda s: s.query(RothConversions).filter_by(run_id=run_id).order_by(RothConversions.conv_group_num).all(),
+         lambda s: hot_queries.roth_conversions(s, run_id)),
+        ("RothConversionsParts by run_id", lambda s: s.query(RothConversionsParts).filter_by(run_id=run_id).order_by(RothConversionsParts.conv_group_num).all(),
+         lambda s: hot_queries.roth_conversions_parts(s, run_id)),
+        ("RetireYrData by run_id, group 0", lambda s: s.query(RetireYrData).filter_by(run_id=run_id, conv_group_num=0).order_by(RetireYrData.year).all(),
+         lambda s: hot_queries.retire_yr_api_rows(s, run_id)),
+    ]
+
+def cpu_per_call(fn, iterations):
+    """Mean process CPU microseconds per call, each call in a fresh session as a request would be"""
+    for _ in range(20):  # Warm the compiled-statement caches first
+        session = SessionLocal()
+        fn(session)
+        session.close()
+    started = time.process_time()
+    for _ in range(iterations):
+        session = SessionLocal()
+        fn(session)
+        session.close()
+    return 1e6 * (time.process_time() - started) / iterations
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="CPU per call of the hot read statements vs. ORM queries")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    with TestClient(main.app) as client:
+        body = dict(SAMPLE_PROFILE, username="query_benchmark", password="query-benchmark-pw", email="query_benchmark@local")
+        user_id = client.post("/users", json=body).json()["user_id"]
+        client.post("/inputs", json=dict(SAMPLE_INPUTS, user_id=user_id, trad_savings=SAMPLE_PROFILE["trad_savings"],
+                                         roth_savings=SAMPLE_PROFILE["roth_savings"]))
+        run_id = calc_retire_and_conversions(user_id)["run_id"]
+
+        print(f"{'Lookup':<34} {'ORM us':>9} {'Hot us':>9} {'Saved us':>9} {'Saved':>7}")
+        print("-" * 72)
+        total_orm = total_hot = 0.0
+        for name, orm_fn, hot_fn in lookups(user_id, run_id):
+            orm_us = cpu_per_call(orm_fn, args.iterations)
+            hot_us = cpu_per_call(hot_fn, args.iterations)
+            total_orm += orm_us
+            total_hot += hot_us
+            print(f"{name:<34} {orm_us:>9.1f} {hot_us:>9.1f} {orm_us - hot_us:>9.1f} {1 - hot_us / orm_us:>7.0%}")
+        print("-" * 72)
+        print(f"{'All six (one of each)':<34} {total_orm:>9.1f} {total_hot:>9.1f} {total_orm - total_hot:>9.1f} {1 - total_hot / total_orm:>7.0%}")
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,117 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import os
+import time
+
+# SQL statement counting per request or engine run. Every statement on any engine is counted and
+# timed against the innermost active tracker (and the ones enclosing it):
+#   - QueryBudgetMiddleware tracks each HTTP request. With QUERY_DEBUG=1 the totals go out as
+#     X-SQL-Queries / X-SQL-Time-Ms headers; a route over its declared budget is logged either way.
+#   - query_budget(n) is the assertion helper: it raises QueryBudgetExceeded, listing the statements,
+#     if the block runs more than n. query_budget_check.py runs the budgeted routes and the
+#     calculation engine under it.
+# Routes declare budgets with @declare_query_budget(n) under the route decorator.
+QUERY_DEBUG = os.getenv("QUERY_DEBUG", "0") == "1"
+MAX_RECORDED_STATEMENTS = 200  # Per tracker, for the QueryBudgetExceeded listing
+
+class QueryStats:
+    """Statements executed while a tracker was active"""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+
+    def record(self, statement, seconds):
+        stats = self
+        while stats is not None:
+            stats.count += 1
+            stats.seconds += seconds
+            if len(stats.statements) < MAX_RECORDED_STATEMENTS:
+                stats.statements.append((" ".join(statement.split())[:160], seconds))
+            stats = stats.parent
+
+    def summary(self):
+        return "\n".join(f"  {1000 * seconds:8.2f} ms  {statement}" for statement, seconds in self.statements)
+
+_current = ContextVar("query_stats", default=None)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_started")
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+
+@contextmanager
+def track_queries():
+    """Count the statements run in this block (threads started inside it are not included)"""
+    stats = QueryStats(parent=_current.get())
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised by query_budget when a block runs more statements than allowed"""
+
+@contextmanager
+def query_budget(max_statements, label="block"):
+    """Fail with QueryBudgetExceeded if the block runs more than max_statements SQL statements"""
+    with track_queries() as stats:
+        yield stats
+    if stats.count > max_statements:
+        raise QueryBudgetExceeded(
+            f"{label}: {stats.count} SQL statements, budget {max_statements}\n{stats.summary()}"
+        )
+
+def declare_query_budget(max_statements):
+    """Route decorator (below @app.get/...) recording how many statements the route may run"""
+    def decorate(endpoint):
+        endpoint.query_budget = max_statements
+        return endpoint
+    return decorate
+
+def route_query_budget(scope):
+    """Declared budget of the route a request scope matched, or None"""
+    return getattr(scope.get("endpoint"), "query_budget", None)
+
+class QueryBudgetMiddleware:
+    """ASGI middleware counting statements per request (up to the response headers; a streamed body
+    runs after them and is not included)"""
+
+    def __init__(self, app, headers=QUERY_DEBUG):
+        self.app = app
+        self.headers = headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_totals(message):
+            if message["type"] == "http.response.start":
+                budget = route_query_budget(scope)
+                if budget is not None and stats.count > budget:
+                    print(f"Query budget exceeded: {scope['method']} {scope['path']} ran {stats.count} SQL statements, budget {budget}")
+                if self.headers:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [
+                        (b"x-sql-queries", str(stats.count).encode()),
+                        (b"x-sql-time-ms", f"{1000 * stats.seconds:.2f}".encode()),
+                    ] + ([(b"x-sql-budget", str(budget).encode())] if budget is not None else [])
+            await send(message)
+
+        with track_queries() as stats:
+            await self.app(scope, receive, send_with_totals)
@@ -0,0 +1,89 @@
+import argparse
+import os
+import sys
+
+# Query-budget check: runs the frontend flow and the calculation engine against a throwaway database
+# and fails if any route runs more SQL statements than its @declare_query_budget, or a calculation
+# with warm tax-schedule caches runs more than CALC_QUERY_BUDGET. Keeps N+1 fixes fixed.
+#
+#   python query_budget_check.py            # exits 1 if anything is over budget (for CI)
+#   python query_budget_check.py --verbose  # also lists every statement of each engine run
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")  # In-memory; the app seeds the tax tables at startup
+os.environ["QUERY_DEBUG"] = "1"  # Budgets are read back from the X-SQL-* response headers
+
+from fastapi.testclient import TestClient
+from load_test import SAMPLE_INPUTS, SAMPLE_PROFILE
+from query_budget import QueryBudgetExceeded, query_budget, track_queries
+from calc_roth_conv_data import calc_retire_and_conversions
+import main
+
+# Statements in one stored calculation once the projected tax schedules are cached: inputs and user
+# reads, run-year tables and version, run insert, calc_count update, four deletes (both year-data
+# layouts), three bulk inserts and the input update
+CALC_QUERY_BUDGET = 15
+
+def check_route(client, failures, method, path, **kwargs):
+    response = client.request(method, path, **kwargs)
+    count = int(response.headers.get("x-sql-queries", 0))
+    budget = response.headers.get("x-sql-budget")
+    status = "over budget" if budget is not None and count > int(budget) else "ok"
+    if status != "ok":
+        failures.append(f"{method} {path}: {count} statements, budget {budget}")
+    print(f"{method + ' ' + path:<44} {response.status_code:>4} {count:>8} {budget if budget is not None else '-':>7}  {status}")
+    return response
+
+def main_check():
+    parser = argparse.ArgumentParser(description="Fail if routes or the calculation engine exceed their SQL query budgets")
+    parser.add_argument("--verbose", action="store_true", help="List the statements of each engine run")
+    args = parser.parse_args()
+
+    failures = []
+    with TestClient(main.app) as client:
+        print(f"{'Route':<44} {'HTTP':>4} {'Queries':>8} {'Budget':>7}")
+        print("-" * 72)
+        body = dict(SAMPLE_PROFILE, username="budget_check", password="budget-check-pw", email="budget_check@local")
+        user_id = client.post("/users", json=body).json()["user_id"]
+        check_route(client, failures, "POST", "/login", json={"username": "budget_check", "password": "budget-check-pw"})
+        check_route(client, failures, "GET", f"/users/{user_id}")
+        inputs = dict(SAMPLE_INPUTS, user_id=user_id, trad_savings=SAMPLE_PROFILE["trad_savings"], roth_savings=SAMPLE_PROFILE["roth_savings"])
+        check_route(client, failures, "POST", "/inputs", json=inputs)
+        check_route(client, failures, "GET", f"/inputs/{user_id}")
+
+        # First run builds and caches the projected schedules; the budget applies from the second
+        with track_queries() as cold:
+            calc_retire_and_conversions(user_id)
+        try:
+            with query_budget(CALC_QUERY_BUDGET, label="calc_retire_and_conversions (warm)") as warm:
+                run_id = calc_retire_and_conversions(user_id)["run_id"]
+        except QueryBudgetExceeded as e:
+            failures.append(str(e))
+            run_id = calc_retire_and_conversions(user_id)["run_id"]
+            warm = None
+        print(f"{'engine run (cold caches)':<44} {'':>4} {cold.count:>8} {'-':>7}")
+        if warm is not None:
+            print(f"{'engine run (warm caches)':<44} {'':>4} {warm.count:>8} {CALC_QUERY_BUDGET:>7}  ok")
+        if args.verbose:
+            print(cold.summary())
+            if warm is not None:
+                print(warm.summary())
+
+        check_route(client, failures, "GET", f"/roth_conversions/{run_id}")
+        check_route(client, failures, "GET", f"/roth_conversions_parts/{run_id}")
+        check_route(client, failures, "GET", f"/retire_yr_data/{run_id}")
+        check_route(client, failures, "GET", f"/distribution_schedule/{run_id}")
+        check_route(client, failures, "GET", "/ratings/summary")
+        check_route(client, failures, "GET", f"/ratings/summary?user_id={user_id}")
+        check_route(client, failures, "GET", f"/users/{user_id}/subscription-status")
+        check_route(client, failures, "GET", "/metrics")
+
+    print()
+    if failures:
+        print("Over budget:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("All query budgets met")
+
+if __name__ == "__main__":
+    main_check()
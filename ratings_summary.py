@@ -0,0 +1,81 @@
+from sqlalchemy import func, update
+from create_retire_database import RATINGS_SUMMARY_ID, RatingsSummary, UserRatings, SessionLocal
+import datetime
+
+# The community average is served from a single maintained row in ratings_summary
+# instead of aggregating user_ratings on every page load. init_db creates the row; writers
+# adjust it in the same transaction as the rating change and reads never write.
+# reconcile_ratings_summary() recomputes it from scratch, from the command line as a repair:
+#   python ratings_summary.py
+SUMMARY_ID = RATINGS_SUMMARY_ID
+
+def _aggregate(session):
+    """(count, sum) of star ratings straight from user_ratings"""
+    rating_count, rating_sum = session.query(
+        func.count(UserRatings.star_rating),
+        func.coalesce(func.sum(UserRatings.star_rating), 0)
+    ).one()
+    return rating_count, int(rating_sum)
+
+def reconcile_ratings_summary(session):
+    """Recompute the summary row from user_ratings (command-line repair). Caller commits."""
+    rating_count, rating_sum = _aggregate(session)
+
+    summary = session.get(RatingsSummary, SUMMARY_ID)
+    if not summary:
+        summary = RatingsSummary(summary_id=SUMMARY_ID)
+        session.add(summary)
+    summary.rating_count = rating_count
+    summary.rating_sum = rating_sum
+    summary.reconciled_at = datetime.datetime.now(datetime.UTC)
+    session.flush()
+    return summary
+
+def adjust_ratings_summary(session, count_delta, sum_delta):
+    """Apply a rating insert/update/delete to the summary row inside the caller's transaction"""
+    if count_delta == 0 and sum_delta == 0:
+        return
+    result = session.execute(
+        update(RatingsSummary)
+        .where(RatingsSummary.summary_id == SUMMARY_ID)
+        .values(
+            rating_count=RatingsSummary.rating_count + count_delta,
+            rating_sum=RatingsSummary.rating_sum + sum_delta
+        )
+    )
+    if result.rowcount == 0:
+        # init_db was skipped; reads aggregate user_ratings until the row is seeded or reconciled
+        print("Ratings summary row missing; run init_db or python ratings_summary.py to create it")
+
+def read_ratings_summary(session, user_id=None):
+    """Community average and count (primary-key read) plus the user's own rating (indexed read). Read-only."""
+    summary = session.get(RatingsSummary, SUMMARY_ID)
+    if summary:
+        rating_count, rating_sum = summary.rating_count, summary.rating_sum
+    else:
+        rating_count, rating_sum = _aggregate(session)  # Row not seeded yet (init_db skipped)
+
+    avg_rating = rating_sum / rating_count if rating_count else 0
+    result = {
+        "averageRating": round(float(avg_rating), 1),
+        "totalRatings": rating_count,
+        "userCurrentRating": None,
+        "userComment": None
+    }
+
+    if user_id:
+        user_rating = session.query(UserRatings.star_rating, UserRatings.comment).filter_by(user_id=user_id).first()
+        if user_rating:
+            result["userCurrentRating"] = user_rating.star_rating
+            result["userComment"] = user_rating.comment
+
+    return result
+
+if __name__ == "__main__":
+    session = SessionLocal()
+    try:
+        summary = reconcile_ratings_summary(session)
+        session.commit()
+        print(f"Reconciled ratings summary: {summary.rating_count} ratings, sum {summary.rating_sum}")
+    finally:
+        session.close()
@@ -0,0 +1,271 @@
+from sqlalchemy import delete, func, or_, select, text, update
+from create_retire_database import CalculationRun, Input, RetireYrData, RetireYrSeries, RothConversions, RothConversionsParts, SessionLocal, engine
+from retire_yr_series import table_size_bytes
+import argparse
+import base64
+import datetime
+import gzip
+import json
+import os
+import threading
+
+# Run retention. calculation_runs gains a row on every calculation and the result tables are deleted
+# and re-inserted per user each run, so this job
+#   1. archives runs outside the policy (beyond the newest RUN_RETENTION_KEEP per user, or older than
+#      RUN_RETENTION_MAX_AGE_DAYS except each user's newest) to gzip JSON Lines in RUN_ARCHIVE_DIR,
+#   2. deletes them and any result rows still attached, RUN_RETENTION_BATCH runs per transaction so
+#      no lock is held for long, and
+#   3. compacts the churned tables (VACUUM ANALYZE on PostgreSQL, VACUUM on SQLite) and reports the
+#      space reclaimed.
+#
+#   python retention.py --dry-run
+#   python retention.py --keep 3 --max-age-days 365
+#
+# Set RUN_RETENTION_INTERVAL_HOURS to also run it from a background thread in the app.
+RUN_RETENTION_KEEP = int(os.getenv("RUN_RETENTION_KEEP", "10"))
+RUN_RETENTION_MAX_AGE_DAYS = int(os.getenv("RUN_RETENTION_MAX_AGE_DAYS", "0"))  # 0 = no age limit
+RUN_RETENTION_BATCH = int(os.getenv("RUN_RETENTION_BATCH", "200"))
+RUN_ARCHIVE_DIR = os.getenv("RUN_ARCHIVE_DIR", "run_archive")
+RUN_RETENTION_INTERVAL_HOURS = float(os.getenv("RUN_RETENTION_INTERVAL_HOURS", "0"))  # 0 = not scheduled
+
+ARCHIVE_FORMAT = "roth-run-archive/1"
+RESULT_MODELS = (RetireYrData, RetireYrSeries, RothConversions, RothConversionsParts)
+COMPACT_TABLES = [CalculationRun.__tablename__] + [model.__tablename__ for model in RESULT_MODELS]
+RETENTION_LOCK_KEY = 0x526F7468  # pg advisory lock id, so only one process deletes a batch at a time
+
+def expired_runs_query(keep, max_age_days=0, now=None):
+    """run_ids outside the policy, oldest first. Each user's newest run is always kept."""
+    keep = max(1, keep)
+    rank = func.row_number().over(
+        partition_by=CalculationRun.user_id,
+        order_by=(CalculationRun.run_timestamp.desc(), CalculationRun.run_id.desc())
+    ).label("run_rank")
+    ranked = select(CalculationRun.run_id, CalculationRun.run_timestamp, rank).subquery()
+    expired = ranked.c.run_rank > keep
+    if max_age_days:
+        cutoff = (now or datetime.datetime.now(datetime.UTC)) - datetime.timedelta(days=max_age_days)
+        expired = or_(expired, (ranked.c.run_timestamp < cutoff.replace(tzinfo=None)) & (ranked.c.run_rank > 1))
+    return select(ranked.c.run_id).where(expired).order_by(ranked.c.run_id)
+
+def _json_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)  # Decimal, kept exact
+
+def _columns(model):
+    return [column.name for column in model.__table__.columns]
+
+def archive_header():
+    """First line of every archive file: the format and each table's column order"""
+    tables = {model.__tablename__: _columns(model) for model in (CalculationRun,) + RESULT_MODELS}
+    return {"format": ARCHIVE_FORMAT, "created": datetime.datetime.now(datetime.UTC).isoformat(), "columns": tables}
+
+def archive_records(session, run_ids):
+    """One {"run": [...], "<result table>": [[...], ...]} record per run, values in header column order"""
+    records = {run_id: {} for run_id in run_ids}
+    for model in (CalculationRun,) + RESULT_MODELS:
+        table = model.__table__
+        rows = session.execute(
+            select(*table.columns).where(table.c.run_id.in_(run_ids)).order_by(*table.primary_key.columns)
+        )
+        key = "run" if model is CalculationRun else model.__tablename__
+        for row in rows:
+            values = [_json_value(value) for value in row]
+            if model is CalculationRun:
+                records[row.run_id]["run"] = values
+            else:
+                records[row.run_id].setdefault(key, []).append(values)
+    return [records[run_id] for run_id in run_ids]
+
+def iter_archive(path):
+    """(header, run records) from an archive file, one record per run"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != ARCHIVE_FORMAT:
+            raise ValueError(f"{path} is not a {ARCHIVE_FORMAT} file")
+        yield header
+        for line in f:
+            yield json.loads(line)
+
+def delete_runs(session, run_ids):
+    """Remove runs and everything pointing at them; returns rows deleted per table"""
+    deleted = {}
+    for model in RESULT_MODELS:
+        deleted[model.__tablename__] = session.execute(
+            delete(model).where(model.run_id.in_(run_ids)), execution_options={"synchronize_session": False}
+        ).rowcount
+    session.execute(
+        update(Input).where(Input.run_id.in_(run_ids)).values(run_id=None),
+        execution_options={"synchronize_session": False}
+    )
+    deleted[CalculationRun.__tablename__] = session.execute(
+        delete(CalculationRun).where(CalculationRun.run_id.in_(run_ids)), execution_options={"synchronize_session": False}
+    ).rowcount
+    return deleted
+
+def table_sizes(session):
+    return {name: table_size_bytes(session, name) for name in COMPACT_TABLES}
+
+def dead_tuples(session):
+    """PostgreSQL's dead row estimate per table (None elsewhere)"""
+    if session.bind.dialect.name != "postgresql":
+        return None
+    rows = session.execute(
+        text("SELECT relname, n_dead_tup FROM pg_stat_user_tables WHERE relname = ANY(:names)"),
+        {"names": COMPACT_TABLES}
+    )
+    return {name: count for name, count in rows}
+
+def compact():
+    """VACUUM the retention tables outside a transaction"""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.dialect.name == "postgresql":
+            for name in COMPACT_TABLES:
+                conn.execute(text(f"VACUUM (ANALYZE) {name}"))
+        elif conn.dialect.name == "sqlite" and conn.engine.url.database not in (None, "", ":memory:"):
+            conn.execute(text("VACUUM"))
+
+def _try_lock(session):
+    """Transaction-scoped, so it is released by each batch's commit and works across pooled connections"""
+    if session.bind.dialect.name != "postgresql":
+        return True
+    return session.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": RETENTION_LOCK_KEY}).scalar()
+
+def run_retention(keep=RUN_RETENTION_KEEP, max_age_days=RUN_RETENTION_MAX_AGE_DAYS, batch_size=RUN_RETENTION_BATCH,
+                  archive_dir=RUN_ARCHIVE_DIR, dry_run=False, do_compact=True):
+    """One retention pass; returns a report dict (runs archived, rows deleted, bytes before/after)"""
+    session = SessionLocal()
+    report = {"keep": max(1, keep), "max_age_days": max_age_days, "runs": 0, "deleted": {}, "archive": None}
+    try:
+        query = expired_runs_query(keep, max_age_days)
+        if dry_run:
+            report["runs"] = session.execute(select(func.count()).select_from(query.subquery())).scalar()
+            return report
+        raw = archive = None
+        try:
+            report["bytes_before"] = table_sizes(session)
+            report["dead_tuples_before"] = dead_tuples(session)
+            while True:
+                if not _try_lock(session):
+                    report["skipped"] = "another process is running retention"
+                    break
+                run_ids = session.execute(query.limit(batch_size)).scalars().all()
+                if not run_ids:
+                    break
+                if archive is None:
+                    os.makedirs(archive_dir, exist_ok=True)
+                    stamp = datetime.datetime.now(datetime.UTC).strftime("%Y%m%dT%H%M%SZ")
+                    report["archive"] = os.path.join(archive_dir, f"runs_{stamp}.jsonl.gz")
+                    raw = open(report["archive"], "xb")
+                    archive = gzip.GzipFile(fileobj=raw, mode="wb")
+                    archive.write((json.dumps(archive_header()) + "\n").encode("utf-8"))
+                for record in archive_records(session, run_ids):
+                    archive.write((json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8"))
+                # The archive reaches disk before the rows it holds are deleted
+                archive.flush()
+                raw.flush()
+                os.fsync(raw.fileno())
+
+                for name, count in delete_runs(session, run_ids).items():
+                    report["deleted"][name] = report["deleted"].get(name, 0) + count
+                session.commit()
+                report["runs"] += len(run_ids)
+                print(f"Retention: archived and deleted {report['runs']} runs (through run_id {run_ids[-1]})")
+        finally:
+            session.rollback()
+            if archive is not None:
+                archive.close()
+                raw.close()
+
+        session.close()
+        if do_compact and report["runs"]:
+            compact()
+        session = SessionLocal()
+        report["bytes_after"] = table_sizes(session)
+        report["dead_tuples_after"] = dead_tuples(session)
+        before = [size for size in report["bytes_before"].values() if size is not None]
+        after = [size for size in report["bytes_after"].values() if size is not None]
+        report["bytes_reclaimed"] = sum(before) - sum(after) if before and after else None
+        return report
+    finally:
+        session.close()
+
+def print_report(report):
+    if report.get("skipped"):
+        print(f"Stopped early: {report['skipped']}")
+    print(f"Policy: keep newest {report['keep']} per user"
+          + (f", drop older than {report['max_age_days']} days" if report["max_age_days"] else ""))
+    print(f"Runs outside policy: {report['runs']}")
+    if "bytes_before" not in report:
+        return
+    if report["archive"]:
+        print(f"Archive: {report['archive']} ({os.path.getsize(report['archive']):,} bytes)")
+    print(f"{'Table':<24} {'Deleted':>10} {'Bytes before':>14} {'Bytes after':>14}")
+    print("-" * 66)
+    for name in COMPACT_TABLES:
+        size_before, size_after = report["bytes_before"].get(name), report["bytes_after"].get(name)
+        print(f"{name:<24} {report['deleted'].get(name, 0):>10,} "
+              f"{f'{size_before:,}' if size_before is not None else 'n/a':>14} "
+              f"{f'{size_after:,}' if size_after is not None else 'n/a':>14}")
+    if report["bytes_reclaimed"] is not None:
+        print(f"Reclaimed: {report['bytes_reclaimed']:,} bytes")
+    if report["dead_tuples_after"] is not None:
+        print(f"Dead tuples: {sum(report['dead_tuples_before'].values()):,} -> {sum(report['dead_tuples_after'].values()):,}")
+
+class RetentionWorker:
+    """Background thread that runs a retention pass every interval_hours"""
+
+    def __init__(self, interval_hours=RUN_RETENTION_INTERVAL_HOURS):
+        self.interval_hours = interval_hours
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_report = None
+        self.last_error = None
+
+    def start(self):
+        if self.interval_hours > 0 and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="run-retention", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_hours * 3600):
+            try:
+                self.last_report = run_retention()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Run retention error: {e}")
+
+    def info(self):
+        report = self.last_report or {}
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "interval_hours": self.interval_hours,
+            "last_runs_archived": report.get("runs"),
+            "last_bytes_reclaimed": report.get("bytes_reclaimed"),
+            "last_error": self.last_error,
+        }
+
+retention_worker = RetentionWorker()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive and delete calculation runs outside the retention policy")
+    parser.add_argument("--keep", type=int, default=RUN_RETENTION_KEEP, help="Newest runs kept per user")
+    parser.add_argument("--max-age-days", type=int, default=RUN_RETENTION_MAX_AGE_DAYS, help="Also drop runs older than this (0 = off)")
+    parser.add_argument("--batch-size", type=int, default=RUN_RETENTION_BATCH, help="Runs deleted per transaction")
+    parser.add_argument("--archive-dir", default=RUN_ARCHIVE_DIR)
+    parser.add_argument("--dry-run", action="store_true", help="Only count the runs that would go")
+    parser.add_argument("--no-compact", action="store_true", help="Skip VACUUM afterwards")
+    args = parser.parse_args()
+    print_report(run_retention(args.keep, args.max_age_days, args.batch_size, args.archive_dir,
+                               dry_run=args.dry_run, do_compact=not args.no_compact))
@@ -0,0 +1,228 @@
+from array import array
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import select, text
+from create_retire_database import RetireYrData, RetireYrSeries, SessionLocal
+import argparse
+import os
+import sys
+import zlib
+
+# Storage layout for the per-year engine output:
+#   rows   - one retire_yr_data row per (run, group, year)  (default)
+#   series - one retire_yr_series row per (run, group) with every field packed as a float64 array,
+#            zlib-compressed (level and constant series compress well)
+#   both   - write both layouts, e.g. while migrating
+RETIRE_YR_STORAGE = os.getenv("RETIRE_YR_STORAGE", "rows")
+
+# retire_yr_data columns the engine actually populates; pretax_income, roth_eq_dist, roth_savings,
+# roth_eq_fed_tax, roth_atcf and the *_calc columns are never written, so they are not packed
+SERIES_FIELDS = (
+    "trad_dist", "roth_dist_opt", "trad_dist_opt",
+    "trad_savings", "roth_savings_opt", "trad_savings_opt",
+    "ss_benefit", "taxable_ss_trad", "pct_ss_taxed_trad", "taxable_ss_opt", "pct_ss_taxed_opt",
+    "taxable_income", "taxable_income_opt", "fed_tax", "fed_tax_opt",
+    "after_tax_dist_opt", "atcf_opt", "trad_atcf",
+    "trad_mtr", "trad_mtr_opt", "trad_mtr_adj", "trad_mtr_adj_opt",
+    "trad_dist_opt_tax_rate", "trad_cum_comp",
+)
+
+def writes_rows():
+    return RETIRE_YR_STORAGE in ("rows", "both")
+
+def writes_series():
+    return RETIRE_YR_STORAGE in ("series", "both")
+
+EIGHT_PLACES = Decimal('0.00000001')
+
+def _column_value(value):
+    """Round the way a Postgres Numeric(x, 8) retire_yr_data column would, so both layouts read back alike"""
+    return float(Decimal(value).quantize(EIGHT_PLACES, rounding=ROUND_HALF_UP)) if value is not None else 0.0
+
+def encode_series(records, fields=SERIES_FIELDS):
+    """Pack one group's year records (ordered by year) field-major into zlib-compressed little-endian float64s"""
+    packed = array("d")
+    for field in fields:
+        packed.extend(_column_value(getattr(r, field)) for r in records)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return zlib.compress(packed.tobytes())
+
+def build_series_rows(records, run_id, user_id):
+    """retire_yr_series mappings for a run's year records (any group order, years ascending within a group)"""
+    groups = {}
+    for record in records:
+        groups.setdefault(record.conv_group_num, []).append(record)
+
+    rows = []
+    for conv_group_num, group_records in groups.items():
+        group_records.sort(key=lambda r: r.year)
+        rows.append({
+            "run_id": run_id,
+            "user_id": user_id,
+            "conv_group_num": conv_group_num,
+            "start_year": group_records[0].year.year,
+            "start_age": group_records[0].age,
+            "num_years": len(group_records),
+            "field_names": ",".join(SERIES_FIELDS),
+            "series": encode_series(group_records),
+        })
+    return rows
+
+def decode_series(series_row, fields=None):
+    """Unpack the requested fields of a retire_yr_series row into {field: [float, ...]}"""
+    stored_fields = series_row.field_names.split(",")
+    packed = array("d")
+    packed.frombytes(zlib.decompress(series_row.series))
+    if sys.byteorder == "big":
+        packed.byteswap()
+
+    n = series_row.num_years
+    decoded = {}
+    for field in fields or stored_fields:
+        if field in stored_fields:
+            offset = stored_fields.index(field) * n
+            decoded[field] = packed[offset:offset + n].tolist()
+        else:
+            decoded[field] = [0.0] * n  # Column exists in retire_yr_data but the engine never writes it
+    return decoded
+
+def series_years(series_row):
+    """The year (Dec 31) and age axes a series row covers"""
+    years = [date(series_row.start_year + i, 12, 31) for i in range(series_row.num_years)]
+    ages = [series_row.start_age + i for i in range(series_row.num_years)]
+    return years, ages
+
+def series_to_records(series_row, fields):
+    """One dict per year with year, age and the requested fields - the retire_yr_data API shape"""
+    decoded = decode_series(series_row, fields)
+    years, ages = series_years(series_row)
+    records = []
+    for i, (year, age) in enumerate(zip(years, ages)):
+        record = {"year": year.isoformat(), "age": age}
+        for field in fields:
+            record[field] = decoded[field][i]
+        records.append(record)
+    return records
+
+def load_year_columns(session, run_id, fields, groups=None):
+    """{conv_group_num: {"year": [...], "age": [...], field: [...]}} for the requested groups (None = all)
+    of a run, reading only the requested columns from whichever layout holds the run (the configured
+    one first, then the other, for runs stored under a different RETIRE_YR_STORAGE)"""
+    first, second = (_series_columns, _row_columns) if writes_series() else (_row_columns, _series_columns)
+    return first(session, run_id, fields, groups) or second(session, run_id, fields, groups)
+
+def _series_columns(session, run_id, fields, groups):
+    columns = {}
+    query = select(RetireYrSeries).where(RetireYrSeries.run_id == run_id)
+    if groups is not None:
+        query = query.where(RetireYrSeries.conv_group_num.in_(groups))
+    for series_row in session.scalars(query.order_by(RetireYrSeries.conv_group_num)):
+        years, ages = series_years(series_row)
+        columns[series_row.conv_group_num] = dict(
+            {"year": [year.year for year in years], "age": ages}, **decode_series(series_row, fields)
+        )
+    return columns
+
+def _row_columns(session, run_id, fields, groups):
+    # Select just these columns, every requested group in one query
+    columns = {}
+    query = select(
+        RetireYrData.conv_group_num, RetireYrData.year, RetireYrData.age,
+        *(getattr(RetireYrData, field) for field in fields)
+    ).where(RetireYrData.run_id == run_id)
+    if groups is not None:
+        query = query.where(RetireYrData.conv_group_num.in_(groups))
+    for row in session.execute(query.order_by(RetireYrData.conv_group_num, RetireYrData.year)):
+        group = columns.get(row.conv_group_num)
+        if group is None:
+            group = columns[row.conv_group_num] = {"year": [], "age": [], **{field: [] for field in fields}}
+        group["year"].append(row.year.year)
+        group["age"].append(row.age)
+        for field in fields:
+            value = getattr(row, field)
+            group[field].append(float(value) if value is not None else 0.0)
+    return columns
+
+def migrate_rows_to_series(session, batch_runs=200, delete_rows=False):
+    """Copy retire_yr_data rows into retire_yr_series a batch of runs at a time; returns groups written"""
+    written = 0
+    last_run_id = 0
+    while True:
+        run_ids = session.scalars(
+            select(RetireYrData.run_id).where(RetireYrData.run_id > last_run_id)
+            .distinct().order_by(RetireYrData.run_id).limit(batch_runs)
+        ).all()
+        if not run_ids:
+            break
+
+        already_packed = set(session.execute(
+            select(RetireYrSeries.run_id, RetireYrSeries.conv_group_num).where(RetireYrSeries.run_id.in_(run_ids))
+        ).all())
+        records = session.query(RetireYrData).filter(RetireYrData.run_id.in_(run_ids)).order_by(
+            RetireYrData.run_id, RetireYrData.conv_group_num, RetireYrData.year
+        ).all()
+
+        by_run = {}
+        for record in records:
+            if (record.run_id, record.conv_group_num) not in already_packed:
+                by_run.setdefault((record.run_id, record.user_id), []).append(record)
+        series_rows = []
+        for (run_id, user_id), run_records in by_run.items():
+            series_rows.extend(build_series_rows(run_records, run_id, user_id))
+        session.bulk_insert_mappings(RetireYrSeries, series_rows)
+
+        if delete_rows:
+            session.query(RetireYrData).filter(RetireYrData.run_id.in_(run_ids)).delete(synchronize_session=False)
+        session.commit()
+        session.expunge_all()
+
+        written += len(series_rows)
+        last_run_id = run_ids[-1]
+        print(f"Migrated runs up to {last_run_id}: {written} series rows written")
+    return written
+
+def table_size_bytes(session, table_name):
+    """On-disk size of a table plus its indexes, or None if the backend can't report it"""
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        return session.execute(text("SELECT pg_total_relation_size(:name)"), {"name": table_name}).scalar()
+    if dialect == "sqlite":
+        try:
+            return session.execute(text(
+                "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN "
+                "(SELECT name FROM sqlite_master WHERE tbl_name = :name)"
+            ), {"name": table_name}).scalar()
+        except Exception:
+            return None  # SQLite built without the dbstat virtual table
+    return None
+
+def compare_sizes(session):
+    """Print row counts and on-disk size of both layouts"""
+    print(f"{'Table':<20} {'Rows':>10} {'Bytes':>14} {'Bytes/run':>12}")
+    print("-" * 60)
+    for model in (RetireYrData, RetireYrSeries):
+        table_name = model.__tablename__
+        row_count = session.execute(text(f"SELECT COUNT(*) FROM {table_name}")).scalar()
+        run_count = session.execute(text(f"SELECT COUNT(DISTINCT run_id) FROM {table_name}")).scalar()
+        size = table_size_bytes(session, table_name)
+        size_text = f"{size:,}" if size is not None else "n/a"
+        per_run = f"{size / run_count:,.0f}" if size is not None and run_count else "n/a"
+        print(f"{table_name:<20} {row_count:>10,} {size_text:>14} {per_run:>12}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate retire_yr_data rows to packed retire_yr_series storage")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="Pack existing retire_yr_data rows into retire_yr_series")
+    migrate_parser.add_argument("--batch-runs", type=int, default=200, help="Runs converted per transaction")
+    migrate_parser.add_argument("--delete-rows", action="store_true", help="Delete the rows once packed")
+    subparsers.add_parser("compare", help="Compare the size of both layouts")
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        if args.command == "migrate":
+            migrate_rows_to_series(session, args.batch_runs, args.delete_rows)
+        compare_sizes(session)
+    finally:
+        session.close()
@@ -0,0 +1,67 @@
+from contextlib import nullcontext
+import threading
+
+# Double-clicks and re-renders send the same calculation several times at once. Calls that share a
+# key (user plus normalized inputs) attach to the one already running and get its result; runs for
+# the same user with different inputs take turns, so one user's deletes and re-inserts never interleave.
+# Coalescing is per worker process.
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Runs fn once per key among concurrent callers and serializes runs per user"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._user_locks = {}  # user_id -> [lock, number of runs holding or waiting for it]
+        self.leaders = 0
+        self.shared = 0
+
+    def run(self, key, user_id, fn, guard=None):
+        """fn() for the first caller with this key; later callers wait and get the same result or error.
+        guard (a context manager factory, e.g. an admission slot) is entered only by the caller that runs fn."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                user_lock = self._user_locks.setdefault(user_id, [threading.Lock(), 0])
+                user_lock[1] += 1
+            else:
+                call.waiters += 1
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return dict(call.result) if isinstance(call.result, dict) else call.result
+
+        try:
+            with guard() if guard else nullcontext():
+                with user_lock[0]:
+                    call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                user_lock[1] -= 1
+                if not user_lock[1]:
+                    del self._user_locks[user_id]
+            call.done.set()
+
+    def info(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "shared": self.shared}
+
+calculation_flights = SingleFlight()
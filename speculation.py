@@ -0,0 +1,185 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
+from admission import calculation_admission
+from calc_roth_conv_data import compute_retire_and_conversions, plan_from_records, plan_key
+from create_retire_database import DB_URL, SessionLocal, is_memory_url
+from hot_queries import active_user, latest_input
+from tax_schedule import get_tax_table_version
+import os
+import threading
+import time
+
+# Speculative calculation. The frontend saves inputs and asks for a calculation straight after, so
+# POST /inputs starts computing the engine result in the background as soon as the inputs commit.
+# /calculate-yr-data then takes that result (waiting for it if it is still running) and only has to
+# persist it. A result is used only if it was computed from exactly the plan (user + normalized
+# inputs) the calculation reads, in the same tax year and against the same tax table version;
+# otherwise the calculation computes as usual. Saving inputs again supersedes (cancels) the user's
+# previous speculation. Results are kept per worker process for SPECULATION_TTL_SECONDS.
+# A speculative run takes a calculation admission slot like any calculation, but only if one is free
+# with nobody queued; otherwise it is skipped. A cancelled run (superseded, expired, or given up on by
+# a calculation that waited SPECULATION_WAIT_SECONDS) stops at the engine's next progress step, so
+# the calculation computing instead is not racing a duplicate for the rest of the run.
+# Off for in-memory SQLite, where every session shares one connection and a background run would
+# interleave with the request's transaction.
+SPECULATIVE_CALC = os.getenv("SPECULATIVE_CALC", "1") == "1" and not is_memory_url(DB_URL)
+SPECULATION_WORKERS = int(os.getenv("SPECULATION_WORKERS", "2"))  # Background engine runs at once
+SPECULATION_TTL_SECONDS = float(os.getenv("SPECULATION_TTL_SECONDS", "120"))
+SPECULATION_MAX_ENTRIES = int(os.getenv("SPECULATION_MAX_ENTRIES", "200"))
+SPECULATION_WAIT_SECONDS = float(os.getenv("SPECULATION_WAIT_SECONDS", "10"))  # Longest a calculation waits on a running one
+
+class _Cancelled(Exception):
+    pass
+
+class _Speculation:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.submitted_at = time.monotonic()
+        self.cancelled = threading.Event()
+        self.future = None
+
+class SpeculativeCalculations:
+    """Per-user background engine runs started on input save and taken by the next calculation"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._entries = {}  # user_id -> _Speculation (at most one per user)
+        self.counts = {
+            "submitted": 0, "superseded": 0, "expired": 0, "failed": 0,
+            "skipped": 0,    # No free admission slot
+            "cancelled": 0,  # Stopped part way through
+            "hit": 0,     # Result was ready
+            "joined": 0,  # Still running; the calculation waited for it
+            "stale": 0,   # Computed from other inputs, tax year or tax tables
+            "miss": 0,    # Nothing to take
+        }
+
+    def _count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def _prune(self):
+        """Drop results nobody took in time, and the oldest if there are too many. Caller holds the lock."""
+        now = time.monotonic()
+        for user_id, entry in list(self._entries.items()):
+            if now - entry.submitted_at > SPECULATION_TTL_SECONDS:
+                entry.cancelled.set()
+                entry.future.cancel()
+                del self._entries[user_id]
+                self.counts["expired"] += 1
+        while len(self._entries) >= SPECULATION_MAX_ENTRIES:
+            user_id = min(self._entries, key=lambda u: self._entries[u].submitted_at)
+            entry = self._entries.pop(user_id)
+            entry.cancelled.set()
+            entry.future.cancel()
+            self.counts["expired"] += 1
+
+    def submit(self, user_id):
+        """Start computing user_id's latest inputs in the background, superseding any earlier speculation"""
+        entry = _Speculation(user_id)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="speculative-calc")
+            previous = self._entries.pop(user_id, None)
+            if previous is not None:
+                previous.cancelled.set()
+                previous.future.cancel()  # Never starts if it was still queued; otherwise its result is dropped
+                self.counts["superseded"] += 1
+            self._prune()
+            entry.future = self._executor.submit(self._speculate, entry)
+            self._entries[user_id] = entry
+            self.counts["submitted"] += 1
+
+    def _speculate(self, entry):
+        """(plan key, tax table version, tax year, computed) for the user's latest inputs, or None if cancelled"""
+        if entry.cancelled.is_set():
+            return None
+        admission_key = f"speculation:{entry.user_id}"
+        if not calculation_admission.try_acquire(admission_key):
+            self._count("skipped")
+            return None
+
+        def stop_if_cancelled(kind, data):
+            if entry.cancelled.is_set():
+                raise _Cancelled()
+
+        started = time.monotonic()
+        session = SessionLocal()
+        try:
+            input_record = latest_input(session, entry.user_id)
+            user = active_user(session, entry.user_id)
+            if not input_record or not user:
+                return None
+            plan = plan_from_records(input_record, user)
+            run_date = datetime.now(timezone.utc)
+            tax_table_version = get_tax_table_version(session)  # Read first: tables changing mid-run make the result stale
+            computed = compute_retire_and_conversions(session, plan, run_date, stop_if_cancelled)
+        except _Cancelled:
+            self._count("cancelled")
+            return None
+        except Exception as e:
+            self._count("failed")
+            print(f"Speculative calculation for user {entry.user_id} failed: {e}")
+            return None
+        finally:
+            session.close()
+            calculation_admission.release(admission_key, time.monotonic() - started)
+        if entry.cancelled.is_set():
+            return None
+        return plan_key(entry.user_id, plan), tax_table_version, run_date.year, computed
+
+    def take(self, session, user_id, plan, run_date):
+        """The speculated result for exactly this plan, tax year and tax table version, or None.
+        Matches calc_retire_and_conversions(precomputed=...)."""
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+        if entry is None:
+            self._count("miss")
+            return None
+
+        outcome = "hit" if entry.future.done() else "joined"
+        try:
+            result = entry.future.result(timeout=SPECULATION_WAIT_SECONDS)
+        except FutureTimeoutError:
+            entry.cancelled.set()  # Stops at its next progress step; this calculation computes instead
+            entry.future.cancel()
+            result = None
+        except Exception:
+            result = None
+        if result is None:
+            self._count("miss")
+            return None
+
+        key, tax_table_version, tax_year, computed = result
+        if key != plan_key(user_id, plan) or tax_year != run_date.year or tax_table_version != get_tax_table_version(session):
+            self._count("stale")
+            return None
+        self._count(outcome)
+        return computed
+
+    def shutdown(self):
+        with self._lock:
+            for entry in self._entries.values():
+                entry.cancelled.set()
+            self._entries.clear()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def info(self):
+        with self._lock:
+            counts = dict(self.counts)
+            running = sum(1 for entry in self._entries.values() if not entry.future.done())
+            ready = len(self._entries) - running
+        taken = counts["hit"] + counts["joined"] + counts["stale"] + counts["miss"]
+        return {
+            "enabled": SPECULATIVE_CALC,
+            "running": running,
+            "ready": ready,
+            **counts,
+            "hit_rate": round((counts["hit"] + counts["joined"]) / taken, 3) if taken else None,
+        }
+
+calculation_speculation = SpeculativeCalculations(SPECULATION_WORKERS)
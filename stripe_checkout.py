@@ -0,0 +1,167 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import uuid
+
+# Checkout session creation against the Stripe API, made without tying up a threadpool worker:
+#   - the call is awaited on the event loop through stripe's async httpx client, with a hard
+#     STRIPE_TIMEOUT_SECONDS per attempt and STRIPE_CHECKOUT_DEADLINE_SECONDS for the whole request
+#   - connection errors, timeouts, 429s and 5xx are retried up to STRIPE_MAX_ATTEMPTS times with
+#     full-jitter exponential backoff; every attempt sends the same idempotency key, so a retry of a
+#     request Stripe did receive returns the same session instead of creating a second one
+#   - after STRIPE_BREAKER_FAILURES failed requests in a row the circuit opens and checkouts fail fast
+#     (503 + Retry-After) for STRIPE_BREAKER_RESET_SECONDS, then one trial request decides whether
+#     it closes again
+# STRIPE_API_BASE points the client somewhere else, e.g. the local stub for degraded-provider tests:
+#   python fake_stripe.py --serve-api --latency 2 --failure-rate 0.5
+#   STRIPE_API_BASE=http://127.0.0.1:12111 STRIPE_SECRET_KEY=sk_test_fake uvicorn main:app
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE")
+STRIPE_TIMEOUT_SECONDS = float(os.getenv("STRIPE_TIMEOUT_SECONDS", "5"))
+STRIPE_CHECKOUT_DEADLINE_SECONDS = float(os.getenv("STRIPE_CHECKOUT_DEADLINE_SECONDS", "12"))
+STRIPE_MAX_ATTEMPTS = int(os.getenv("STRIPE_MAX_ATTEMPTS", "3"))
+STRIPE_RETRY_BASE_SECONDS = float(os.getenv("STRIPE_RETRY_BASE_SECONDS", "0.25"))
+STRIPE_BREAKER_FAILURES = int(os.getenv("STRIPE_BREAKER_FAILURES", "5"))
+STRIPE_BREAKER_RESET_SECONDS = float(os.getenv("STRIPE_BREAKER_RESET_SECONDS", "30"))
+
+class StripeUnavailable(Exception):
+    """Stripe could not be reached in time, or the circuit is open"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker: closed -> open after failure_threshold failures ->
+    half_open (one trial call) after reset_seconds -> closed on success, open again on failure"""
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self.counts = {"success": 0, "failure": 0, "rejected": 0, "opened": 0}
+
+    def allow(self):
+        """True if a call may go out now (in half_open, only the single trial call)"""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "closed" or (self.state == "half_open" and not self._trial_in_flight):
+                self._trial_in_flight = self.state == "half_open"
+                return True
+            self.counts["rejected"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.counts["success"] += 1
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.counts["failure"] += 1
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.counts["opened"] += 1
+                    print(f"Stripe circuit opened after {self.failures} consecutive failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def abandon(self):
+        """The call was cancelled before it finished; frees the half_open trial slot without a verdict"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def retry_after(self):
+        """Whole seconds until an open circuit lets a trial call through"""
+        with self._lock:
+            if self.state != "open":
+                return 1
+            return max(1, int(self.reset_seconds - (time.monotonic() - self.opened_at) + 0.999))
+
+    def info(self):
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures, **self.counts}
+
+checkout_breaker = CircuitBreaker(STRIPE_BREAKER_FAILURES, STRIPE_BREAKER_RESET_SECONDS)
+
+_client = None
+
+def stripe_client():
+    """StripeClient on an async httpx transport, built on first use (stripe is a slow import).
+    Retries are ours, so the library's own network retries are off."""
+    global _client
+    if _client is None:
+        import stripe
+        _client = stripe.StripeClient(
+            os.getenv("STRIPE_SECRET_KEY"),
+            base_addresses={"api": STRIPE_API_BASE} if STRIPE_API_BASE else {},
+            http_client=stripe.HTTPXClient(timeout=STRIPE_TIMEOUT_SECONDS),
+            max_network_retries=0,
+        )
+    return _client
+
+def _retryable(exc):
+    """Timeouts, connection errors, rate limits and Stripe-side 5xx; other API errors are the request's fault"""
+    import stripe
+    if isinstance(exc, (asyncio.TimeoutError, stripe.APIConnectionError, stripe.RateLimitError)):
+        return True
+    return isinstance(exc, stripe.StripeError) and (exc.http_status or 0) >= 500
+
+async def create_checkout(email, price_id, user_id, base_url):
+    """Create a one-off payment Checkout Session for the user; returns its URL. Raises StripeUnavailable
+    when the circuit is open or Stripe keeps failing, and stripe errors for rejected requests."""
+    if not checkout_breaker.allow():
+        raise StripeUnavailable("Payments are temporarily unavailable", checkout_breaker.retry_after())
+
+    params = {
+        "customer_email": email,  # Pre-fill email from database
+        "line_items": [{"price": price_id, "quantity": 1}],
+        "mode": "payment",
+        "success_url": base_url + "/?payment=success&tab=conversions",
+        "cancel_url": base_url,
+        "metadata": {"user_id": str(user_id)},  # Store user_id for webhook
+    }
+    options = {"idempotency_key": f"checkout-{user_id}-{uuid.uuid4().hex}"}
+    deadline = time.monotonic() + STRIPE_CHECKOUT_DEADLINE_SECONDS
+    client = stripe_client()
+
+    try:
+        for attempt in range(1, STRIPE_MAX_ATTEMPTS + 1):
+            timeout = min(STRIPE_TIMEOUT_SECONDS, deadline - time.monotonic())
+            try:
+                if timeout <= 0:
+                    raise asyncio.TimeoutError()
+                checkout_session = await asyncio.wait_for(
+                    client.checkout.sessions.create_async(params=params, options=options), timeout
+                )
+            except Exception as e:
+                if not _retryable(e):
+                    if getattr(e, "http_status", None):
+                        checkout_breaker.record_success()  # Stripe answered; the request itself was bad
+                    else:
+                        checkout_breaker.abandon()
+                    raise
+                backoff = random.uniform(0, STRIPE_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+                if attempt == STRIPE_MAX_ATTEMPTS or time.monotonic() + backoff >= deadline:
+                    checkout_breaker.record_failure()
+                    print(f"Stripe checkout failed after {attempt} attempts: {type(e).__name__}: {e}")
+                    raise StripeUnavailable("Payment provider is not responding; try again shortly", checkout_breaker.retry_after())
+                print(f"Stripe checkout attempt {attempt} failed ({type(e).__name__}); retrying in {backoff:.2f}s")
+                await asyncio.sleep(backoff)
+                continue
+            checkout_breaker.record_success()
+            return checkout_session.url
+    except asyncio.CancelledError:
+        checkout_breaker.abandon()  # The client went away; not Stripe's failure
+        raise
@@ -0,0 +1,200 @@
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from create_retire_database import StripeEvent, User, SessionLocal
+from decimal import Decimal
+import datetime
+import json
+import os
+import threading
+
+# Stripe webhook deliveries are recorded in stripe_events (keyed by Stripe event id) and acknowledged
+# as soon as the row is committed; a background worker applies them to users afterwards. Stripe
+# retries and duplicate deliveries land on the existing row, so a payment is applied once.
+STRIPE_EVENT_WORKER = os.getenv("STRIPE_EVENT_WORKER", "1") == "1"
+STRIPE_EVENT_POLL_SECONDS = float(os.getenv("STRIPE_EVENT_POLL_SECONDS", "5"))
+MAX_ATTEMPTS = 5                        # Failed events are retried on later passes up to this many times
+STALE_CLAIM = datetime.timedelta(minutes=5)  # A claim older than this belonged to a worker that died
+
+def _now():
+    return datetime.datetime.now(datetime.UTC)
+
+def record_event(session, event):
+    """Store a verified event; returns False if the event id was already recorded. Caller commits."""
+    values = {
+        "event_id": event["id"],
+        "event_type": event["type"],
+        "payload": json.dumps(event),
+        "status": "pending",
+        "attempts": 0,
+        "delivery_count": 1,
+        "received_at": _now(),
+    }
+    dialect = session.bind.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        inserted = session.execute(insert(StripeEvent).values(**values).on_conflict_do_nothing()).rowcount == 1
+    else:
+        try:
+            with session.begin_nested():
+                session.add(StripeEvent(**values))
+            inserted = True
+        except IntegrityError:
+            inserted = False
+
+    if not inserted:
+        session.execute(
+            update(StripeEvent).where(StripeEvent.event_id == event["id"])
+            .values(delivery_count=StripeEvent.delivery_count + 1)
+        )
+    return inserted
+
+def apply_checkout_completed(session, checkout):
+    """Mark the paying user as paid; returns a short description of what was done"""
+    # Find user by the user_id stored when the checkout session was created, falling back to email
+    customer_email = (checkout.get("customer_details") or {}).get("email")
+    amount_total = (checkout.get("amount_total") or 0) / 100  # Convert cents to dollars
+    payment_intent = checkout.get("payment_intent")
+
+    user = None
+    user_id = (checkout.get("metadata") or {}).get("user_id")
+    if user_id and str(user_id).isdigit():
+        user = session.get(User, int(user_id))
+    if user is None and customer_email:
+        user = session.query(User).filter_by(email=customer_email).first()
+    if user is None:
+        return f"no user found with email {customer_email}"
+
+    user.subscription_status = "paid"
+    user.amount_paid = Decimal(str(amount_total))
+    user.payment_timestamp = _now()
+    user.stripe_subscription_id = payment_intent
+
+    # Set subscription end date (1 year from now)
+    user.sub_end_date = (_now() + datetime.timedelta(days=365)).date()
+
+    # Determine subscription type based on amount
+    # You'll need to adjust these amounts to match your actual prices
+    if amount_total >= 99:
+        user.subscription_type = "professional"
+    else:
+        user.subscription_type = "individual"
+    return f"user {user.user_id}: subscription_status=paid, type={user.subscription_type}, ${amount_total}"
+
+EVENT_HANDLERS = {
+    "checkout.session.completed": apply_checkout_completed,
+}
+
+def _claim(session, event_id):
+    """Atomically take an event for this worker (False if another worker got it first)"""
+    claimable = or_(
+        StripeEvent.status == "pending",
+        (StripeEvent.status == "failed") & (StripeEvent.attempts < MAX_ATTEMPTS),
+        (StripeEvent.status == "processing") & (StripeEvent.locked_at < _now() - STALE_CLAIM),
+    )
+    claimed = session.execute(
+        update(StripeEvent).where(StripeEvent.event_id == event_id, claimable)
+        .values(status="processing", locked_at=_now(), attempts=StripeEvent.attempts + 1)
+    ).rowcount == 1
+    session.commit()
+    return claimed
+
+def process_event(session, event_id):
+    """Claim and apply one recorded event; returns its final status (None if claimed elsewhere)"""
+    if not _claim(session, event_id):
+        return None
+
+    row = session.get(StripeEvent, event_id)
+    handler = EVENT_HANDLERS.get(row.event_type)
+    try:
+        if handler:
+            event = json.loads(row.payload)
+            outcome = handler(session, event["data"]["object"])
+            print(f"Stripe event {event_id} applied: {outcome}")
+        row.status = "applied" if handler else "ignored"
+        row.processed_at = _now()
+        row.last_error = None
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        session.execute(
+            update(StripeEvent).where(StripeEvent.event_id == event_id)
+            .values(status="failed", last_error=str(e))
+        )
+        session.commit()
+        print(f"Stripe event {event_id} failed: {e}")
+        return "failed"
+    return row.status
+
+def process_pending_events(limit=100):
+    """Apply up to limit outstanding events, oldest first; returns {status: count}"""
+    session = SessionLocal()
+    try:
+        event_ids = session.query(StripeEvent.event_id).filter(or_(
+            StripeEvent.status == "pending",
+            (StripeEvent.status == "failed") & (StripeEvent.attempts < MAX_ATTEMPTS),
+            (StripeEvent.status == "processing") & (StripeEvent.locked_at < _now() - STALE_CLAIM),
+        )).order_by(StripeEvent.received_at).limit(limit).all()
+        session.rollback()  # Release the read before each claim opens its own transaction
+
+        counts = {}
+        for (event_id,) in event_ids:
+            status = process_event(session, event_id)
+            if status:
+                counts[status] = counts.get(status, 0) + 1
+        return counts
+    finally:
+        session.close()
+
+class StripeEventWorker:
+    """Background thread that applies recorded events. The webhook wakes it after each new event;
+    it also polls, so events recorded by other processes (or left failed) are picked up."""
+
+    def __init__(self, poll_seconds=STRIPE_EVENT_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.processed = {}
+        self.last_error = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="stripe-event-worker", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def notify(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            try:
+                for status, count in process_pending_events().items():
+                    self.processed[status] = self.processed.get(status, 0) + count
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Stripe event worker error: {e}")
+
+    def info(self):
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "processed": dict(self.processed),
+            "last_error": self.last_error,
+        }
+
+stripe_event_worker = StripeEventWorker()
+
+if __name__ == "__main__":
+    # Drain outstanding events once, e.g. from a cron job when the in-process worker is disabled
+    print(process_pending_events(limit=10000))
@@ -0,0 +1,254 @@
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from decimal import Decimal
+from create_retire_database import ReferenceTable, SSProvisionalIncomeBrackets, StandardDeductions, TaxBrackets
+from tax_snapshot import current_snapshot
+import os
+import threading
+
+# Projected (inflation-indexed) tax schedules are the same for every user who shares a filing
+# status and inflation assumption, so they are built once per
+# (filing_status, year, inflation_assum, tax-table version) and shared across requests.
+TAX_SCHEDULE_CACHE_SIZE = int(os.getenv("TAX_SCHEDULE_CACHE_SIZE", "4096"))
+
+# reference_tables row the tax-data loader stamps whenever tax tables change
+TAX_TABLE_VERSION_TABLE = "tax_tables"
+TAX_TABLE_VERSION_KEY = "version"
+
+# Detached, immutable stand-ins for TaxBrackets / SSProvisionalIncomeBrackets rows, safe to share between sessions
+Bracket = namedtuple("Bracket", ["tax_rate", "income_max"])
+SSBracket = namedtuple("SSBracket", ["year", "filing_status", "ss_pct_taxed", "prov_income_min", "prov_income_max"])
+
+class CompiledTaxSchedule:
+    """Federal tax as a piecewise-linear function of taxable income. Cumulative tax at every bracket
+    boundary is precomputed, so tax, marginal rate and tax on an increment are a bisect (scalars,
+    exact Decimal arithmetic) or a searchsorted (NumPy arrays of incomes) instead of a bracket walk.
+
+    Brackets are rate-ascending objects with tax_rate and income_max (None for the open top bracket).
+    Results match the bracket-walking helpers this replaced, including their accumulation order."""
+
+    def __init__(self, brackets):
+        self.brackets = list(brackets)
+        self.thresholds = []       # income_max of each bounded bracket
+        self.rates = []            # tax_rate per bracket; one extra entry past the last threshold
+        self.lower_bounds = []     # income where each bracket starts (previous threshold)
+        self.cumulative_tax = []   # tax owed at each bracket's lower bound
+        self.open_top = False
+
+        running = Decimal('0')
+        prev_max = Decimal('0')
+        for bracket in self.brackets:
+            self.rates.append(bracket.tax_rate)
+            self.lower_bounds.append(prev_max)
+            self.cumulative_tax.append(running)
+            if bracket.income_max is None:
+                self.open_top = True
+                break
+            running += (bracket.income_max - prev_max) * bracket.tax_rate
+            self.thresholds.append(bracket.income_max)
+            prev_max = bracket.income_max
+
+        if not self.open_top:
+            # Income above the last bounded bracket is untaxed, as the bracket walk left it
+            self.rates.append(Decimal('0'))
+            self.lower_bounds.append(prev_max)
+            self.cumulative_tax.append(running)
+        self._float_arrays = None
+
+    def _segment(self, income):
+        """Index of the bracket that holds income: the first whose income_max >= income"""
+        return bisect_left(self.thresholds, income)
+
+    def tax(self, income):
+        """Tax owed on taxable income"""
+        i = self._segment(income)
+        if i == len(self.thresholds) and not self.open_top:
+            return self.cumulative_tax[i]
+        return self.cumulative_tax[i] + (income - self.lower_bounds[i]) * self.rates[i]
+
+    def marginal_rate(self, income):
+        """Rate on the next dollar of taxable income (0 for zero or negative income)"""
+        if income <= 0:
+            return Decimal('0')
+        return self.rates[self._segment(income + 1)]
+
+    def tax_on_increment(self, base_income, increment):
+        """Additional tax when taxable income grows from base_income by increment"""
+        return self.tax(base_income + increment) - self.tax(base_income)
+
+    def _arrays(self):
+        if self._float_arrays is None:
+            import numpy as np  # Only the vectorized paths need NumPy
+            self._float_arrays = (
+                np.array([float(t) for t in self.thresholds]),
+                np.array([float(r) for r in self.rates]),
+                np.array([float(b) for b in self.lower_bounds]),
+                np.array([float(c) for c in self.cumulative_tax]),
+            )
+        return self._float_arrays
+
+    def tax_array(self, incomes):
+        """Vectorized tax for an array of taxable incomes (float64)"""
+        import numpy as np
+        thresholds, rates, lower_bounds, cumulative_tax = self._arrays()
+        incomes = np.asarray(incomes, dtype=float)
+        i = np.searchsorted(thresholds, incomes, side="left")
+        return cumulative_tax[i] + (incomes - lower_bounds[i]) * rates[i]
+
+    def marginal_rate_array(self, incomes):
+        """Vectorized marginal rate for an array of taxable incomes (float64)"""
+        import numpy as np
+        thresholds, rates, _, _ = self._arrays()
+        incomes = np.asarray(incomes, dtype=float)
+        i = np.searchsorted(thresholds, incomes + 1, side="left")
+        return np.where(incomes <= 0, 0.0, rates[i])
+
+    def tax_on_increment_array(self, base_incomes, increments):
+        """Vectorized additional tax for arrays of base incomes and increments (float64)"""
+        import numpy as np
+        base_incomes = np.asarray(base_incomes, dtype=float)
+        return self.tax_array(base_incomes + np.asarray(increments, dtype=float)) - self.tax_array(base_incomes)
+
+def compile_tax_schedule(tax_brackets):
+    """CompiledTaxSchedule for a rate-ascending bracket list (passed through if already compiled)"""
+    if isinstance(tax_brackets, CompiledTaxSchedule):
+        return tax_brackets
+    return CompiledTaxSchedule(tax_brackets)
+
+class ProjectedTaxSchedule:
+    """One filing status' federal schedule for one year: the compiled bracket function (with the
+    cumulative tax at each threshold), the standard deduction, the 65+ add-on, and the Social
+    Security provisional-income brackets in force that year."""
+
+    def __init__(self, year, filing_status, brackets, std_ded, std_ded_65_add, ss_brackets):
+        self.year = year
+        self.filing_status = filing_status
+        self.brackets = brackets
+        self.compiled = CompiledTaxSchedule(brackets)
+        self.std_ded = std_ded
+        self.std_ded_65_add = std_ded_65_add
+        self.ss_brackets = ss_brackets
+
+    def ss_bracket(self, provisional_income):
+        """Same row the per-year SS bracket query returns: the latest year whose range holds the income"""
+        best = None
+        for bracket in self.ss_brackets:
+            if bracket.prov_income_min <= provisional_income and (
+                bracket.prov_income_max is None or bracket.prov_income_max >= provisional_income
+            ):
+                if best is None or bracket.year > best.year:
+                    best = bracket
+        return best
+
+class TaxScheduleCache:
+    """Thread-safe LRU of ProjectedTaxSchedule objects with hit/miss/eviction counters"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            schedule = self._entries.get(key)
+            if schedule is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return schedule
+
+    def put(self, key, schedule):
+        with self._lock:
+            self._entries[key] = schedule
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+schedule_cache = TaxScheduleCache(TAX_SCHEDULE_CACHE_SIZE)
+
+def get_tax_table_version(session, use_snapshot=True):
+    """Version stamp of the loaded tax tables ("0" until the loader has stamped one)"""
+    snapshot = current_snapshot() if use_snapshot else None
+    if snapshot:
+        # Republishing (even the same stamp after a manual fix) must not reuse schedules built from the old tables
+        return f"{snapshot.version}#{snapshot.generation}"
+    row = session.query(ReferenceTable.value).filter_by(
+        table_name=TAX_TABLE_VERSION_TABLE, row_key=TAX_TABLE_VERSION_KEY
+    ).first()
+    return row.value if row else "0"
+
+def get_run_year_tables(session, year, filing_status):
+    """Unprojected standard deduction in force in year (None if none) and that year's brackets, rate ascending"""
+    snapshot = current_snapshot()
+    if snapshot:
+        return snapshot.latest_standard_deduction(filing_status, year), snapshot.brackets_for_year(filing_status, year)
+
+    std_deduction = session.query(StandardDeductions).filter_by(
+        filing_status=filing_status
+    ).filter(
+        StandardDeductions.year <= year
+    ).order_by(StandardDeductions.year.desc()).first()
+    tax_brackets = session.query(TaxBrackets).filter_by(
+        year=year, filing_status=filing_status
+    ).order_by(TaxBrackets.tax_rate.asc()).all()
+    return std_deduction, tax_brackets
+
+def build_projected_schedule(session, year, filing_status, inflation_assum):
+    """Reads and projects one year's schedule from the shared snapshot, or the tax tables without one"""
+    # Imported here: calc_roth_conv_data imports this module
+    from calc_roth_conv_data import (
+        get_standard_deduction_for_year, get_tax_brackets_for_year, project_standard_deduction, project_tax_brackets
+    )
+
+    snapshot = current_snapshot()
+    if snapshot:
+        std_ded, std_ded_65_add = project_standard_deduction(
+            snapshot.latest_standard_deduction(filing_status, year), year, filing_status, inflation_assum
+        )
+        year_brackets = project_tax_brackets(snapshot.latest_brackets(filing_status, year), year, inflation_assum)
+        ss_rows = snapshot.ss_brackets_through(filing_status, year)
+    else:
+        std_ded, std_ded_65_add = get_standard_deduction_for_year(session, year, filing_status, inflation_assum)
+        year_brackets = get_tax_brackets_for_year(session, year, filing_status, inflation_assum)
+        SSPI = SSProvisionalIncomeBrackets
+        ss_rows = session.query(SSPI).filter(
+            SSPI.filing_status == filing_status,
+            SSPI.year <= year
+        ).order_by(SSPI.year.desc(), SSPI.ss_pct_taxed.asc()).all()
+
+    brackets = [Bracket(b.tax_rate, b.income_max) for b in year_brackets]
+    ss_brackets = [
+        SSBracket(b.year, b.filing_status, b.ss_pct_taxed, b.prov_income_min, b.prov_income_max)
+        for b in ss_rows
+    ]
+    return ProjectedTaxSchedule(year, filing_status, brackets, std_ded, std_ded_65_add, ss_brackets)
+
+def get_projected_schedule(session, year, filing_status, inflation_assum, tax_table_version):
+    """Cached projected schedule; builds (and caches) it from the tax tables on a miss"""
+    key = (filing_status, year, inflation_assum, tax_table_version)
+    schedule = schedule_cache.get(key)
+    if schedule is None:
+        schedule = build_projected_schedule(session, year, filing_status, inflation_assum)
+        schedule_cache.put(key, schedule)
+    return schedule
@@ -0,0 +1,370 @@
+from collections import namedtuple
+from contextlib import contextmanager
+from decimal import Decimal
+from sqlalchemy import Integer, Numeric, String
+from create_retire_database import TaxBrackets, StandardDeductions, SSProvisionalIncomeBrackets, SessionLocal
+import argparse
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Read-only snapshot of the tax reference tables, shared by every worker process. A loader (or the
+# first worker to start) publishes the tables into a memory-mapped data file; every worker maps the
+# same file, so the pages live once in the OS page cache and no worker queries the tax tables.
+#
+#   <TAX_SNAPSHOT_PATH>          control file: magic + current generation (uint64), updated in place
+#   <TAX_SNAPSHOT_PATH>.<gen>    data file for one generation: header, then fixed-width rows per table,
+#                                sorted by (filing_status, year, rate) so the sorted rows are the index
+#
+# Workers keep the data file mapped and answer lookups from it directly: a binary search over the
+# mapped rows, decoding only the rows a lookup returns. They read the generation from the mapped
+# control file on each lookup (a memory read, no system call) and map the new data file when
+# load_retire_data publishes a newer generation.
+# Projected schedules depend on each user's inflation assumption, so they are not in the snapshot;
+# each worker builds them from it into its own LRU (see tax_schedule.py).
+# Unset TAX_SNAPSHOT_PATH to read the tax tables from the database as before.
+TAX_SNAPSHOT_PATH = os.getenv("TAX_SNAPSHOT_PATH")
+
+CONTROL_MAGIC = b"RTAXCTL1"
+DATA_MAGIC = b"RTAXSNP2"
+CONTROL = struct.Struct("<8sQ")                # magic, generation
+DATA_HEADER = struct.Struct("<8sQ48sIII")      # magic, generation, tax-table version, row count per table
+NULL_NUMERIC = -(2 ** 63)                       # Stored for NULL Numeric columns (open-ended brackets)
+STRING_BYTES = 8                                # Fixed width of String columns (filing statuses)
+PROBE_INTERVAL = 5.0                            # Seconds between checks for a control file that isn't there yet
+
+SNAPSHOT_TABLES = (TaxBrackets, StandardDeductions, SSProvisionalIncomeBrackets)
+# Rows are stored sorted by (filing_status, year, this column): the order the lookups return them in
+ORDER_COLUMNS = {TaxBrackets: "tax_rate", StandardDeductions: None, SSProvisionalIncomeBrackets: "ss_pct_taxed"}
+
+def _row_layout(model):
+    """Struct and per-column decimal scale for a table: integers and strings as-is, Numerics as scaled int64s"""
+    formats, scales = [], []
+    for column in model.__table__.columns:
+        if isinstance(column.type, Numeric):
+            formats.append("q")
+            scales.append(column.type.scale)
+        elif isinstance(column.type, Integer):
+            formats.append("q")
+            scales.append(None)
+        elif isinstance(column.type, String):
+            formats.append(f"{STRING_BYTES}s")
+            scales.append(None)
+        else:
+            raise TypeError(f"{model.__tablename__}.{column.name} can't be stored in a tax snapshot")
+    return struct.Struct("<" + "".join(formats)), scales
+
+ROW_LAYOUTS = {model: _row_layout(model) for model in SNAPSHOT_TABLES}
+ROW_TYPES = {model: namedtuple(model.__name__ + "Row", [c.name for c in model.__table__.columns]) for model in SNAPSHOT_TABLES}
+
+def _encode_row(model, record):
+    layout, scales = ROW_LAYOUTS[model]
+    values = []
+    for column, scale in zip(model.__table__.columns, scales):
+        value = getattr(record, column.name)
+        if scale is not None:
+            value = NULL_NUMERIC if value is None else int(Decimal(value).scaleb(scale).to_integral_value())
+        elif isinstance(column.type, String):
+            value = value.encode("utf-8")
+            if len(value) > STRING_BYTES:
+                raise ValueError(
+                    f"{model.__tablename__}.{column.name} value {getattr(record, column.name)!r} is longer "
+                    f"than the {STRING_BYTES} bytes a tax snapshot stores"
+                )
+        values.append(value)
+    return layout.pack(*values)
+
+def _decode_row(model, values):
+    layout, scales = ROW_LAYOUTS[model]
+    decoded = []
+    for column, scale, value in zip(model.__table__.columns, scales, values):
+        if scale is not None:
+            value = None if value == NULL_NUMERIC else Decimal(value).scaleb(-scale)
+        elif isinstance(column.type, String):
+            value = value.rstrip(b"\0").decode("utf-8")
+        decoded.append(value)
+    return ROW_TYPES[model](*decoded)
+
+def _sort_key(model, record):
+    """Stored row order: filing status as its stored (zero-padded) bytes, then year, then the order column"""
+    order_column = ORDER_COLUMNS[model]
+    return (
+        _status_key(record.filing_status),
+        record.year,
+        getattr(record, order_column) if order_column else 0,
+    )
+
+def _status_key(filing_status):
+    return filing_status.encode("utf-8").ljust(STRING_BYTES, b"\0")
+
+class MappedTable:
+    """One table's rows in a mapped data file, sorted by (filing_status, year, ...). Lookups binary
+    search the mapped bytes and decode only the rows they return."""
+
+    def __init__(self, model, buffer, count):
+        self.model = model
+        self.layout = ROW_LAYOUTS[model][0]
+        self.buffer = buffer  # memoryview of this table's rows inside the mapping
+        self.count = count
+        fields = ROW_TYPES[model]._fields
+        self._status_index = fields.index("filing_status")
+        self._year_index = fields.index("year")
+
+    def _values(self, i):
+        return self.layout.unpack_from(self.buffer, i * self.layout.size)
+
+    def _key(self, i):
+        values = self._values(i)
+        return values[self._status_index], values[self._year_index]
+
+    def _bound(self, key):
+        """Index of the first row whose (filing_status, year) is not below key"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _rows(self, start, stop):
+        return [_decode_row(self.model, self._values(i)) for i in range(start, stop)]
+
+    def year_rows(self, filing_status, year):
+        """Rows for exactly this filing status and year"""
+        status = _status_key(filing_status)
+        return self._rows(self._bound((status, year)), self._bound((status, year + 1)))
+
+    def rows_through(self, filing_status, year):
+        """Rows for this filing status up to and including year, oldest year first"""
+        status = _status_key(filing_status)
+        return self._rows(self._bound((status, NULL_NUMERIC)), self._bound((status, year + 1)))
+
+    def latest_year(self, filing_status, year):
+        """Latest year at or before year with rows for this filing status, or None"""
+        status = _status_key(filing_status)
+        i = self._bound((status, year + 1))
+        if i == 0:
+            return None
+        found_status, found_year = self._key(i - 1)
+        return found_year if found_status == status else None
+
+class TaxSnapshot:
+    """One generation of the tax tables, served from the mapped data file, answering the same lookups
+    the engine otherwise runs against the database (same filters and ordering)"""
+
+    def __init__(self, generation, version, mapping, tables):
+        self.generation = generation
+        self.version = version
+        self.mapping = mapping  # Kept open for the snapshot's lifetime; unmapped when it is collected
+        self.tax_brackets = tables[TaxBrackets]
+        self.standard_deductions = tables[StandardDeductions]
+        self.ss_brackets = tables[SSProvisionalIncomeBrackets]
+
+    def latest_standard_deduction(self, filing_status, year):
+        """Deduction row of the latest year at or before year (None if there is none)"""
+        latest = self.standard_deductions.latest_year(filing_status, year)
+        return self.standard_deductions.year_rows(filing_status, latest)[0] if latest is not None else None
+
+    def latest_brackets(self, filing_status, year):
+        """Brackets (rate ascending) of the latest year at or before year"""
+        latest = self.tax_brackets.latest_year(filing_status, year)
+        return self.tax_brackets.year_rows(filing_status, latest) if latest is not None else []
+
+    def brackets_for_year(self, filing_status, year):
+        """Brackets (rate ascending) for exactly this year"""
+        return self.tax_brackets.year_rows(filing_status, year)
+
+    def ss_brackets_through(self, filing_status, year):
+        """SS provisional-income brackets up to year, latest year first"""
+        rows = self.ss_brackets.rows_through(filing_status, year)
+        return sorted(rows, key=lambda b: -b.year)  # Stable: ss_pct_taxed stays ascending within a year
+
+def _data_path(path, generation):
+    return f"{path}.{generation}"
+
+def _map_file(file_path):
+    with open(file_path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def read_snapshot(path, generation):
+    """Map the data file for one generation; lookups read the mapping in place"""
+    mapping = _map_file(_data_path(path, generation))
+    magic, stored_generation, version, *counts = DATA_HEADER.unpack_from(mapping, 0)
+    if magic != DATA_MAGIC or stored_generation != generation:
+        mapping.close()
+        raise ValueError(f"{_data_path(path, generation)} is not tax snapshot generation {generation}")
+
+    view = memoryview(mapping)
+    offset = DATA_HEADER.size
+    tables = {}
+    for model, count in zip(SNAPSHOT_TABLES, counts):
+        size = ROW_LAYOUTS[model][0].size * count
+        tables[model] = MappedTable(model, view[offset:offset + size], count)
+        offset += size
+    return TaxSnapshot(generation, version.rstrip(b"\0").decode("ascii"), mapping, tables)
+
+def _readable(path, generation):
+    """True if the generation's data file exists and is in this version's format"""
+    try:
+        with open(_data_path(path, generation), "rb") as f:
+            header = f.read(DATA_HEADER.size)
+    except FileNotFoundError:
+        return False
+    return len(header) == DATA_HEADER.size and DATA_HEADER.unpack(header)[0] == DATA_MAGIC
+
+def publish_snapshot(session, path=None):
+    """Write the current tax tables as a new generation and point the control file at it; returns the generation"""
+    path = path or TAX_SNAPSHOT_PATH
+    with _publish_lock(path):
+        return _publish(session, path)
+
+def ensure_snapshot(session, path=None):
+    """Publish a first generation if none exists yet, or the current one is in an older format
+    (workers racing at startup publish once)"""
+    path = path or TAX_SNAPSHOT_PATH
+    generation = read_generation(path)
+    if generation and _readable(path, generation):
+        return generation
+    with _publish_lock(path):
+        generation = read_generation(path)
+        if generation and _readable(path, generation):
+            return generation
+        return _publish(session, path)
+
+def _publish(session, path):
+    from tax_schedule import get_tax_table_version  # tax_schedule reads snapshots through this module
+
+    generation = read_generation(path) + 1
+    version = get_tax_table_version(session, use_snapshot=False)
+    chunks, counts = [], []
+    for model in SNAPSHOT_TABLES:
+        records = sorted(session.query(model).all(), key=lambda record: _sort_key(model, record))
+        chunks.extend(_encode_row(model, record) for record in records)
+        counts.append(len(records))
+
+    tmp_path = _data_path(path, generation) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(DATA_HEADER.pack(DATA_MAGIC, generation, version.encode("ascii"), *counts))
+        f.write(b"".join(chunks))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _data_path(path, generation))
+    _write_generation(path, generation)
+
+    # Keep the previous generation for a worker that read its number just before this publish
+    for old in range(max(generation - 5, 1), generation - 1):
+        try:
+            os.remove(_data_path(path, old))
+        except FileNotFoundError:
+            pass
+    print(f"Published tax snapshot generation {generation} (version {version}) to {path}")
+    return generation
+
+@contextmanager
+def _publish_lock(path):
+    """Exclusive lock file around publishing (advisory flock; no-op where fcntl isn't available)"""
+    with open(f"{path}.lock", "a") as lock_file:
+        try:
+            import fcntl
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except ImportError:
+            pass
+        yield  # Closing the file releases the lock
+
+def read_generation(path):
+    """Current generation in the control file (0 if nothing has been published)"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read(CONTROL.size)
+    except FileNotFoundError:
+        return 0
+    if len(data) < CONTROL.size:
+        return 0
+    magic, generation = CONTROL.unpack(data)
+    return generation if magic == CONTROL_MAGIC else 0
+
+def _write_generation(path, generation):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size < CONTROL.size:
+            os.pwrite(fd, CONTROL.pack(CONTROL_MAGIC, 0), 0)
+        # The generation is one aligned 8-byte write into the mapped page, so readers never see half of it
+        os.pwrite(fd, struct.pack("<Q", generation), 8)
+    finally:
+        os.close(fd)
+
+class SnapshotReader:
+    """Per-process view of the published snapshot: maps the control file once and swaps in a new
+    data file whenever the generation moves"""
+
+    def __init__(self, path):
+        self.path = path
+        self._control = None
+        self._snapshot = None
+        self._next_probe = 0.0
+        self._lock = threading.Lock()
+
+    def current(self):
+        """The latest published snapshot, or None if nothing has been published yet"""
+        if self._control is None:
+            now = time.monotonic()
+            if now < self._next_probe:
+                return None
+            self._next_probe = now + PROBE_INTERVAL
+            try:
+                self._control = _map_file(self.path)
+            except (FileNotFoundError, ValueError):
+                return None  # Not published yet (ValueError: mapped while still empty)
+
+        magic, generation = CONTROL.unpack_from(self._control, 0)
+        snapshot = self._snapshot
+        if magic != CONTROL_MAGIC or generation == 0:
+            return snapshot
+        if snapshot is None or snapshot.generation != generation:
+            with self._lock:
+                if self._snapshot is None or self._snapshot.generation != generation:
+                    self._snapshot = read_snapshot(self.path, generation)
+                snapshot = self._snapshot
+        return snapshot
+
+    def info(self):
+        snapshot = self._snapshot
+        return {
+            "path": self.path,
+            "generation": snapshot.generation if snapshot else 0,
+            "version": snapshot.version if snapshot else None,
+        }
+
+snapshot_reader = SnapshotReader(TAX_SNAPSHOT_PATH) if TAX_SNAPSHOT_PATH else None
+
+def current_snapshot():
+    """The shared tax snapshot if one is configured and published, else None (read the database)"""
+    return snapshot_reader.current() if snapshot_reader else None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish or inspect the shared tax-table snapshot")
+    parser.add_argument("command", choices=["publish", "show"])
+    parser.add_argument("--path", default=TAX_SNAPSHOT_PATH, help="Control file path (default: TAX_SNAPSHOT_PATH)")
+    args = parser.parse_args()
+    if not args.path:
+        parser.error("set TAX_SNAPSHOT_PATH or pass --path")
+
+    if args.command == "publish":
+        session = SessionLocal()
+        try:
+            publish_snapshot(session, args.path)
+        finally:
+            session.close()
+    else:
+        generation = read_generation(args.path)
+        if not generation:
+            print(f"No tax snapshot published at {args.path}")
+        else:
+            snapshot = read_snapshot(args.path, generation)
+            print(f"Generation {generation}, version {snapshot.version}: "
+                  f"{snapshot.tax_brackets.count} brackets, {snapshot.standard_deductions.count} deductions, "
+                  f"{snapshot.ss_brackets.count} SS brackets")
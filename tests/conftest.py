@@ -0,0 +1,34 @@
+import os
+import pytest
+import sys
+import tempfile
+import uuid
+
+# The modules under test live at the repository root and build their engine from DATABASE_URL on
+# import; tests run against an in-memory SQLite database unless one is given.
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+# Tests drain recorded Stripe events themselves rather than racing the background worker
+os.environ.setdefault("STRIPE_EVENT_WORKER", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Relative runtime paths (roth_app.log, run_archive/) resolve against the working directory; keep
+# them out of the checkout.
+os.chdir(tempfile.mkdtemp(prefix="roth_app_tests_"))
+
+@pytest.fixture(scope="session")
+def client():
+    """The app on the test database; startup creates the schema and seeds the tax tables"""
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def user_with_inputs(client):
+    """user_id of a new user with the load-test sample inputs saved"""
+    from load_test import SAMPLE_INPUTS, SAMPLE_PROFILE
+    name = f"test_{uuid.uuid4().hex[:12]}"
+    body = dict(SAMPLE_PROFILE, username=name, password="test-password", email=f"{name}@local")
+    user_id = client.post("/users", json=body).json()["user_id"]
+    inputs = dict(SAMPLE_INPUTS, user_id=user_id, trad_savings=SAMPLE_PROFILE["trad_savings"], roth_savings=SAMPLE_PROFILE["roth_savings"])
+    assert client.post("/inputs", json=inputs).status_code == 200
+    return user_id
@@ -0,0 +1,24 @@
+from sqlalchemy import event
+from calc_roth_conv_data import calc_retire_and_conversions
+from create_retire_database import engine
+from query_budget import track_queries
+
+# One stored run: calculation_runs insert, calc_count update, deletes of the user's retire_yr_data,
+# retire_yr_series, roth_conversions and roth_conversions_parts, bulk inserts of retire_yr_data,
+# roth_conversions and roth_conversions_parts, and the input update
+WRITE_STATEMENTS_PER_RUN = 10
+
+def test_calculation_writes_in_one_transaction(user_with_inputs):
+    commits = []
+    listener = lambda conn: commits.append(conn)
+    event.listen(engine, "commit", listener)
+    try:
+        with track_queries() as stats:
+            result = calc_retire_and_conversions(user_with_inputs)
+    finally:
+        event.remove(engine, "commit", listener)
+
+    assert result["run_id"]
+    writes = [s for s, _ in stats.statements if s.split()[0].upper() in ("INSERT", "UPDATE", "DELETE")]
+    assert len(writes) == WRITE_STATEMENTS_PER_RUN, "\n".join(writes)
+    assert len(commits) == 1
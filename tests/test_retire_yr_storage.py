@@ -0,0 +1,55 @@
+import pytest
+from calc_roth_conv_data import calc_retire_and_conversions
+from create_retire_database import RetireYrData, RetireYrSeries, SessionLocal
+from hot_queries import RETIRE_YR_API_FIELDS
+import retire_yr_series
+
+COLUMNS_QUERY = f"fields={','.join(RETIRE_YR_API_FIELDS)}&groups=all"
+
+def stored(user_id):
+    session = SessionLocal()
+    try:
+        return (
+            session.query(RetireYrData).filter_by(user_id=user_id).count(),
+            session.query(RetireYrSeries).filter_by(user_id=user_id).count(),
+        )
+    finally:
+        session.close()
+
+def assert_records_match(actual, expected):
+    assert [(r["year"], r["age"]) for r in actual] == [(r["year"], r["age"]) for r in expected]
+    for record, want in zip(actual, expected):
+        for field in RETIRE_YR_API_FIELDS:
+            assert record[field] == pytest.approx(want[field], abs=0.01), (record["year"], field)
+
+def assert_columns_match(actual, expected):
+    assert actual["fields"] == expected["fields"]
+    assert [g["conv_group_num"] for g in actual["groups"]] == [g["conv_group_num"] for g in expected["groups"]]
+    for group, want in zip(actual["groups"], expected["groups"]):
+        assert (group["year"], group["age"]) == (want["year"], want["age"])
+        for field in RETIRE_YR_API_FIELDS:
+            assert group[field] == pytest.approx(want[field], abs=0.01), (group["conv_group_num"], field)
+
+@pytest.mark.parametrize("written, configured", [("series", "rows"), ("rows", "series")])
+def test_runs_read_back_after_switching_layout(client, user_with_inputs, monkeypatch, written, configured):
+    monkeypatch.setattr(retire_yr_series, "RETIRE_YR_STORAGE", "both")
+    run_id = calc_retire_and_conversions(user_with_inputs)["run_id"]
+    expected = client.get(f"/retire_yr_data/{run_id}").json()
+    expected_columns = client.get(f"/retire_yr_data/{run_id}?{COLUMNS_QUERY}").json()
+    assert any(record["fed_tax_opt"] for record in expected)
+
+    monkeypatch.setattr(retire_yr_series, "RETIRE_YR_STORAGE", written)
+    run_id = calc_retire_and_conversions(user_with_inputs)["run_id"]
+    rows, series = stored(user_with_inputs)
+    assert (rows > 0, series > 0) == (written == "rows", written == "series")
+
+    monkeypatch.setattr(retire_yr_series, "RETIRE_YR_STORAGE", configured)
+    response = client.get(f"/retire_yr_data/{run_id}")
+    assert response.status_code == 200
+    assert_records_match(response.json(), expected)
+    assert_columns_match(client.get(f"/retire_yr_data/{run_id}?{COLUMNS_QUERY}").json(), expected_columns)
+
+    # The next run replaces the user's year data in both layouts, not just the configured one
+    calc_retire_and_conversions(user_with_inputs)
+    rows, series = stored(user_with_inputs)
+    assert (rows > 0, series > 0) == (configured == "rows", configured == "series")
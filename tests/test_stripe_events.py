@@ -0,0 +1,45 @@
+import json
+from create_retire_database import SessionLocal, StripeEvent, User
+from fake_stripe import checkout_completed_event, sign
+from stripe_events import process_pending_events
+
+WEBHOOK_SECRET = "whsec_test"
+DELIVERIES = 3
+
+def deliver(client, payload):
+    headers = {"Stripe-Signature": sign(payload, WEBHOOK_SECRET), "Content-Type": "application/json"}
+    return client.post("/stripe-webhook", content=payload, headers=headers)
+
+def test_duplicate_deliveries_apply_once(client, user_with_inputs, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "STRIPE_WEBHOOK_SECRET", WEBHOOK_SECRET)
+    event = checkout_completed_event(user_id=user_with_inputs, amount_cents=2500)
+    payload = json.dumps(event)
+
+    responses = [deliver(client, payload) for _ in range(DELIVERIES)]
+    assert [r.status_code for r in responses] == [200] * DELIVERIES
+    assert [r.json()["status"] for r in responses] == ["success"] + ["duplicate"] * (DELIVERIES - 1)
+
+    session = SessionLocal()
+    try:
+        rows = session.query(StripeEvent).filter_by(event_id=event["id"]).all()
+        assert [(row.status, row.delivery_count) for row in rows] == [("pending", DELIVERIES)]
+        assert session.get(User, user_with_inputs).subscription_status != "paid"
+        session.rollback()
+
+        assert process_pending_events() == {"applied": 1}
+        user = session.get(User, user_with_inputs)
+        paid = (user.subscription_status, float(user.amount_paid), user.payment_timestamp)
+        assert paid[:2] == ("paid", 25.0)
+        session.rollback()
+
+        # Drained: nothing is left to apply, and the user is not updated again
+        assert process_pending_events() == {}
+        assert deliver(client, payload).json()["status"] == "duplicate"
+        assert process_pending_events() == {}
+        row = session.get(StripeEvent, event["id"])
+        assert (row.status, row.attempts, row.delivery_count) == ("applied", 1, DELIVERIES + 1)
+        user = session.get(User, user_with_inputs)
+        assert (user.subscription_status, float(user.amount_paid), user.payment_timestamp) == paid
+    finally:
+        session.close()
@@ -0,0 +1,131 @@
+from decimal import Decimal
+import pytest
+from calc_roth_conv_data import calculate_conversion_tax, calculate_federal_taxes, get_mtr
+from tax_schedule import Bracket, CompiledTaxSchedule
+
+# Reference implementations: the bracket walks CompiledTaxSchedule replaced, kept verbatim so the
+# compiled lookups can be checked against them.
+
+def walk_federal_taxes(tax_brackets, taxable_income, taxable_income_opt):
+    fed_tax = Decimal('0')
+    fed_tax_opt = Decimal('0')
+    prev_max = Decimal('0')
+
+    for bracket in tax_brackets:
+        if taxable_income <= (bracket.income_max or taxable_income):
+            fed_tax += (taxable_income - prev_max) * bracket.tax_rate
+            income_done = True
+        else:
+            fed_tax += (bracket.income_max - prev_max) * bracket.tax_rate
+            income_done = False
+        if taxable_income_opt <= (bracket.income_max or taxable_income_opt):
+            fed_tax_opt += (taxable_income_opt - prev_max) * bracket.tax_rate
+            income_opt_done = True
+        else:
+            fed_tax_opt += (bracket.income_max - prev_max) * bracket.tax_rate
+            income_opt_done = False
+
+        prev_max = bracket.income_max
+        if income_done and income_opt_done:
+            break
+    return fed_tax, fed_tax_opt
+
+def walk_mtr(tax_brackets, taxable_income):
+    if taxable_income <= 0:
+        return Decimal('0')
+    for bracket in tax_brackets:
+        if (taxable_income + 1) <= (bracket.income_max or taxable_income + 1):
+            return bracket.tax_rate
+    return Decimal('0')
+
+def walk_conversion_tax(conv_amt, tax_brackets, std_deduction):
+    taxable_amt = conv_amt - std_deduction
+    if taxable_amt <= 0:
+        return Decimal('0')
+
+    conv_tax = Decimal('0')
+    prev_max = Decimal('0')
+    for tax_bracket in tax_brackets:
+        if taxable_amt <= (tax_bracket.income_max or taxable_amt):
+            taxable_in_bracket = taxable_amt - prev_max
+            conv_tax += taxable_in_bracket * tax_bracket.tax_rate
+            break
+        else:
+            taxable_in_bracket = tax_bracket.income_max - prev_max
+            conv_tax += taxable_in_bracket * tax_bracket.tax_rate
+            prev_max = tax_bracket.income_max
+    return conv_tax
+
+OPEN_TOP = [
+    Bracket(Decimal('0.10'), Decimal('11925')),
+    Bracket(Decimal('0.12'), Decimal('48475')),
+    Bracket(Decimal('0.22'), Decimal('103350')),
+    Bracket(Decimal('0.24'), Decimal('197300')),
+    Bracket(Decimal('0.32'), Decimal('250525')),
+    Bracket(Decimal('0.35'), Decimal('626350')),
+    Bracket(Decimal('0.37'), None),
+]
+# Projected (inflation-indexed) thresholds are not whole dollars
+PROJECTED = [
+    Bracket(b.tax_rate, b.income_max * Decimal('1.025') ** 3 if b.income_max else None) for b in OPEN_TOP
+]
+NO_OPEN_TOP = OPEN_TOP[:-1]
+SCHEDULES = {"open_top": OPEN_TOP, "projected": PROJECTED, "no_open_top": NO_OPEN_TOP}
+
+def incomes_for(brackets):
+    """Zero, negative, each boundary exactly and either side of it, and well past the top"""
+    incomes = [Decimal('0'), Decimal('-1'), Decimal('-25000.50'), Decimal('0.01'), Decimal('1'), Decimal('5000000')]
+    for bracket in brackets:
+        if bracket.income_max is not None:
+            edge = bracket.income_max
+            incomes += [edge, edge - 1, edge + 1, edge - Decimal('0.01'), edge + Decimal('0.01'), edge - Decimal('0.5')]
+    return incomes
+
+CASES = [(name, income) for name, brackets in SCHEDULES.items() for income in incomes_for(brackets)]
+
+@pytest.mark.parametrize("name, income", CASES)
+def test_federal_taxes_match_walk(name, income):
+    brackets = SCHEDULES[name]
+    assert calculate_federal_taxes(brackets, income, income) == walk_federal_taxes(brackets, income, income)
+    assert CompiledTaxSchedule(brackets).tax(income) == walk_federal_taxes(brackets, income, income)[0]
+
+@pytest.mark.parametrize("name", SCHEDULES)
+def test_federal_taxes_pair_is_two_independent_lookups(name):
+    # The old paired walk went wrong when its two incomes fell in different brackets; the engine
+    # only ever passed the same income twice. Each result must equal a single-income walk.
+    brackets = SCHEDULES[name]
+    low, high = Decimal('5000'), Decimal('300000')
+    assert calculate_federal_taxes(brackets, low, high) == (
+        walk_federal_taxes(brackets, low, low)[0], walk_federal_taxes(brackets, high, high)[0]
+    )
+
+@pytest.mark.parametrize("name, income", CASES)
+def test_mtr_matches_walk(name, income):
+    brackets = SCHEDULES[name]
+    assert get_mtr(brackets, income) == walk_mtr(brackets, income)
+
+@pytest.mark.parametrize("name, income", CASES)
+def test_conversion_tax_matches_walk(name, income):
+    brackets = SCHEDULES[name]
+    for std_deduction in (Decimal('0'), Decimal('15000'), Decimal('31500.75')):
+        conv_amt = income + std_deduction
+        assert calculate_conversion_tax(conv_amt, brackets, std_deduction) == walk_conversion_tax(conv_amt, brackets, std_deduction)
+
+@pytest.mark.parametrize("name, income", CASES)
+def test_tax_on_increment_matches_walk(name, income):
+    brackets = SCHEDULES[name]
+    increment = Decimal('10000')
+    expected = walk_federal_taxes(brackets, income + increment, income + increment)[0] - walk_federal_taxes(brackets, income, income)[0]
+    assert CompiledTaxSchedule(brackets).tax_on_increment(income, increment) == expected
+
+@pytest.mark.parametrize("name", SCHEDULES)
+def test_array_lookups_match_scalar(name):
+    schedule = CompiledTaxSchedule(SCHEDULES[name])
+    incomes = incomes_for(SCHEDULES[name])
+    floats = [float(income) for income in incomes]
+
+    assert schedule.tax_array(floats).tolist() == pytest.approx([float(schedule.tax(i)) for i in incomes], abs=1e-6)
+    assert schedule.marginal_rate_array(floats).tolist() == [float(schedule.marginal_rate(i)) for i in incomes]
+    assert schedule.tax_on_increment_array(floats, [2500.0] * len(floats)).tolist() == pytest.approx(
+        [float(schedule.tax_on_increment(i, Decimal('2500'))) for i in incomes], abs=1e-6
+    )
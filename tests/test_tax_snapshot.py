@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+from decimal import Decimal
+import pytest
+from create_retire_database import SSProvisionalIncomeBrackets, SessionLocal, StandardDeductions, TaxBrackets
+from tax_snapshot import (
+    DATA_HEADER, SnapshotReader, _encode_row, ensure_snapshot, publish_snapshot, read_generation, read_snapshot
+)
+
+FILING_STATUSES = ["S", "M", "H", "unknown"]
+YEARS = [1990, 2024, 2025, 2026, 2027, 2040]
+
+def row_values(row):
+    return None if row is None else (row.year, row.filing_status) + tuple(
+        getattr(row, name) for name in ("tax_rate", "income_min", "income_max", "std_ded", "std_ded_65_add",
+                                        "ss_pct_taxed", "prov_income_min", "prov_income_max") if hasattr(row, name)
+    )
+
+@pytest.fixture
+def session(client):
+    session = SessionLocal()
+    yield session
+    session.close()
+
+def test_lookups_match_database(session, tmp_path):
+    path = str(tmp_path / "tax.snapshot")
+    snapshot = read_snapshot(path, publish_snapshot(session, path))
+
+    for filing_status in FILING_STATUSES:
+        for year in YEARS:
+            deduction = session.query(StandardDeductions).filter_by(filing_status=filing_status).filter(
+                StandardDeductions.year <= year
+            ).order_by(StandardDeductions.year.desc()).first()
+            assert row_values(snapshot.latest_standard_deduction(filing_status, year)) == row_values(deduction)
+
+            year_brackets = session.query(TaxBrackets).filter_by(year=year, filing_status=filing_status).order_by(
+                TaxBrackets.tax_rate
+            ).all()
+            assert [row_values(b) for b in snapshot.brackets_for_year(filing_status, year)] == [row_values(b) for b in year_brackets]
+
+            through = session.query(TaxBrackets).filter(
+                TaxBrackets.filing_status == filing_status, TaxBrackets.year <= year
+            ).order_by(TaxBrackets.year.desc(), TaxBrackets.tax_rate).all()
+            latest = [b for b in through if b.year == through[0].year] if through else []
+            assert [row_values(b) for b in snapshot.latest_brackets(filing_status, year)] == [row_values(b) for b in latest]
+
+            SSPI = SSProvisionalIncomeBrackets
+            ss_rows = session.query(SSPI).filter(SSPI.filing_status == filing_status, SSPI.year <= year).order_by(
+                SSPI.year.desc(), SSPI.ss_pct_taxed
+            ).all()
+            assert [row_values(b) for b in snapshot.ss_brackets_through(filing_status, year)] == [row_values(b) for b in ss_rows]
+
+def test_reader_follows_generations(session, tmp_path):
+    path = str(tmp_path / "tax.snapshot")
+    assert SnapshotReader(path).current() is None
+
+    assert ensure_snapshot(session, path) == 1
+    assert ensure_snapshot(session, path) == 1  # Already published
+    reader = SnapshotReader(path)
+    first = reader.current()
+    assert first.generation == 1
+
+    publish_snapshot(session, path)
+    second = reader.current()
+    assert second.generation == 2
+    assert row_values(second.latest_standard_deduction("S", 2026)) == row_values(first.latest_standard_deduction("S", 2026))
+
+def test_older_format_is_republished(session, tmp_path):
+    path = str(tmp_path / "tax.snapshot")
+    publish_snapshot(session, path)
+    with open(f"{path}.1", "r+b") as f:
+        f.write(b"RTAXSNP1")
+    assert ensure_snapshot(session, path) == 2
+    assert read_generation(path) == 2
+    assert len(open(f"{path}.2", "rb").read(DATA_HEADER.size)) == DATA_HEADER.size
+
+def test_long_strings_are_rejected():
+    record = SimpleNamespace(year=2026, filing_status="Married Filing Jointly", std_ded=Decimal("30000"), std_ded_65_add=Decimal("1600"))
+    with pytest.raises(ValueError, match="longer than the 8 bytes"):
+        _encode_row(StandardDeductions, record)